@@ -0,0 +1,156 @@
+"""
+Batch lip tracking over a directory or a manifest of videos.
+
+The videos are sharded across a pool of processes. Each worker loads the dlib models once and processes its
+videos one after another. For each video `<relative/path/name>.<ext>` the outputs are written to
+`<output_dir>/<relative/path/name>/`(the annotated video, the `mouth` directory or `mouth.npz` store and the
+`activation` vector).
+
+Videos whose outputs are complete are skipped, so an interrupted run can simply be restarted.
+
+Example:
+    python batch_lip_tracking.py --manifest video_path.txt --video_dir /path/to/videos --output_dir results
+"""
+
+import argparse
+import os
+import sys
+import time
+import multiprocessing
+import mouth_extraction
+import frame_sampling
+import landmark_cache
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.mpg', '.mpeg')
+
+# The per-process models(loaded once by the pool initializer).
+_detector = None
+_predictor = None
+_cache = None
+_args = None
+
+
+def list_videos(video_dir, manifest=None):
+    """List the videos to process as paths relative to `video_dir`.
+
+    Args:
+        video_dir (string): The directory of the videos.
+        manifest (string, optional): Path to a .txt file with one video per line. Same format as the speech
+            manifest("class_label subject_dir/video_file_name.ext"), the label is optional.
+    Returns:
+        The list of relative paths.
+    """
+    videos = []
+    if manifest is not None:
+        with open(manifest, 'r') as f:
+            for line in f:
+                if line.strip():
+                    videos.append(line.strip().split()[-1])
+    else:
+        for root, _, files in os.walk(video_dir):
+            for name in sorted(files):
+                if name.lower().endswith(VIDEO_EXTENSIONS):
+                    videos.append(os.path.relpath(os.path.join(root, name), video_dir))
+        videos.sort()
+    return videos
+
+
+def output_video_path(output_dir, video):
+    """The path of the annotated output video for a video(relative to the video directory)."""
+    name = os.path.splitext(video)[0]
+    return os.path.join(output_dir, name, os.path.basename(name) + '.mp4')
+
+
+def _init_worker(args):
+    global _detector, _predictor, _cache, _args
+    _detector, _predictor = mouth_extraction.load_models(args["predictor"])
+    if args["cache_dir"] is not None:
+        _cache = landmark_cache.LandmarkCache(args["cache_dir"], max_bytes=args["cache_size"] << 20)
+    _args = args
+
+
+def _process(video):
+    input_path = os.path.join(_args["video_dir"], video)
+    output_path = output_video_path(_args["output_dir"], video)
+    try:
+        # A new tracker per video, the models are shared.
+        tracker = mouth_extraction.create_tracker(_detector, _predictor, _args)
+        stats = mouth_extraction.process_video(input_path, output_path, tracker, verbose=False,
+                                               mouth_format=_args["mouth_format"],
+                                               video_output=_args["video_output"],
+                                               preview_stride=_args["preview_stride"],
+                                               preview_scale=_args["preview_scale"],
+                                               sampler=frame_sampling.create_sampler(_args),
+                                               border=_args["border"], square=_args["square"], cache=_cache,
+                                               cache_config=mouth_extraction.cache_config(_args),
+                                               predictor_path=_args["predictor"], faces=_args["faces"])
+        return video, stats, None
+    except Exception as err:
+        return video, None, '%s: %s' % (type(err).__name__, err)
+
+
+def main(args):
+    videos = list_videos(args["video_dir"], args["manifest"])
+    todo = [video for video in videos
+            if not mouth_extraction.is_complete(output_video_path(args["output_dir"], video))]
+    num_skipped = len(videos) - len(todo)
+    print('%d videos found, %d already processed.' % (len(videos), num_skipped))
+
+    num_done = 0
+    num_failed = 0
+    num_frames = 0
+    full_output_seconds_estimate = 0.0
+    cache_hits = 0
+    cache_misses = 0
+    start_time = time.time()
+    pool = multiprocessing.Pool(args["num_workers"], initializer=_init_worker, initargs=(args,))
+    try:
+        for video, stats, error in pool.imap_unordered(_process, todo):
+            if error is not None:
+                num_failed += 1
+                print('video %s failed! %s' % (video, error))
+                continue
+            num_done += 1
+            num_frames += stats['frames']
+            full_output_seconds_estimate += stats['full_output_seconds_estimate']
+            cache_hits += stats['cache_hits']
+            cache_misses += stats['cache_misses']
+            print('[%d/%d] %s: %d frames in %.2f seconds (%.2f seconds on the output video)' % (
+                num_done + num_failed, len(todo), video, stats['frames'], stats['seconds'],
+                stats['output_seconds']))
+    finally:
+        pool.close()
+        pool.join()
+
+    # Throughput summary.
+    elapsed = max(time.time() - start_time, 1e-6)
+    print('%d videos processed, %d skipped, %d failed in %.2f seconds.' % (
+        num_done, num_skipped, num_failed, elapsed))
+    print('Throughput: %.3f videos/sec, %.2f frames/sec with %d workers.' % (
+        num_done / elapsed, num_frames / elapsed, args["num_workers"]))
+    if args["cache_dir"] is not None:
+        print('Landmark cache: %d hits, %d misses(%.1f%% hit rate).' % (
+            cache_hits, cache_misses, 100.0 * cache_hits / max(cache_hits + cache_misses, 1)))
+    if args["video_output"] != 'full':
+        print('Rough estimate of the full output videos: %.2f seconds(%.2f seconds per video, from the JPEG '
+              'encoding of the frames).' % (full_output_seconds_estimate,
+                                            full_output_seconds_estimate / max(num_done, 1)))
+    return num_failed
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Batch lip tracking')
+    ap.add_argument("--video_dir", required=True,
+                    help="directory of the input videos")
+    ap.add_argument("--manifest", default=None,
+                    help="text file listing the videos relative to --video_dir(all the videos of --video_dir "
+                         "are processed otherwise)")
+    ap.add_argument("--output_dir", required=True,
+                    help="directory of the outputs")
+    ap.add_argument("-j", "--num_workers", type=int, default=multiprocessing.cpu_count(),
+                    help="number of worker processes")
+    mouth_extraction.add_tracking_arguments(ap)
+    mouth_extraction.add_output_arguments(ap)
+    frame_sampling.add_sampling_arguments(ap)
+    landmark_cache.add_cache_arguments(ap)
+    sys.exit(1 if main(vars(ap.parse_args())) else 0)
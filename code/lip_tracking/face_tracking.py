@@ -0,0 +1,189 @@
+"""
+Face localization for the lip tracker.
+
+Running the HOG frontal face detector on every frame dominates the cost of the lip tracking. For talking-head
+videos the face barely moves between two consecutive frames, so the detector is only run on keyframes and the
+shape predictor is seeded with the face box of the previous frame in between.
+
+For high resolution videos the faces are much larger than the detector needs, so the detection is performed on a
+downscaled copy of the frame and the face boxes are mapped back to the full resolution frame before running the
+shape predictor.
+"""
+
+import numpy as np
+import cv2
+import dlib
+from landmarks import shape_to_array
+
+# The smallest face(in pixels) which is found by the HOG detector without upsampling.
+DETECTOR_FACE_SIZE = 80
+
+
+def shape_center(shape):
+    """Return the center and the extent of the landmarks of a dlib shape.
+
+    Args:
+        shape: dlib full_object_detection returned by the shape predictor.
+    Returns:
+        (center, size): The (x, y) center of the landmarks and their (width, height).
+    """
+    points = shape_to_array(shape)
+    top_left = np.amin(points, axis=0)
+    bottom_right = np.amax(points, axis=0)
+    return (top_left + bottom_right) / 2.0, (bottom_right - top_left).astype(np.float64)
+
+
+def detection_scale(frame_shape, expected_face_size=0.3, upsample=1):
+    """Choose the scale of the frame which is fed to the face detector.
+
+    The frame is downscaled such that a face of the expected size is still comfortably larger than the
+    smallest face which can be found by the detector.
+
+    Args:
+        frame_shape (tuple): The shape of the frame (height, width, channels).
+        expected_face_size (float): The expected face height as a fraction of the frame height.
+        upsample (int): The number of times the frame is upsampled by the detector.
+    Returns:
+        The scale(at most 1.0) of the frame which is fed to the detector.
+    """
+    face_size = expected_face_size * frame_shape[0] * (2 ** upsample)
+    return min(1.0, 1.25 * DETECTOR_FACE_SIZE / float(face_size))
+
+
+class FaceTracker(object):
+    """Detect-then-track face localization.
+
+    The detector is called on keyframes (every `redetect_interval` frames), whenever no face is being tracked
+    and whenever the landmarks of a tracked face drift too far from the seeded box. For the other frames the
+    face box of the previous frame is moved along with the landmarks and used to seed the shape predictor.
+
+    Args:
+        detector: dlib frontal face detector.
+        predictor: dlib shape predictor.
+        redetect_interval (int): The number of frames between two forced detections. 1 runs the detector
+            on every frame(no tracking).
+        margin (float): The fraction of the face box size which is added to each side of the seeded box
+            to account for the motion between two frames.
+        drift_threshold (float): The maximum displacement(and relative scale change) of the landmarks
+            with respect to the face box before falling back to the detector.
+        upsample (int): The number of times the frame is upsampled by the detector.
+        detect_scale (float): The scale of the frame which is fed to the detector. 1.0 runs the detector
+            on the full resolution frame and 0 chooses the scale from the frame size and `expected_face_size`.
+        expected_face_size (float): The expected face height as a fraction of the frame height.
+    """
+
+    def __init__(self, detector, predictor, redetect_interval=1, margin=0.0, drift_threshold=0.2, upsample=1,
+                 detect_scale=1.0, expected_face_size=0.3):
+        self.detector = detector
+        self.predictor = predictor
+        self.redetect_interval = max(int(redetect_interval), 1)
+        self.margin = margin
+        self.drift_threshold = drift_threshold
+        self.upsample = upsample
+        self.detect_scale = detect_scale
+        self.expected_face_size = expected_face_size
+
+        # Tracked faces: (face box, offset of the box center from the landmark center, landmark extent).
+        self.tracks = []
+        self.frames_since_detection = 0
+
+        # Statistics.
+        self.num_frames = 0
+        self.num_detections = 0
+        self.num_drifts = 0
+
+    def detect(self, frame):
+        """Run the face detector on the frame and return the face rectangles in frame coordinates."""
+        self.num_detections += 1
+        if self.detect_scale <= 0:
+            # The scale is chosen once, all the frames of a video have the same size.
+            self.detect_scale = detection_scale(frame.shape, self.expected_face_size, self.upsample)
+        if self.detect_scale >= 1.0:
+            return list(self.detector(frame, self.upsample))
+
+        # Detection on the downscaled frame.
+        height, width = frame.shape[:2]
+        small = cv2.resize(frame, (max(int(width * self.detect_scale), 1), max(int(height * self.detect_scale), 1)),
+                           interpolation=cv2.INTER_AREA)
+        rects = []
+        for d in self.detector(small, self.upsample):
+            # Map the rectangle back to the full resolution.
+            rects.append(dlib.rectangle(int(round(d.left() / self.detect_scale)),
+                                        int(round(d.top() / self.detect_scale)),
+                                        int(round(d.right() / self.detect_scale)),
+                                        int(round(d.bottom() / self.detect_scale))))
+        return rects
+
+    def __call__(self, frame):
+        """Localize the faces in the frame.
+
+        Args:
+            frame: The RGB frame.
+        Returns:
+            A list of (rectangle, shape) pairs, one per face.
+        """
+        self.num_frames += 1
+        if self.tracks and self.frames_since_detection < self.redetect_interval - 1:
+            faces = self._track(frame)
+            if faces is not None:
+                self.frames_since_detection += 1
+                return faces
+            self.num_drifts += 1
+
+        return self._detect(frame)
+
+    def _detect(self, frame):
+        faces = []
+        self.tracks = []
+        for d in self.detect(frame):
+            shape = self.predictor(frame, d)
+            faces.append((d, shape))
+            self._update_track(d, shape, None)
+        self.frames_since_detection = 0
+        return faces
+
+    def _track(self, frame):
+        faces = []
+        tracks = self.tracks
+        self.tracks = []
+        for rect, offset, extent in tracks:
+            seed = self._seed_rectangle(rect)
+            shape = self.predictor(frame, seed)
+            center, size = shape_center(shape)
+
+            # Drift check: the landmarks are expected around the center of the seeded box with the same extent
+            # as in the previous frame.
+            displacement = np.abs(center + offset - self._rect_center(rect)) / float(rect.width())
+            scale_change = np.abs(size / np.maximum(extent, 1.0) - 1.0)
+            if np.amax(displacement) > self.drift_threshold or np.amax(scale_change) > self.drift_threshold:
+                return None
+
+            faces.append((rect, shape))
+            self._update_track(rect, shape, offset, center, size)
+        return faces
+
+    def _update_track(self, rect, shape, offset, center=None, size=None):
+        if center is None:
+            center, size = shape_center(shape)
+        if offset is None:
+            # The offset between the face box and the landmarks is fixed at detection time.
+            offset = self._rect_center(rect) - center
+
+        # Move the face box along with the landmarks.
+        new_center = center + offset
+        half_width = rect.width() / 2.0
+        half_height = rect.height() / 2.0
+        moved = dlib.rectangle(int(round(new_center[0] - half_width)), int(round(new_center[1] - half_height)),
+                               int(round(new_center[0] + half_width)), int(round(new_center[1] + half_height)))
+        self.tracks.append((moved, offset, size))
+
+    def _seed_rectangle(self, rect):
+        if self.margin <= 0:
+            return rect
+        dx = int(round(self.margin * rect.width()))
+        dy = int(round(self.margin * rect.height()))
+        return dlib.rectangle(rect.left() - dx, rect.top() - dy, rect.right() + dx, rect.bottom() + dy)
+
+    @staticmethod
+    def _rect_center(rect):
+        return np.array([(rect.left() + rect.right()) / 2.0, (rect.top() + rect.bottom()) / 2.0])
@@ -0,0 +1,156 @@
+"""
+Temporal sampling of the frames fed to the lip tracker.
+
+Only the frames which feed the lipread_mouth cube need to be decoded and landmarked. The policies are:
+
+    all: Every frame(up to the frame budget).
+    stride: One of `stride` frames.
+    fps: The video resampled at `target_fps`(50 f/s matches the 0.02s frame stride of the speech features), at most
+        the frame rate of the video so no frame is duplicated.
+    windows: Windows of `window` frames(9 frames = 0.3s at 30 f/s) centered on the requested timestamps.
+
+With the `windows` policy FFmpeg seeks to each window, so only the frames from the keyframe before each window are
+decoded. The `stride` and `fps` policies still decode every frame inside FFmpeg, but only the sampled frames are
+converted to RGB, sent through the pipe and landmarked.
+"""
+
+import itertools
+import numpy as np
+import skvideo.io
+
+# The frame rate assumed when it cannot be probed.
+DEFAULT_FPS = 30.0
+
+POLICIES = ('all', 'stride', 'fps', 'windows')
+
+
+def add_sampling_arguments(ap):
+    """Add the sampling arguments to an argument parser."""
+    ap.add_argument("--max_frames", type=int, default=150,
+                    help="maximum number of frames to process(0 for no limit)")
+    ap.add_argument("--sampling", type=str, default="all", choices=POLICIES,
+                    help="temporal sampling policy of the frames")
+    ap.add_argument("--stride", type=int, default=1,
+                    help="one of this many frames is processed with --sampling stride")
+    ap.add_argument("--target_fps", type=float, default=50.0,
+                    help="frame rate of the resampled video with --sampling fps(at most the frame rate of the video)")
+    ap.add_argument("--timestamps", type=str, default="",
+                    help="comma separated timestamps(seconds) of the windows with --sampling windows")
+    ap.add_argument("--window", type=int, default=9,
+                    help="number of frames of each window with --sampling windows")
+    return ap
+
+
+def create_sampler(args):
+    """Create a frame sampler from the parsed arguments(as a dictionary)."""
+    timestamps = [float(t) for t in args["timestamps"].split(',') if t.strip()]
+    return FrameSampler(policy=args["sampling"], max_frames=args["max_frames"], stride=args["stride"],
+                        target_fps=args["target_fps"], timestamps=timestamps, window=args["window"])
+
+
+class FrameSampler(object):
+    """Decode the frames of a video according to a sampling policy.
+
+    Args:
+        policy (string): One of `all`, `stride`, `fps` and `windows`.
+        max_frames (int): The maximum number of frames(0 for no limit).
+        stride (int): One of `stride` frames is decoded with the `stride` policy.
+        target_fps (float): The frame rate of the resampled video with the `fps` policy(capped at the frame rate of
+            the video).
+        timestamps (list): The centers(in seconds) of the windows with the `windows` policy.
+        window (int): The number of frames of each window.
+    """
+
+    def __init__(self, policy='all', max_frames=150, stride=1, target_fps=50.0, timestamps=(), window=9):
+        if policy not in POLICIES:
+            raise ValueError('Sampling policy [%s] was not recognized' % policy)
+        self.policy = policy
+        self.max_frames = max_frames
+        self.stride = max(int(stride), 1)
+        self.target_fps = target_fps
+        self.timestamps = list(timestamps)
+        self.window = window
+
+    def _limit(self, num_frames):
+        if self.max_frames > 0:
+            return min(num_frames, self.max_frames)
+        return num_frames
+
+    def segments(self, num_frames, fps):
+        """Plan the decoding of a video.
+
+        Args:
+            num_frames (int): The number of frames of the video.
+            fps (float): The frame rate of the video.
+        Returns:
+            A list of (inputdict, outputdict, times) where the dictionaries are the FFmpeg parameters of a reader
+            and times is the array of the timestamps of the frames it decodes.
+        """
+        duration = num_frames / float(fps)
+        if self.policy == 'all' or (self.policy == 'fps' and self.target_fps >= fps):
+            # Resampling above the frame rate of the video would only duplicate frames.
+            times = np.arange(self._limit(num_frames)) / float(fps)
+            return [({}, {}, times)]
+
+        if self.policy == 'stride':
+            count = self._limit(int(np.ceil(num_frames / float(self.stride))))
+            times = np.arange(count) * self.stride / float(fps)
+            return [({}, {'-vf': 'select=not(mod(n\\,%d))' % self.stride, '-vsync': '0', '-vframes': str(count)},
+                     times)]
+
+        if self.policy == 'fps':
+            count = self._limit(int(np.floor(duration * self.target_fps)))
+            times = np.arange(count) / float(self.target_fps)
+            return [({}, {'-r': '%g' % self.target_fps, '-vframes': str(count)}, times)]
+
+        # Windows around the timestamps(clipped to the video).
+        segments = []
+        remaining = self.max_frames if self.max_frames > 0 else None
+        for timestamp in self.timestamps:
+            start = int(round(timestamp * fps)) - self.window // 2
+            start = max(min(start, num_frames - self.window), 0)
+            count = min(self.window, num_frames - start)
+            if remaining is not None:
+                count = min(count, remaining)
+                remaining -= count
+            if count <= 0:
+                break
+            times = (start + np.arange(count)) / float(fps)
+            segments.append(({'-ss': '%.6f' % (start / float(fps))}, {'-vframes': str(count)}, times))
+        return segments
+
+    def read(self, input_path):
+        """Open a video.
+
+        Returns:
+            (video_shape, num_frames, times, frames): The shape of the video (total_num_frames, h, w, c), the
+            number of frames which will be decoded, their timestamps and a generator of the frames.
+        """
+        reader = skvideo.io.FFmpegReader(input_path, inputdict={}, outputdict={})
+        video_shape = reader.getShape()
+        fps = float(getattr(reader, 'inputfps', DEFAULT_FPS) or DEFAULT_FPS)
+        segments = self.segments(int(video_shape[0]), fps)
+        times = np.concatenate([t for _, _, t in segments]) if segments else np.zeros((0,))
+
+        if len(segments) == 1 and not segments[0][0] and not segments[0][1]:
+            # Every frame is decoded, which the probing reader already does.
+            frames = _close_after(reader, itertools.islice(reader.nextFrame(), len(times)))
+        else:
+            reader.close()
+            frames = self._frames(input_path, segments)
+        return video_shape, len(times), times, frames
+
+    @staticmethod
+    def _frames(input_path, segments):
+        for inputdict, outputdict, times in segments:
+            reader = skvideo.io.FFmpegReader(input_path, inputdict=inputdict, outputdict=outputdict)
+            for frame in _close_after(reader, itertools.islice(reader.nextFrame(), len(times))):
+                yield frame
+
+
+def _close_after(reader, frames):
+    try:
+        for frame in frames:
+            yield frame
+    finally:
+        reader.close()
@@ -0,0 +1,160 @@
+"""
+On-disk cache of the face rectangles and landmarks of each frame.
+
+The face detection and the landmark prediction are the expensive part of the lip tracking while the cropping is
+cheap. The cache stores the faces of each frame keyed by the content hash of the video, the frame index, the hash of
+the landmark model and the detection/sampling configuration, so re-running the lip tracker with different cropping
+parameters(border, square windows, output format) only re-runs the geometry.
+
+Each cache entry holds all the cached frames of a (video, model, configuration) as a single .npz file. The total size
+of the cache is bounded and the least recently used entries are evicted first.
+"""
+
+import os
+import hashlib
+import numpy as np
+
+# The (path, size, mtime) -> hash of the files which have already been hashed by this process.
+_file_hashes = {}
+
+
+def add_cache_arguments(ap):
+    """Add the cache arguments to an argument parser."""
+    ap.add_argument("--cache_dir", type=str, default=None,
+                    help="directory of the landmark cache(no cache by default)")
+    ap.add_argument("--cache_size", type=int, default=1024,
+                    help="maximum size of the landmark cache in MB")
+    return ap
+
+
+def file_hash(path, block_size=1 << 20):
+    """The SHA-1 of the content of a file(memoized by path, size and modification time)."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if memo_key not in _file_hashes:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            block = f.read(block_size)
+            while block:
+                sha.update(block)
+                block = f.read(block_size)
+        _file_hashes[memo_key] = sha.hexdigest()
+    return _file_hashes[memo_key]
+
+
+class LandmarkCache(object):
+    """Least recently used cache of the faces of the frames of videos.
+
+    Args:
+        cache_dir (string): The directory of the cache.
+        max_bytes (int): The maximum size of the cache in bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        # Statistics(in frames).
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, video_path, model_path, config):
+        """The key of the entry of a video.
+
+        Args:
+            video_path (string): Path to the video.
+            model_path (string): Path to the landmark model.
+            config (dict): The parameters which affect the faces(detection, tracking and sampling parameters).
+        """
+        sha = hashlib.sha1()
+        sha.update(file_hash(video_path).encode('utf-8'))
+        sha.update(file_hash(model_path).encode('utf-8'))
+        sha.update(repr(sorted(config.items())).encode('utf-8'))
+        return sha.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        """Load the cached frames of an entry.
+
+        Returns:
+            A dictionary frame index -> (rects, landmarks) with the (num_faces, 4) face rectangles and the
+            (num_faces, 68, 2) landmarks(empty if the entry does not exist).
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                frames, counts, rects, landmarks = data['frames'], data['counts'], data['rects'], data['landmarks']
+            # Mark the entry as recently used.
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, KeyError):
+            return {}
+
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return dict((int(frame), (rects[offsets[i]:offsets[i + 1]], landmarks[offsets[i]:offsets[i + 1]]))
+                    for i, frame in enumerate(frames))
+
+    def store(self, key, entries):
+        """Store the frames of an entry(replacing the previous content) and enforce the size limit.
+
+        The stored entry is never evicted by its own store, the least recently used other entries are. An entry
+        which alone is larger than the cache is not stored.
+
+        Args:
+            key (string): The key of the entry.
+            entries (dict): frame index -> (rects, landmarks).
+        Returns:
+            True if the entry has been stored.
+        """
+        frames = np.array(sorted(entries), dtype=np.int64)
+        counts = np.array([len(entries[frame][1]) for frame in frames], dtype=np.int64)
+        rects = [entries[frame][0] for frame in frames]
+        landmarks = [entries[frame][1] for frame in frames]
+        rects = np.concatenate(rects).astype(np.int32) if rects else np.zeros((0, 4), dtype=np.int32)
+        landmarks = np.concatenate(landmarks).astype(np.int32) if landmarks else np.zeros((0, 68, 2), np.int32)
+
+        path = self._path(key)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(f, frames=frames, counts=counts, rects=rects, landmarks=landmarks)
+        if os.path.getsize(temp_path) > self.max_bytes:
+            os.remove(temp_path)
+            return False
+        os.rename(temp_path, path)
+        self._evict(keep=os.path.basename(path))
+        return True
+
+    def _evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz') or name == keep:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        # Remove the least recently used entries until the cache fits(the kept entry counts but is not removed).
+        total = sum(size for _, size, _ in entries)
+        if keep is not None:
+            total += os.path.getsize(os.path.join(self.cache_dir, keep))
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+
+    def report(self):
+        """A summary of the cache statistics."""
+        total = self.hits + self.misses
+        return 'landmark cache: %d hits, %d misses(%.1f%% hit rate), %d evictions' % (
+            self.hits, self.misses, 100.0 * self.hits / max(total, 1), self.evictions)
@@ -0,0 +1,151 @@
+"""
+Landmark utilities.
+
+The 68 facial landmarks of dlib are handled as NumPy arrays of shape (num_faces, 68, 2) so that the mouth boxes and
+the cropping windows of all the faces of a frame are computed at once.
+"""
+
+import numpy as np
+
+NUM_LANDMARKS = 68
+
+# The 20 landmarks of the mouth.
+MOUTH_LANDMARKS = slice(48, 68)
+
+
+def shape_to_array(shape, dtype=np.int32):
+    """Convert a dlib shape to a (68, 2) array of the (x, y) coordinates of the landmarks."""
+    return np.array([(p.x, p.y) for p in shape.parts()], dtype=dtype)
+
+
+def shapes_to_array(shapes):
+    """Convert a list of dlib shapes to a (num_faces, 68, 2) array."""
+    if len(shapes) == 0:
+        return np.zeros((0, NUM_LANDMARKS, 2), dtype=np.int32)
+    return np.stack([shape_to_array(shape) for shape in shapes])
+
+
+def rects_to_array(rects):
+    """Convert a list of dlib rectangles to a (num_faces, 4) array (left, top, right, bottom)."""
+    return np.array([(d.left(), d.top(), d.right(), d.bottom()) for d in rects], dtype=np.int32).reshape((-1, 4))
+
+
+def faces_to_arrays(faces):
+    """Convert the (rectangle, shape) pairs of the face tracker to (num_faces, 4) and (num_faces, 68, 2) arrays."""
+    return rects_to_array([d for d, _ in faces]), shapes_to_array([shape for _, shape in faces])
+
+
+def mouth_boxes(landmarks):
+    """Compute the bounding boxes of the mouths.
+
+    Args:
+        landmarks: The (num_faces, 68, 2) landmarks.
+    Returns:
+        The (num_faces, 4) boxes (X_left, Y_left, X_right, Y_right).
+    """
+    mouth = landmarks[:, MOUTH_LANDMARKS, :]
+    return np.concatenate((np.amin(mouth, axis=1), np.amax(mouth, axis=1)), axis=1)
+
+
+def box_centers(boxes):
+    """The (num_faces, 2) centers of (num_faces, 4) boxes."""
+    return (boxes[:, :2] + boxes[:, 2:]) / 2.0
+
+
+def largest_face(boxes):
+    """The index of the face with the largest mouth box."""
+    return int(np.argmax(np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)))
+
+
+def crops_inside(crops, frame_shape):
+    """Whether each (num_faces, 4) cropping window lies inside a frame of the given shape."""
+    h, w = frame_shape[:2]
+    return (crops[:, 0] >= 0) & (crops[:, 1] >= 0) & (crops[:, 2] < w) & (crops[:, 3] < h)
+
+
+def match_faces(previous, current, max_distance):
+    """Match the faces of a frame to the faces of the previous frame by their nearest centers.
+
+    The closest pairs of centers are matched first, and a face is only matched to a previous face within
+    `max_distance` of it.
+
+    Args:
+        previous: The (num_previous, 2) centers of the faces of the previous frame.
+        current: The (num_faces, 2) centers of the faces of the frame.
+        max_distance: The (num_previous,) maximum distance to each previous face.
+    Returns:
+        The (num_faces,) index of the matched previous face of each face(-1 for the new faces).
+    """
+    match = np.full((current.shape[0],), -1, dtype=np.int64)
+    if previous.shape[0] == 0 or current.shape[0] == 0:
+        return match
+    distance = np.sqrt(np.sum((current[:, None, :] - previous[None, :, :]) ** 2, axis=2))
+    distance[distance > max_distance[None, :]] = np.inf
+    used = np.zeros((previous.shape[0],), dtype=bool)
+    for i, j in zip(*np.unravel_index(np.argsort(distance, axis=None, kind='mergesort'), distance.shape)):
+        if not np.isfinite(distance[i, j]):
+            break
+        if match[i] < 0 and not used[j]:
+            match[i] = j
+            used[j] = True
+    return match
+
+
+class CropWindow(object):
+    """Growing cropping windows of the mouths of a video.
+
+    For the first frame the window of a face is the mouth box with a border around it. After that, the size of the
+    window remains fixed unless a bigger window is required, in which case it grows and is held fixed again. A face
+    keeps the window of the nearest face of the previous frame(refer to `match_faces`, within the size of that
+    window), faces which appear start with a new window and the windows of the faces which disappear are dropped.
+
+    A face also keeps the track of the face it is matched to: after each frame `tracks` holds the track of each face,
+    the tracks being numbered in the order the faces appear.
+
+    Args:
+        border (int): The border around the mouth(in pixels).
+        square (bool): Use square windows(the largest of the width and height) instead of rectangles.
+    """
+
+    def __init__(self, border=30, square=False):
+        self.border = border
+        self.square = square
+        # The (width_crop_max, height_crop_max) and the mouth center of each face of the previous frame.
+        self.size = np.zeros((0, 2))
+        self.centers = np.zeros((0, 2))
+        self.tracks = np.zeros((0,), dtype=np.int64)
+        self.num_tracks = 0
+
+    def __call__(self, boxes):
+        """Update the windows with the mouth boxes of a frame.
+
+        Args:
+            boxes: The (num_faces, 4) mouth boxes (X_left, Y_left, X_right, Y_right).
+        Returns:
+            The (num_faces, 4) cropping windows (X_left_crop, Y_left_crop, X_right_crop, Y_right_crop).
+        """
+        # Width and height of the mouths(before considering the border).
+        extent = boxes[:, 2:] - boxes[:, :2]
+        centers = box_centers(boxes)
+
+        # The window sizes of the matched faces of the previous frame.
+        match = match_faces(self.centers, centers, np.amax(self.size, axis=1))
+        size = np.zeros((boxes.shape[0], 2))
+        size[match >= 0] = self.size[match[match >= 0]]
+
+        # Determine the cropping rectangle dimensions(the main purpose is to have a fixed area).
+        new = (match < 0)[:, None]
+        self.size = np.where(new, extent + 2 * self.border, size + 1.5 * np.maximum(extent - size, 0))
+        self.centers = centers
+        tracks = np.zeros((boxes.shape[0],), dtype=np.int64)
+        tracks[match >= 0] = self.tracks[match[match >= 0]]
+        tracks[match < 0] = self.num_tracks + np.arange(np.count_nonzero(match < 0))
+        self.num_tracks += int(np.count_nonzero(match < 0))
+        self.tracks = tracks
+
+        # Find the cropping points(top-left and bottom-right).
+        if self.square:
+            half = np.repeat(np.amax(self.size, axis=1, keepdims=True) / 2.0, 2, axis=1)
+        else:
+            half = self.size / 2.0
+        return np.trunc(np.concatenate((centers - half, centers + half), axis=1)).astype(np.int64)
@@ -0,0 +1,615 @@
+"""
+Mouth extraction from a video.
+
+Procedure:
+     1 - Extracting each frame.
+     2 - Detect the mouth in the frame.
+     3 - Define a boarder around the mouth.
+     4 - Crop and save the mouth.
+
+Technical considerations:
+     * - For the first frame the mouth is detected and by using a boarder the mouth is extracted and cropped.
+     * - After the first frame the size of the cropped windows remains fixed unless for the subsequent frames
+          a bigger windows is required. In such a case the windows size will be increased and it will be held
+          fixed again unless increasing the size becoming necessary again too.
+"""
+
+import os
+import pickle
+import time
+import collections
+import threading
+import multiprocessing
+import numpy as np
+import cv2
+import dlib
+import skvideo.io
+from face_tracking import FaceTracker
+from frame_sampling import FrameSampler
+from landmarks import faces_to_arrays, mouth_boxes, largest_face, crops_inside, CropWindow
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Default path of the dlib landmark model.
+PREDICTOR_PATH = 'dlib/shape_predictor_68_face_landmarks.dat'
+
+# How many frames will be processed.
+MAX_FRAMES = 150
+
+# The border around the mouth(in pixels).
+BORDER = 30
+
+# The (height, width) of the mouth images fed to the lipread_mouth network.
+MOUTH_SIZE = (60, 100)
+
+# The FFmpeg encoders of the FourCC codes accepted by --codec(other values are passed to FFmpeg as they are).
+FOURCC_ENCODERS = {'MJPG': 'mjpeg', 'XVID': 'libxvid', 'H264': 'libx264', 'X264': 'libx264', 'MP4V': 'mpeg4'}
+
+font = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def add_tracking_arguments(ap):
+    """Add the face detection and tracking arguments to an argument parser."""
+    ap.add_argument("-r", "--redetect_interval", type=int, default=1,
+                    help="number of frames between two face detections(1 runs the detector on every frame)")
+    ap.add_argument("--track_margin", type=float, default=0.0,
+                    help="fraction of the face box added to each side of the tracked box")
+    ap.add_argument("--drift_threshold", type=float, default=0.2,
+                    help="relative landmark drift which forces a new face detection")
+    ap.add_argument("--upsample", type=int, default=1,
+                    help="number of times the frame is upsampled by the face detector")
+    ap.add_argument("--detect_scale", type=float, default=1.0,
+                    help="scale of the frame fed to the face detector(0 chooses it from the frame size)")
+    ap.add_argument("--expected_face_size", type=float, default=0.3,
+                    help="expected face height as a fraction of the frame height(used when --detect_scale is 0)")
+    ap.add_argument("--predictor", type=str, default=PREDICTOR_PATH,
+                    help="path to the dlib 68 face landmarks model")
+    return ap
+
+
+def add_output_arguments(ap):
+    """Add the output arguments to an argument parser."""
+    ap.add_argument("--border", type=int, default=BORDER,
+                    help="border around the mouth in pixels")
+    ap.add_argument("--square", action="store_true",
+                    help="crop square mouth areas instead of rectangles")
+    ap.add_argument("--faces", type=str, default="all", choices=["all", "largest"],
+                    help="extract the mouth of every face(one output per face track) or of the largest face only")
+    ap.add_argument("--mouth_format", type=str, default="png", choices=["png", "npz"],
+                    help="save the mouth areas as one png per frame or as a single compressed array per video")
+    ap.add_argument("--video_output", type=str, default="full", choices=["full", "preview", "none"],
+                    help="write the full annotated video, a low-rate preview or no video at all")
+    ap.add_argument("--preview_stride", type=int, default=10,
+                    help="one of this many frames is written to the preview video")
+    ap.add_argument("--preview_scale", type=float, default=0.5,
+                    help="scale of the frames of the preview video")
+    return ap
+
+
+def load_models(predictor_path=PREDICTOR_PATH):
+    """Load the dlib face detector and the landmark predictor."""
+    detector = dlib.get_frontal_face_detector()
+    predictor = dlib.shape_predictor(predictor_path)
+    return detector, predictor
+
+
+def create_tracker(detector, predictor, args):
+    """Create a face tracker from the parsed arguments(as a dictionary)."""
+    return FaceTracker(detector, predictor, redetect_interval=args["redetect_interval"],
+                       margin=args["track_margin"], drift_threshold=args["drift_threshold"],
+                       upsample=args["upsample"], detect_scale=args["detect_scale"],
+                       expected_face_size=args["expected_face_size"])
+
+
+def cache_config(args, pipelined=False):
+    """The parameters which affect the faces found in the frames, for keying the landmark cache.
+
+    The frame budget is not part of it since it does not change the faces of the processed frames. The pipelined
+    mode and its chunk size are part of it since each chunk starts with a new tracker.
+
+    Args:
+        args (dict): The parsed arguments.
+        pipelined (bool): Whether the landmarks are extracted by the pipelined mode(refer to `LocatePool`).
+    """
+    keys = ("redetect_interval", "track_margin", "drift_threshold", "upsample", "detect_scale",
+            "expected_face_size", "sampling", "stride", "target_fps", "timestamps", "window")
+    config = dict((key, args[key]) for key in keys if key in args)
+    config["pipelined"] = pipelined
+    if pipelined:
+        config["chunk_size"] = args["chunk_size"]
+    return config
+
+
+def output_paths(output_path, track=0):
+    """Return the mouth directory and the activation file of a face track associated with an output video.
+
+    The first track keeps the `mouth` and `activation` names, the track k > 0 uses `mouth_<k>` and `activation_<k>`.
+    """
+    output_dir = os.path.dirname(output_path)
+    suffix = '_%d' % track if track else ''
+    return os.path.join(output_dir, 'mouth' + suffix), os.path.join(output_dir, 'activation' + suffix)
+
+
+def mouth_store_path(output_path, track=0):
+    """Return the path of the mouth array store of a face track associated with an output video."""
+    return output_paths(output_path, track)[0] + '.npz'
+
+
+def is_complete(output_path):
+    """Whether the outputs of a video have already been written.
+
+    The activation vector is the last output which is written, so its existence means the video is done.
+    """
+    return os.path.exists(output_paths(output_path)[1])
+
+
+def save_activation(activation, filename):
+    """Save the activation vector as a list.
+
+    The python script for loading a list:
+        with open(the_filename, 'rb') as f:
+            my_list = pickle.load(f)
+    """
+    # Write to a temporary file first so an interrupted run never leaves a partial activation file.
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as f:
+        pickle.dump(activation, f)
+    os.rename(temp_filename, filename)
+
+
+class PNGMouthWriter(object):
+    """Save each mouth area as `frame_<n>.png` in a directory.
+
+    Args:
+        mouth_dir (string): The destination directory.
+    """
+
+    def __init__(self, mouth_dir):
+        self.mouth_dir = mouth_dir
+        if not os.path.exists(mouth_dir):
+            os.makedirs(mouth_dir)
+
+    def write(self, counter, mouth_gray, box):
+        cv2.imwrite(self.mouth_dir + '/' + 'frame' + '_' + str(counter) + '.png', mouth_gray)
+
+    def close(self, activation, times=None):
+        pass
+
+
+class ArrayMouthWriter(object):
+    """Save all the mouth areas of a video in a single compressed .npz file.
+
+    The file contains:
+        mouth: (num_frames, 60, 100, 1) uint8 array of the gray mouth areas resized to the input size of the
+            lipread_mouth network(zero for the frames without a mouth).
+        activation: (num_frames,) uint8 array, one if the full mouth has been extracted and zero otherwise.
+        times: (num_frames,) float64 array of the timestamps of the frames in seconds.
+        boxes: (num_frames, 4) int32 array of the cropping windows (X_left, Y_left, X_right, Y_right) in the
+            original frame(-1 for the frames without a mouth).
+
+    The store is read by `PairWindows.from_mouth_store` in code/training_evaluation/datasets/pair_windows.py.
+
+    Args:
+        path (string): Path to the .npz file.
+        num_frames (int): The maximum number of frames.
+    """
+
+    def __init__(self, path, num_frames):
+        self.path = path
+        self.mouth = np.zeros((num_frames, MOUTH_SIZE[0], MOUTH_SIZE[1], 1), dtype=np.uint8)
+        self.boxes = np.full((num_frames, 4), -1, dtype=np.int32)
+
+    def write(self, counter, mouth_gray, box):
+        self.mouth[counter, :, :, 0] = cv2.resize(mouth_gray, (MOUTH_SIZE[1], MOUTH_SIZE[0]),
+                                                  interpolation=cv2.INTER_AREA)
+        self.boxes[counter] = box
+
+    def close(self, activation, times=None):
+        num_frames = len(activation)
+        if times is None:
+            times = np.full((num_frames,), np.nan)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez_compressed(f, mouth=self.mouth[:num_frames], activation=np.array(activation, dtype=np.uint8),
+                                times=np.asarray(times[:num_frames], dtype=np.float64),
+                                boxes=self.boxes[:num_frames])
+        os.rename(temp_path, self.path)
+
+
+def locate_landmarks(frames, tracker, cached=None):
+    """Sequentially localize the faces and their landmarks in each frame.
+
+    Args:
+        frames: An iterable of frames.
+        tracker (FaceTracker): The face tracker.
+        cached (dict, optional): frame index -> (rects, landmarks) of the frames which are already known.
+    Returns:
+        A generator of (frame, rects, landmarks) where rects is the (num_faces, 4) array of the face rectangles and
+        landmarks is the (num_faces, 68, 2) array of the landmarks.
+    """
+    for index, frame in enumerate(frames):
+        if cached is not None and index in cached:
+            rects, landmarks = cached[index]
+        else:
+            rects, landmarks = faces_to_arrays(tracker(frame))
+        yield frame, rects, landmarks
+
+
+# The per-process models and frame slots of the landmark workers(set once by the pool initializer).
+_worker_models = None
+_worker_args = None
+_worker_slots = None
+
+
+def _init_locate_worker(args, buffer, slots_shape):
+    global _worker_models, _worker_args, _worker_slots
+    _worker_models = load_models(args["predictor"])
+    _worker_args = args
+    _worker_slots = np.frombuffer(buffer, dtype=np.uint8).reshape(slots_shape)
+
+
+def _locate_chunk(slot, num_frames):
+    # The detector runs on every frame(refer to `LocatePool`), so a new tracker per chunk gives the same faces as
+    # the sequential tracker.
+    tracker = create_tracker(_worker_models[0], _worker_models[1], _worker_args)
+    faces = [faces_to_arrays(tracker(frame)) for frame in _worker_slots[slot, :num_frames]]
+    return faces, tracker.num_detections
+
+
+class LocatePool(object):
+    """A pool of processes for the landmark extraction of `locate_landmarks_parallel`.
+
+    The frames are handed to the processes through shared memory: one slot of `chunk_size` frames per chunk in
+    flight, only the slot index goes through the pipe of the pool.
+
+    The tracking state cannot cross the chunk boundaries, so the pipelined mode requires the detector to run on
+    every frame(`redetect_interval` of 1).
+
+    Args:
+        num_workers (int): The number of processes.
+        args (dict): The parsed tracking arguments(refer to `add_tracking_arguments`).
+        frame_shape (tuple): The (h, w, c) shape of the frames.
+        chunk_size (int): The number of frames sent to a process at once.
+    """
+
+    def __init__(self, num_workers, args, frame_shape, chunk_size=16):
+        if args["redetect_interval"] > 1:
+            raise ValueError('The pipelined landmark extraction requires --redetect_interval 1(got %d)' %
+                             args["redetect_interval"])
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self.num_slots = 2 * num_workers
+        slots_shape = (self.num_slots, chunk_size) + tuple(int(x) for x in frame_shape)
+        buffer = multiprocessing.RawArray('B', int(np.prod(slots_shape)))
+        self.slots = np.frombuffer(buffer, dtype=np.uint8).reshape(slots_shape)
+        self.pool = multiprocessing.Pool(num_workers, initializer=_init_locate_worker,
+                                         initargs=(args, buffer, slots_shape))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def _decode(frames, frame_queue, errors):
+    try:
+        for frame in frames:
+            frame_queue.put(frame)
+    except Exception as err:
+        errors.append(err)
+    finally:
+        frame_queue.put(None)
+
+
+def locate_landmarks_parallel(frames, pool, stats=None):
+    """Localize the facial landmarks of each frame with a pool of processes.
+
+    The frames are decoded by a separate thread and the face detection and landmark prediction fan out across
+    the pool over chunks of frames. The results are yielded in the order of the frames so they can be fed to the
+    stateful cropping step.
+
+    Args:
+        frames: An iterable of frames.
+        pool (LocatePool): The pool of processes.
+        stats (dict, optional): The number of face detections is accumulated in `stats['detections']`.
+    Returns:
+        A generator of (frame, rects, landmarks) where rects is the (num_faces, 4) array of the face rectangles and
+        landmarks is the (num_faces, 68, 2) array of the landmarks.
+    """
+    # The decoded frames waiting for being sent to the workers.
+    chunk_size = pool.chunk_size
+    frame_queue = queue.Queue(maxsize=2 * chunk_size)
+    errors = []
+    thread = threading.Thread(target=_decode, args=(frames, frame_queue, errors))
+    thread.daemon = True
+    thread.start()
+
+    # Reorder buffer: the chunks in flight in the order of submission. The workers finish them in any order but
+    # a chunk is only consumed once all the chunks before it have been consumed.
+    # There is one chunk in flight per slot of shared memory.
+    pending = collections.deque()
+    free_slots = list(range(pool.num_slots))
+    decoded = False
+    while not decoded or pending:
+        while not decoded and free_slots:
+            chunk = []
+            while len(chunk) < chunk_size:
+                frame = frame_queue.get()
+                if frame is None:
+                    decoded = True
+                    break
+                chunk.append(frame)
+            if chunk:
+                slot = free_slots.pop()
+                pool.slots[slot, :len(chunk)] = chunk
+                pending.append((slot, chunk, pool.pool.apply_async(_locate_chunk, (slot, len(chunk)))))
+
+        if pending:
+            slot, chunk, result = pending.popleft()
+            faces, num_detections = result.get()
+            free_slots.append(slot)
+            if stats is not None:
+                stats['detections'] = stats.get('detections', 0) + num_detections
+            for frame, (rects, landmarks) in zip(chunk, faces):
+                yield frame, rects, landmarks
+
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def estimate_encode_seconds(frame, repeat=3):
+    """A rough estimate of the time required to annotate and encode a frame of the output video.
+
+    A JPEG encoding of the annotated frame stands for the video encoder, the FFmpeg writer itself is not timed. The
+    value only gives the order of magnitude of the cost of the full output video.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        annotated = frame.copy()
+        cv2.putText(annotated, 'Mouth is not detectable. ', (30, 30), font, 1, (0, 0, 255), 2)
+        cv2.imencode('.jpg', annotated)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def process_video(input_path, output_path, tracker=None, max_frames=MAX_FRAMES, verbose=True, locate_args=None,
+                  num_workers=0, chunk_size=16, mouth_format='png', video_output='full', preview_stride=10,
+                  preview_scale=0.5, fps=30, codec=None, sampler=None, border=BORDER, square=False, cache=None,
+                  cache_config=None, predictor_path=PREDICTOR_PATH, faces='all'):
+    """Extract the mouth areas of each frame of a video.
+
+    The faces are followed from frame to frame by the nearest centers of their mouths(refer to `CropWindow`) and
+    the mouth of each face track is saved separately: the cropped mouth areas are saved as `frame_<n>.png` in the
+    `mouth` directory next to the output video(or in a single `mouth.npz` file with the `npz` format, refer to
+    `ArrayMouthWriter`) and the activation vector(one if the full mouth can be extracted and zero otherwise) is
+    saved as `activation` next to the output video. The first face track uses these names, the next ones
+    `mouth_<k>` and `activation_<k>`(refer to `output_paths`). With `faces='largest'` only the mouth of the largest
+    face of each frame is extracted, into the names of the first track. The output video is annotated with the
+    cropping windows.
+
+    Drawing and encoding the output video is not required for the feature extraction. With `video_output='none'`
+    no video is written and with `video_output='preview'` only one of `preview_stride` frames is written at a
+    reduced resolution.
+
+    With a landmark cache, when all the frames have already been processed(with the same video, model and
+    configuration) their faces are read from the cache and only the cropping is performed again. A partial hit is
+    recomputed as a whole since the state of the tracker after the cached frames is unknown.
+
+    The cropping window and the outputs only depend on the landmarks, so the pipelined mode(`num_workers` > 0)
+    gives the same results as the sequential mode. It requires the detector to run on every frame(refer to
+    `LocatePool`).
+
+    Args:
+        input_path (string): Path to the input video file.
+        output_path (string): Path to the output video file.
+        tracker (FaceTracker): The face tracker of the sequential mode(a new one must be used for every video).
+        max_frames (int): How many frames will be processed(when no sampler is given).
+        verbose (bool): Print the progress for each frame.
+        locate_args (dict): The parsed tracking arguments of the processes of the pipelined mode.
+        num_workers (int): The number of processes of the pipelined mode(0 for the sequential mode).
+        chunk_size (int): The number of frames sent to a worker at once in the pipelined mode.
+        mouth_format (string): `png` or `npz`.
+        video_output (string): `full`, `preview` or `none`.
+        preview_stride (int): One of this many frames is written to the preview video.
+        preview_scale (float): The scale of the frames of the preview video.
+        fps (int): The frame rate of the full output video.
+        codec (string, optional): The codec of the output video, a FourCC code of `FOURCC_ENCODERS` or an FFmpeg
+            encoder(chosen by FFmpeg from the extension of the output path by default).
+        sampler (FrameSampler, optional): The temporal sampling of the frames(every frame up to `max_frames` by
+            default).
+        border (int): The border around the mouth in pixels.
+        square (bool): Crop square mouth areas instead of rectangles.
+        cache (LandmarkCache, optional): The landmark cache.
+        cache_config (dict, optional): The configuration which keys the cache entries(refer to `cache_config`).
+        predictor_path (string): Path to the landmark model(which keys the cache entries).
+        faces (string): `all` or `largest`.
+    Returns:
+        A dictionary with the number of processed frames, face detections, face tracks, the processing time in
+        seconds, the time spent on the output video and, without the full output video, a rough estimate of the time the full
+        output video would have taken(refer to `estimate_encode_seconds`).
+    """
+    start_time = time.time()
+    stats = {'detections': 0, 'output_seconds': 0.0, 'full_output_seconds_estimate': 0.0, 'cache_hits': 0,
+             'cache_misses': 0}
+    activation_path = output_paths(output_path)[1]
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Only the sampled frames are decoded.
+    if sampler is None:
+        sampler = FrameSampler(max_frames=max_frames)
+    video_shape, num_frames, times, frames = sampler.read(input_path)
+    (total_num_frames, h, w, c) = video_shape
+    if verbose:
+        print(total_num_frames, h, w, c)
+
+    '''
+    Processing parameters.
+
+        activations: the activation vector of each face track, set to one if the full mouth can be extracted and
+            set to zero otherwise.
+        total_num_frames: Total number of frames for the video.
+        num_frames: The number of frames which are subjected to be processed.
+        times: The timestamps of the processed frames.
+        counter: The frame counter.
+    '''
+    activations = {0: []}
+    counter = 0
+
+    cached = previously_cached = {}
+    if cache is not None:
+        cache_key = cache.key(input_path, predictor_path, cache_config or {})
+        cached = previously_cached = cache.load(cache_key)
+    if not all(index in cached for index in range(num_frames)):
+        # The tracking resumes from the state of the previous frame, so all the frames are recomputed unless they are
+        # all cached.
+        cached = {}
+    pool = None
+    if num_workers > 0 and not cached and num_frames > 0:
+        pool = LocatePool(num_workers, locate_args, (h, w, c), chunk_size=chunk_size)
+        located = locate_landmarks_parallel(frames, pool, stats=stats)
+    else:
+        located = locate_landmarks(frames, tracker, cached)
+    new_faces = {}
+
+    # Define the writer
+    output_stride = 1
+    output_scale = 1.0
+    writer_outputdict = {'-vcodec': FOURCC_ENCODERS.get(codec.upper(), codec)} if codec else {}
+    if video_output == 'full':
+        writer = skvideo.io.FFmpegWriter(output_path, outputdict=writer_outputdict)
+    elif video_output == 'preview':
+        output_stride = max(int(preview_stride), 1)
+        output_scale = preview_scale
+        writer = skvideo.io.FFmpegWriter(output_path, inputdict={'-r': '%g' % (float(fps) / output_stride)},
+                                         outputdict=writer_outputdict)
+    else:
+        writer = None
+    encode_seconds = None
+
+    # Required parameters for mouth extraction.
+    crop_window = CropWindow(border=border, square=square)
+
+    def _mouth_writer(track):
+        if mouth_format == 'npz':
+            return ArrayMouthWriter(mouth_store_path(output_path, track), num_frames)
+        return PNGMouthWriter(output_paths(output_path, track)[0])
+    # The outputs of the first track are written even without any face.
+    mouth_writers = {0: _mouth_writer(0)}
+
+    # Loop over all frames.
+    for frame, rects, landmarks in located:
+        if verbose:
+            print('frame_shape:', frame.shape)
+
+        if counter in cached:
+            stats['cache_hits'] += 1
+        else:
+            stats['cache_misses'] += 1
+            new_faces[counter] = (rects, landmarks)
+
+        # If the face is detected.
+        if verbose:
+            print(len(landmarks))
+        # The (track, cropping window) of the extracted mouths.
+        extracted = []
+        message = None
+        if len(landmarks) > 0:
+            # Cropping windows of the mouths of all the faces(so each face keeps its own window).
+            boxes = mouth_boxes(landmarks)
+            crops = crop_window(boxes)
+            inside = crops_inside(crops, frame.shape)
+
+            for k in (range(len(boxes)) if faces == 'all' else [largest_face(boxes)]):
+                track = int(crop_window.tracks[k]) if faces == 'all' else 0
+                if track not in mouth_writers:
+                    mouth_writers[track] = _mouth_writer(track)
+                    activations[track] = [0] * counter
+                if inside[k]:
+                    crop = tuple(int(x) for x in crops[k])
+                    X_left_crop, Y_left_crop, X_right_crop, Y_right_crop = crop
+                    mouth = frame[Y_left_crop:Y_right_crop, X_left_crop:X_right_crop, :]
+
+                    # Save the mouth area.
+                    mouth_gray = cv2.cvtColor(mouth, cv2.COLOR_RGB2GRAY)
+                    mouth_writers[track].write(counter, mouth_gray, crop)
+                    extracted.append((track, crop))
+
+                    if verbose:
+                        print("The cropped mouth is detected ...")
+            if not extracted:
+                message = ('The full mouth is not detectable. ', (0, 255, 255))
+                if verbose:
+                    print("The full mouth is not detectable. ...")
+
+        else:
+            message = ('Mouth is not detectable. ', (0, 0, 255))
+            if verbose:
+                print("Mouth is not detectable. ...")
+        for track in activations:
+            activations[track].append(0)
+        for track, _ in extracted:
+            activations[track][counter] = 1
+
+        if video_output != 'full' and encode_seconds is None:
+            # Rough cost of a frame of the full output video.
+            encode_seconds = estimate_encode_seconds(frame)
+
+        if verbose:
+            print('frame number %d of %d' % (counter, num_frames))
+        if writer is not None and counter % output_stride == 0:
+            output_start = time.time()
+            if message is not None:
+                cv2.putText(frame, message[0], (30, 30), font, 1, message[1], 2)
+
+            for _, crop in extracted:
+                # Demonstration of face.
+                cv2.rectangle(frame, crop[:2], crop[2:], (0, 255, 0), 2)
+
+            if output_scale < 1.0:
+                frame = cv2.resize(frame, (max(int(w * output_scale), 2), max(int(h * output_scale), 2)),
+                                   interpolation=cv2.INTER_AREA)
+
+            # write the output frame to file
+            if verbose:
+                print("writing frame %d with %d mouths" % (counter + 1, len(extracted)))
+            writer.writeFrame(frame)
+            stats['output_seconds'] += time.time() - output_start
+        counter += 1
+
+    if pool is not None:
+        pool.close()
+    if writer is not None:
+        output_start = time.time()
+        writer.close()
+        stats['output_seconds'] += time.time() - output_start
+
+    # Save the mouth areas and the activation vectors, the one of the first track last(refer to `is_complete`).
+    for track in sorted(mouth_writers, reverse=True):
+        mouth_writers[track].close(activations[track], times)
+        if track:
+            save_activation(activations[track], output_paths(output_path, track)[1])
+    save_activation(activations[0], activation_path)
+
+    if cache is not None:
+        cache.hits += stats['cache_hits']
+        cache.misses += stats['cache_misses']
+        if new_faces:
+            for index in previously_cached:
+                new_faces.setdefault(index, previously_cached[index])
+            cache.store(cache_key, new_faces)
+
+    if tracker is not None:
+        stats['detections'] = tracker.num_detections
+    stats['frames'] = counter
+    stats['tracks'] = len(mouth_writers)
+    if encode_seconds is not None:
+        stats['full_output_seconds_estimate'] = encode_seconds * counter
+    stats['seconds'] = time.time() - start_time
+    return stats
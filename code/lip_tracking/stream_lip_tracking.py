@@ -0,0 +1,303 @@
+"""
+Real-time lip tracking of a live source(webcam, network stream or pipe).
+
+Unlike `VisualizeLip.py`, the source has no known length: the frames are read by a capture thread into a bounded
+buffer and processed as they come. When the processing falls behind, the oldest buffered frames are dropped so the
+memory and the latency stay bounded. For each processed frame a newline-delimited JSON record is written:
+
+    {"frame": 12, "time": 0.41, "activation": 1, "box": [x_left, y_left, x_right, y_right], "latency_ms": 35.2,
+     "faces": [{"track": 0, "activation": 1, "box": [x_left, y_left, x_right, y_right]}, ...]}
+
+where `frame` is the index of the frame in the source(the indices of the dropped frames are missing), `time` is the
+arrival time of the frame relative to the first frame and `latency_ms` is the time from the arrival of the frame to
+its record. `activation` and `box` are the ones of the largest face and `faces` holds every face with the track it
+is matched to across the frames(refer to `CropWindow`), unless `--faces largest` is given. The mouths of the first
+track are saved in `--mouth_dir`, the ones of the track k > 0 in `<mouth_dir>_<k>`. The p50/p95/p99 latencies are reported periodically and at the end of the stream.
+
+Example:
+    python stream_lip_tracking.py --input 0 --mouth_dir mouth > records.ndjson
+    ffmpeg -i rtsp://camera -f rawvideo -pix_fmt rgb24 -s 640x480 - | \
+        python stream_lip_tracking.py --input - --width 640 --height 480
+"""
+
+import argparse
+import collections
+import json
+import sys
+import threading
+import time
+import numpy as np
+import cv2
+import mouth_extraction
+from landmarks import faces_to_arrays, mouth_boxes, largest_face, crops_inside, CropWindow
+
+
+def raw_frames(stream, width, height):
+    """Read raw rgb24 frames of the given size from a binary stream until it ends."""
+    frame_size = width * height * 3
+    while True:
+        data = stream.read(frame_size)
+        if len(data) < frame_size:
+            return
+        yield np.frombuffer(data, dtype=np.uint8).reshape((height, width, 3))
+
+
+def file_frames(path, width, height):
+    """Read raw rgb24 frames of the given size from a file or a named pipe, which is closed at the end."""
+    with open(path, 'rb') as stream:
+        for frame in raw_frames(stream, width, height):
+            yield frame
+
+
+def capture_frames(capture):
+    """Read the frames of an OpenCV capture(converted to RGB) until it ends."""
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        capture.release()
+
+
+def open_source(source, width=0, height=0):
+    """Open a live source.
+
+    Args:
+        source (string): `-` for raw rgb24 frames on the standard input, a device index(e.g. `0`) or a stream URL
+            or path readable by OpenCV. A path with `width` and `height` is read as raw rgb24 frames(e.g. a named
+            pipe fed by FFmpeg).
+        width (int): The width of the raw frames.
+        height (int): The height of the raw frames.
+    Returns:
+        A generator of RGB frames.
+    """
+    if source == '-':
+        if width <= 0 or height <= 0:
+            raise ValueError('The frame size(--width and --height) is required for raw frames')
+        return raw_frames(getattr(sys.stdin, 'buffer', sys.stdin), width, height)
+    if source.isdigit():
+        return capture_frames(cv2.VideoCapture(int(source)))
+    if width > 0 and height > 0:
+        return file_frames(source, width, height)
+    return capture_frames(cv2.VideoCapture(source))
+
+
+class FrameBuffer(object):
+    """Bounded buffer between the capture thread and the processing which drops the oldest frames when full.
+
+    Args:
+        capacity (int): The maximum number of buffered frames.
+    """
+
+    def __init__(self, capacity=4):
+        self.frames = collections.deque()
+        self.capacity = max(int(capacity), 1)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if len(self.frames) >= self.capacity:
+                self.frames.popleft()
+                self.dropped += 1
+            self.frames.append(item)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def get(self):
+        """The oldest buffered item(None once the buffer is closed and empty)."""
+        with self.condition:
+            while not self.frames and not self.closed:
+                self.condition.wait()
+            if self.frames:
+                return self.frames.popleft()
+            return None
+
+
+def _capture(frames, frame_buffer, errors):
+    try:
+        for index, frame in enumerate(frames):
+            frame_buffer.put((index, time.time(), frame))
+    except Exception as err:
+        errors.append(err)
+    finally:
+        frame_buffer.close()
+
+
+class LatencyStats(object):
+    """Percentiles of the latency over the most recent frames.
+
+    Args:
+        window (int): The number of most recent latencies which are kept.
+    """
+
+    def __init__(self, window=10000):
+        self.latencies = collections.deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.latencies.append(seconds)
+        self.count += 1
+
+    def percentiles(self):
+        """The p50, p95 and p99 latencies in milliseconds(zero before the first frame)."""
+        if not self.latencies:
+            return 0.0, 0.0, 0.0
+        p50, p95, p99 = np.percentile(np.array(self.latencies), [50, 95, 99])
+        return 1000.0 * p50, 1000.0 * p95, 1000.0 * p99
+
+    def report(self):
+        return 'latency over the last %d frames: p50 %.1f ms, p95 %.1f ms, p99 %.1f ms' % (
+            (len(self.latencies),) + self.percentiles())
+
+
+def stream_mouths(frames, tracker, buffer_size=4, border=mouth_extraction.BORDER, square=False, latency=None,
+                  stats=None, faces='all'):
+    """Extract the mouth areas of the frames of a live source as they arrive.
+
+    The frames are read by a separate thread into a `FrameBuffer` of `buffer_size` frames, so a slow processing
+    drops frames rather than delaying them.
+
+    Args:
+        frames: An iterable of RGB frames(refer to `open_source`).
+        tracker (FaceTracker): The face tracker.
+        buffer_size (int): The maximum number of frames waiting for being processed.
+        border (int): The border around the mouth in pixels.
+        square (bool): Crop square mouth areas instead of rectangles.
+        latency (LatencyStats, optional): The latency of each frame is added to it.
+        stats (dict, optional): The numbers of processed and dropped frames are updated in `stats['frames']` and
+            `stats['dropped']`.
+        faces (string): `all` to extract the mouth of every face or `largest` for the largest face only.
+    Returns:
+        A generator of (record, mouths) where record is the dictionary written as a JSON line and mouths is the list
+        of the (track, mouth_gray, box) of the extracted gray mouth areas(the track is 0 with `faces='largest'`).
+    """
+    frame_buffer = FrameBuffer(buffer_size)
+    errors = []
+    thread = threading.Thread(target=_capture, args=(frames, frame_buffer, errors))
+    thread.daemon = True
+    thread.start()
+
+    crop_window = CropWindow(border=border, square=square)
+    start_time = None
+    num_frames = 0
+    while True:
+        item = frame_buffer.get()
+        if item is None:
+            break
+        index, arrival_time, frame = item
+        if start_time is None:
+            start_time = arrival_time
+
+        record = {'frame': index, 'time': round(arrival_time - start_time, 4), 'activation': 0, 'box': None}
+        if faces == 'all':
+            record['faces'] = []
+        mouths = []
+        landmarks = faces_to_arrays(tracker(frame))[1]
+        if len(landmarks) > 0:
+            boxes = mouth_boxes(landmarks)
+            crops = crop_window(boxes)
+            inside = crops_inside(crops, frame.shape)
+            largest = largest_face(boxes)
+            for k in (range(len(boxes)) if faces == 'all' else [largest]):
+                track = int(crop_window.tracks[k]) if faces == 'all' else 0
+                activation, box = 0, None
+                if inside[k]:
+                    X_left_crop, Y_left_crop, X_right_crop, Y_right_crop = [int(x) for x in crops[k]]
+                    mouth = frame[Y_left_crop:Y_right_crop, X_left_crop:X_right_crop, :]
+                    activation, box = 1, [X_left_crop, Y_left_crop, X_right_crop, Y_right_crop]
+                    mouths.append((track, cv2.cvtColor(mouth, cv2.COLOR_RGB2GRAY), box))
+                if k == largest:
+                    record['activation'], record['box'] = activation, box
+                if faces == 'all':
+                    record['faces'].append({'track': track, 'activation': activation, 'box': box})
+
+        seconds = time.time() - arrival_time
+        record['latency_ms'] = round(1000.0 * seconds, 2)
+        if latency is not None:
+            latency.add(seconds)
+        num_frames += 1
+        if stats is not None:
+            stats['frames'] = num_frames
+            stats['dropped'] = frame_buffer.dropped
+        yield record, mouths
+
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def main(args):
+    frames = open_source(args["input"], args["width"], args["height"])
+    detector, predictor = mouth_extraction.load_models(args["predictor"])
+    tracker = mouth_extraction.create_tracker(detector, predictor, args)
+    # The mouth writer of each face track, created at the first mouth of the track.
+    mouth_writers = {}
+    output = sys.stdout if args["output"] == '-' else open(args["output"], 'w')
+
+    latency = LatencyStats()
+    stats = {'frames': 0, 'dropped': 0}
+    last_report = time.time()
+    try:
+        for record, mouths in stream_mouths(frames, tracker, buffer_size=args["buffer_size"],
+                                            border=args["border"], square=args["square"], latency=latency,
+                                            stats=stats, faces=args["faces"]):
+            for track, mouth_gray, box in mouths if args["mouth_dir"] else []:
+                if track not in mouth_writers:
+                    mouth_writers[track] = mouth_extraction.PNGMouthWriter(
+                        args["mouth_dir"] + ('_%d' % track if track else ''))
+                mouth_writers[track].write(record['frame'], mouth_gray, box)
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+
+            if args["report_interval"] > 0 and time.time() - last_report >= args["report_interval"]:
+                last_report = time.time()
+                sys.stderr.write('%d frames, %d dropped, %s\n' % (stats['frames'], stats['dropped'],
+                                                                 latency.report()))
+            if 0 < args["max_frames"] <= stats['frames']:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    # The progress goes to stderr so the records can be piped.
+    sys.stderr.write('%d frames processed, %d dropped, %d face detections\n' % (
+        stats['frames'], stats['dropped'], tracker.num_detections))
+    sys.stderr.write(latency.report() + '\n')
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Real-time lip tracking')
+    ap.add_argument("-i", "--input", type=str, default="0",
+                    help="device index, stream URL or path, or - for raw rgb24 frames on the standard input")
+    ap.add_argument("--width", type=int, default=0,
+                    help="width of the raw rgb24 frames")
+    ap.add_argument("--height", type=int, default=0,
+                    help="height of the raw rgb24 frames")
+    ap.add_argument("-o", "--output", type=str, default="-",
+                    help="path of the newline-delimited JSON records(- for the standard output)")
+    ap.add_argument("--mouth_dir", type=str, default=None,
+                    help="directory where the mouth areas are saved as frame_<n>.png(not saved by default)")
+    ap.add_argument("--buffer_size", type=int, default=4,
+                    help="maximum number of frames waiting for being processed(the oldest are dropped)")
+    ap.add_argument("--max_frames", type=int, default=0,
+                    help="stop after this many processed frames(0 for no limit)")
+    ap.add_argument("--report_interval", type=float, default=5.0,
+                    help="seconds between two latency reports on the standard error(0 to disable)")
+    ap.add_argument("--border", type=int, default=mouth_extraction.BORDER,
+                    help="border around the mouth in pixels")
+    ap.add_argument("--square", action="store_true",
+                    help="crop square mouth areas instead of rectangles")
+    ap.add_argument("--faces", type=str, default="all", choices=["all", "largest"],
+                    help="extract the mouth of every face(one directory per face track) or of the largest face only")
+    mouth_extraction.add_tracking_arguments(ap)
+    main(vars(ap.parse_args()))
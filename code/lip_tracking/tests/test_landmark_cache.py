@@ -0,0 +1,84 @@
+"""
+Tests of the size limit of the landmark cache.
+
+Run from code/lip_tracking:
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from landmark_cache import LandmarkCache
+
+
+def _entries(num_frames, seed=0):
+    rng = np.random.RandomState(seed)
+    return dict((frame, (rng.randint(0, 640, (1, 4)), rng.randint(0, 640, (1, 68, 2))))
+                for frame in range(num_frames))
+
+
+class LandmarkCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def _size(self, num_frames):
+        cache = LandmarkCache(tempfile.mkdtemp())
+        try:
+            cache.store('entry', _entries(num_frames))
+            return os.path.getsize(cache._path('entry'))
+        finally:
+            shutil.rmtree(cache.cache_dir)
+
+    def test_round_trip(self):
+        cache = LandmarkCache(self.cache_dir)
+        entries = _entries(5)
+        self.assertTrue(cache.store('entry', entries))
+        loaded = cache.load('entry')
+        self.assertEqual(sorted(loaded), sorted(entries))
+        for frame in entries:
+            np.testing.assert_array_equal(loaded[frame][0], entries[frame][0])
+            np.testing.assert_array_equal(loaded[frame][1], entries[frame][1])
+        self.assertEqual(cache.load('missing'), {})
+
+    def test_store_evicts_the_least_recently_used_other_entries(self):
+        size = self._size(50)
+        cache = LandmarkCache(self.cache_dir, max_bytes=int(2.5 * size))
+        for i, key in enumerate(('a', 'b', 'c')):
+            self.assertTrue(cache.store(key, _entries(50, seed=i)))
+            # Distinct modification times.
+            os.utime(cache._path(key), (time.time() - 100 + i, time.time() - 100 + i))
+        self.assertFalse(os.path.exists(cache._path('a')))
+        self.assertTrue(os.path.exists(cache._path('b')))
+        self.assertTrue(os.path.exists(cache._path('c')))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_just_stored_entry_is_kept(self):
+        size = self._size(50)
+        cache = LandmarkCache(self.cache_dir, max_bytes=int(1.5 * size))
+        cache.store('old', _entries(50, seed=1))
+        # The new entry is the most recent one, even with a modification time older than the others.
+        os.utime(cache._path('old'), (time.time() + 100, time.time() + 100))
+        self.assertTrue(cache.store('new', _entries(50, seed=2)))
+        self.assertTrue(os.path.exists(cache._path('new')))
+        self.assertFalse(os.path.exists(cache._path('old')))
+
+    def test_entry_larger_than_the_cache_is_not_stored(self):
+        cache = LandmarkCache(self.cache_dir, max_bytes=self._size(50))
+        cache.store('small', _entries(10))
+        self.assertFalse(cache.store('large', _entries(500)))
+        self.assertEqual(cache.load('large'), {})
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['small.npz'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+Tests of the landmark utilities.
+
+Run from code/lip_tracking:
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from landmarks import (CropWindow, crops_inside, largest_face, match_faces, mouth_boxes, shapes_to_array,
+                       NUM_LANDMARKS)
+
+
+class _Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class _Shape(object):
+    # The interface of a dlib full_object_detection.
+    def __init__(self, points):
+        self.points = [_Point(int(x), int(y)) for x, y in points]
+
+    def part(self, i):
+        return self.points[i]
+
+    def parts(self):
+        return self.points
+
+
+def legacy_mouth_box(shape):
+    """The per-landmark loop of the former VisualizeLip.py."""
+    marks = np.zeros((2, 20))
+    co = 0
+    for ii in range(48, 68):
+        X = shape.part(ii)
+        marks[0, co] = X.x
+        marks[1, co] = X.y
+        co += 1
+    return [int(np.amin(marks, axis=1)[0]), int(np.amin(marks, axis=1)[1]), int(np.amax(marks, axis=1)[0]),
+            int(np.amax(marks, axis=1)[1])]
+
+
+def legacy_crops(boxes, border=30):
+    """The growing window of the former VisualizeLip.py for a single face over the frames."""
+    width_crop_max = 0
+    height_crop_max = 0
+    crops = []
+    for X_left, Y_left, X_right, Y_right in boxes:
+        X_center = (X_left + X_right) / 2.0
+        Y_center = (Y_left + Y_right) / 2.0
+        width_new = X_right - X_left + 2 * border
+        height_new = Y_right - Y_left + 2 * border
+        width_current = X_right - X_left
+        height_current = Y_right - Y_left
+        if width_crop_max == 0 and height_crop_max == 0:
+            width_crop_max = width_new
+            height_crop_max = height_new
+        else:
+            width_crop_max += 1.5 * np.maximum(width_current - width_crop_max, 0)
+            height_crop_max += 1.5 * np.maximum(height_current - height_crop_max, 0)
+        crops.append([int(X_center - width_crop_max / 2.0), int(Y_center - height_crop_max / 2.0),
+                      int(X_center + width_crop_max / 2.0), int(Y_center + height_crop_max / 2.0)])
+    return crops
+
+
+class MouthBoxesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def test_matches_the_per_landmark_loop(self):
+        shapes = [_Shape(self.rng.randint(0, 640, (NUM_LANDMARKS, 2))) for _ in range(5)]
+        landmarks = shapes_to_array(shapes)
+        self.assertEqual(landmarks.shape, (5, NUM_LANDMARKS, 2))
+        self.assertEqual(mouth_boxes(landmarks).tolist(), [legacy_mouth_box(shape) for shape in shapes])
+
+    def test_no_face(self):
+        landmarks = shapes_to_array([])
+        self.assertEqual(mouth_boxes(landmarks).shape, (0, 4))
+
+    def test_largest_face(self):
+        boxes = np.array([[0, 0, 10, 10], [0, 0, 30, 5], [5, 5, 16, 16]])
+        # Areas of 100, 150 and 121.
+        self.assertEqual(largest_face(boxes), 1)
+
+    def test_crops_inside(self):
+        crops = np.array([[0, 0, 99, 49], [-1, 0, 10, 10], [0, 0, 100, 10], [0, 0, 10, 50]])
+        self.assertEqual(crops_inside(crops, (50, 100, 3)).tolist(), [True, False, False, False])
+
+
+class CropWindowTest(unittest.TestCase):
+
+    def _boxes(self, num_frames, offset=(0, 0)):
+        rng = np.random.RandomState(1)
+        centers = np.array([200, 150]) + np.array(offset) + np.cumsum(rng.randint(-3, 4, (num_frames, 2)), axis=0)
+        half = rng.randint(15, 40, (num_frames, 2))
+        return np.concatenate((centers - half, centers + half), axis=1)
+
+    def test_single_face_matches_the_former_loop(self):
+        boxes = self._boxes(30)
+        crop_window = CropWindow(border=30)
+        crops = [crop_window(box[None])[0].tolist() for box in boxes]
+        self.assertEqual(crops, legacy_crops(boxes.tolist(), border=30))
+        self.assertEqual(crop_window.num_tracks, 1)
+
+    def test_square(self):
+        crop_window = CropWindow(border=5, square=True)
+        crop = crop_window(np.array([[10, 20, 30, 60]]))[0]
+        self.assertEqual(crop[2] - crop[0], crop[3] - crop[1])
+
+    def test_each_face_keeps_its_window_and_track(self):
+        first = self._boxes(10)
+        second = self._boxes(10, offset=(300, 0))
+        crop_window = CropWindow(border=10)
+        alone = CropWindow(border=10)
+        for i in range(10):
+            # The second face appears at the third frame, the order of the faces changes from frame to frame.
+            boxes = [first[i]] + ([second[i]] if i >= 2 else [])
+            order = [1, 0] if i % 2 and len(boxes) == 2 else list(range(len(boxes)))
+            crops = crop_window(np.array([boxes[k] for k in order]))
+            tracks = crop_window.tracks.tolist()
+            self.assertEqual(tracks, [[0, 1][k] for k in order])
+            self.assertEqual(crops[order.index(0)].tolist(), alone(first[i][None])[0].tolist())
+        self.assertEqual(crop_window.num_tracks, 2)
+
+    def test_reappearing_face_starts_a_new_track(self):
+        crop_window = CropWindow(border=10)
+        box = np.array([[100, 100, 140, 120]])
+        crop_window(box)
+        crop_window(np.zeros((0, 4)))
+        self.assertEqual(crop_window.tracks.tolist(), [])
+        crop_window(box)
+        self.assertEqual(crop_window.tracks.tolist(), [1])
+
+
+class MatchFacesTest(unittest.TestCase):
+
+    def test_nearest_centers(self):
+        previous = np.array([[0., 0.], [100., 0.]])
+        current = np.array([[98., 3.], [200., 0.], [2., 1.]])
+        self.assertEqual(match_faces(previous, current, np.array([50., 50.])).tolist(), [1, -1, 0])
+
+    def test_closest_pairs_first(self):
+        previous = np.array([[0., 0.]])
+        current = np.array([[5., 0.], [1., 0.]])
+        self.assertEqual(match_faces(previous, current, np.array([50.])).tolist(), [-1, 0])
+
+    def test_max_distance(self):
+        previous = np.array([[0., 0.], [100., 0.]])
+        current = np.array([[30., 0.]])
+        self.assertEqual(match_faces(previous, current, np.array([20., 80.])).tolist(), [1])
+        self.assertEqual(match_faces(previous, current, np.array([20., 20.])).tolist(), [-1])
+
+    def test_empty(self):
+        self.assertEqual(match_faces(np.zeros((0, 2)), np.ones((2, 2)), np.zeros((0,))).tolist(), [-1, -1])
+        self.assertEqual(match_faces(np.ones((2, 2)), np.zeros((0, 2)), np.ones((2,))).tolist(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
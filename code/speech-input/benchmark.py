@@ -0,0 +1,206 @@
+"""
+Per-sample latency of the speech feature extraction.
+
+Compares the former `AudioDataset.__getitem__` path(the wav file decoded twice, a discarded framing and power
+spectrum, then `speechpy.feature.lmfe` framing the signal again) with the single-read, single-FFT path of
+`input_feature.extract_features`, and checks that both give the same log-energies.
+
+The speech cubes of a batch are also computed with the per-item pipeline(`CMVN`, `Extract_Derivative` and
+`Feature_Cube`) and with `AudioDataset.get_batch`, and the composed transforms are compared with `Fused_Cube`.
+
+Finally an epoch of batches is computed with each dtype policy of `AudioDataset`, without and with the feature
+cache, to compare the throughput, the peak memory allocated by the batches and the size of the cached features. On
+Python 2, which has no tracemalloc, the peak resident memory of the process is reported instead.
+
+Example:
+    python benchmark.py --file_path file_path.txt --audio_dir Audio --repeat 50 --batch_size 64
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import scipy.io.wavfile as wav
+import soundfile as sf
+import speechpy
+import input_feature
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2: the peak resident memory of the process is reported instead.
+    import resource
+    tracemalloc = None
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def legacy_features(sound_file_path, num_coefficient=40):
+    """The feature extraction of `AudioDataset.__getitem__` before the single-read path."""
+    fs, signal = wav.read(sound_file_path)
+    signal, fs = sf.read(sound_file_path)
+    frames = speechpy.processing.stack_frames(signal, sampling_frequency=fs, frame_length=0.02, frame_stride=0.02,
+                                              zero_padding=True)
+    power_spectrum = speechpy.processing.power_spectrum(frames, fft_points=2 * num_coefficient)[:, 1:]
+    return speechpy.feature.lmfe(signal, sampling_frequency=fs, frame_length=0.02, frame_stride=0.02,
+                                 num_filters=num_coefficient, fft_length=1024, low_frequency=0, high_frequency=None)
+
+
+def features(sound_file_path, num_coefficient=40):
+    """The feature extraction of `AudioDataset.__getitem__`."""
+    signal, fs = sf.read(sound_file_path)
+    return input_feature.extract_features(signal, fs, outputs=('logenergy',), num_coefficient=num_coefficient,
+                                          frame_length=0.02, frame_stride=0.02, fft_length=1024, low_frequency=0,
+                                          high_frequency=None)['logenergy']
+
+
+def item_cubes(dataset, indices, num_frames=15):
+    """The speech cubes of a batch computed one file at a time(zero-padded like `AudioDataset.get_batch`)."""
+    cubes = np.zeros((len(indices), num_frames, dataset.params['num_coefficient'], 1, 3))
+    for i, idx in enumerate(indices):
+        feature, _ = dataset[idx]
+        cubes[i, :feature.shape[1], :, 0, :] = feature[0]
+    return cubes
+
+
+def best_of(function, repeat):
+    """The shortest of `repeat` runs of a function in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        start_time = time.time()
+        function()
+        durations.append(1000.0 * (time.time() - start_time))
+    return min(durations)
+
+
+def time_per_sample(function, paths, repeat):
+    """The per-sample latencies in milliseconds of `repeat` passes over the files."""
+    latencies = []
+    for _ in range(repeat):
+        for path in paths:
+            start_time = time.time()
+            function(path)
+            latencies.append(1000.0 * (time.time() - start_time))
+    return np.array(latencies)
+
+
+def epoch(dataset, indices, batch_size):
+    """Compute the batches of an epoch.
+
+    Returns:
+        (seconds, peak_bytes): The duration of the epoch and the peak memory allocated by a batch(the peak resident
+        memory of the process so far on Python 2).
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start_time = time.time()
+    for start in range(0, len(indices), batch_size):
+        dataset.get_batch(indices[start:start + batch_size])
+    seconds = time.time() - start_time
+    if tracemalloc is None:
+        # ru_maxrss is in kilobytes on Linux.
+        return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak_bytes
+
+
+def directory_size(directory):
+    """The total size of the files of a directory in bytes."""
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+class _Silence(object):
+    # Some speechpy versions print from stack_frames, which would flood the report.
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Speech feature extraction benchmark')
+    parser.add_argument('--file_path', default=os.path.join(DIRECTORY, 'file_path.txt'),
+                        help='The file names("class_label subject_dir/sound_file_name.ext" per line)')
+    parser.add_argument('--audio_dir', default=os.path.join(DIRECTORY, 'Audio'),
+                        help='Location of sound files')
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='Number of passes over the files')
+    parser.add_argument('--batch_size', type=int, default=64,
+                        help='Number of files of the batch(the files are repeated if there are fewer)')
+    parser.add_argument('--epoch_size', type=int, default=1024,
+                        help='Number of samples of the epoch(the files are repeated if there are fewer)')
+    args = parser.parse_args()
+
+    with open(args.file_path, 'r') as f:
+        paths = [os.path.join(args.audio_dir, line.strip().split()[1]) for line in f if line.strip()]
+
+    # Warm up(file cache, filterbanks) and check the equivalence.
+    with _Silence():
+        reference = [legacy_features(path) for path in paths]
+    max_difference = max(np.amax(np.abs(a - features(path))) for a, path in zip(reference, paths))
+
+    with _Silence():
+        before = time_per_sample(legacy_features, paths, args.repeat)
+    after = time_per_sample(features, paths, args.repeat)
+
+    print('%d files, %d passes, max absolute difference of the features: %g' % (
+        len(paths), args.repeat, max_difference))
+    for name, latencies in (('before', before), ('after', after)):
+        print('%-6s: mean %.3f ms, median %.3f ms, p95 %.3f ms per sample' % (
+            name, np.mean(latencies), np.median(latencies), np.percentile(latencies, 95)))
+    print('speedup: %.2fx(median)' % (np.median(before) / np.median(after)))
+
+    # Per-item pipeline versus batch API.
+    dataset = input_feature.AudioDataset(args.file_path, args.audio_dir, dtype_policy='float64',
+                                         transform=input_feature.Compose([
+                                             input_feature.CMVN(), input_feature.Extract_Derivative(),
+                                             input_feature.Feature_Cube(cube_shape=(15, 40, 3)),
+                                             input_feature.ToOutput()]))
+    indices = [i % len(dataset) for i in range(args.batch_size)]
+    reference = item_cubes(dataset, indices)
+    repeat = max(args.repeat // 10, 3)
+    loop_ms = best_of(lambda: item_cubes(dataset, indices), repeat)
+    print('batch of %d: per-item loop %.2f ms' % (len(indices), loop_ms))
+    for dtype in (np.float64, np.float32):
+        cubes, _ = dataset.get_batch(indices, dtype=dtype)
+        batch_ms = best_of(lambda: dataset.get_batch(indices, dtype=dtype), repeat)
+        print('batch of %d: get_batch(%s) %.2f ms, %.2fx, max absolute difference %g' % (
+            len(indices), np.dtype(dtype).name, batch_ms, loop_ms / batch_ms, np.amax(np.abs(cubes - reference))))
+
+    # Composed versus fused transforms on the features of the first file.
+    sample = {'feature': features(paths[0]), 'label': 0}
+    composed = input_feature.Compose([input_feature.CMVN(), input_feature.Extract_Derivative(),
+                                      input_feature.Feature_Cube(cube_shape=(15, 40, 3)), input_feature.ToOutput()])
+    fused = input_feature.Fused_Cube(cube_shape=(15, 40, 3), dtype=np.float64)
+    difference = np.amax(np.abs(composed(sample)[0] - fused(sample)[0]))
+    for name, transform in (('composed', composed), ('fused', fused)):
+        transform_ms = best_of(lambda: [transform(sample) for _ in range(100)], repeat) / 100
+        print('transforms: %-8s %.1f us per sample' % (name, 1000.0 * transform_ms))
+    print('transforms: max absolute difference %g' % difference)
+
+    # A full epoch with each dtype policy.
+    indices = [i % len(dataset) for i in range(args.epoch_size)]
+    for policy in ('float64', 'float32', 'float16'):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            dataset = input_feature.AudioDataset(args.file_path, args.audio_dir, dtype_policy=policy)
+            seconds, peak_bytes = epoch(dataset, indices, args.batch_size)
+            dataset = input_feature.AudioDataset(args.file_path, args.audio_dir, dtype_policy=policy,
+                                                 cache_dir=cache_dir)
+            epoch(dataset, indices, args.batch_size)
+            cached_seconds, cached_peak_bytes = epoch(dataset, indices, args.batch_size)
+            peak = 'peak' if tracemalloc is not None else 'process peak'
+            print('epoch of %d(%s): %.0f samples/sec, %s %.1f MB; cached: %.0f samples/sec, %s %.1f MB, '
+                  '%.1f KB per file on disk' % (
+                      len(indices), policy, len(indices) / seconds, peak, peak_bytes / 1e6,
+                      len(indices) / cached_seconds, peak, cached_peak_bytes / 1e6,
+                      directory_size(cache_dir) / 1e3 / len(dataset)))
+        finally:
+            shutil.rmtree(cache_dir)
@@ -0,0 +1,225 @@
+"""
+Per-stage benchmark of the speech feature extraction.
+
+Synthetic sound files of several durations and sampling frequencies are generated, then each stage of
+`AudioDataset.__getitem__` is timed separately:
+
+    decode       soundfile decoding(in the data type of the dtype policy)
+    framing      `frame_signal`
+    fft          `power_spectrum`
+    filterbank   `log_filterbank_energies`
+    cmvn         the `CMVN` transform
+    derivative   the `Extract_Derivative` transform
+    cube         the `Feature_Cube` and `ToOutput` transforms
+    fused        the `Fused_Cube` transform(the alternative of the three previous stages)
+    getitem      the whole `AudioDataset.__getitem__` with the composed transforms
+
+The latencies and the throughput in utterances/sec are printed and saved as JSON with the commit and the versions
+of the libraries, so the results of two commits can be compared with `--compare`. Everything runs offline on the
+CPU.
+
+Example:
+    python benchmark_stages.py --output stages.json
+    python benchmark_stages.py --output stages_new.json --compare stages.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+import numpy as np
+import scipy
+import soundfile as sf
+import input_feature
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+STAGES = ('decode', 'framing', 'fft', 'filterbank', 'cmvn', 'derivative', 'cube', 'fused', 'getitem')
+
+
+def synthetic_speech(duration, fs, seed=0):
+    """A speech-like signal: harmonics of a varying pitch modulated at the syllable rate, plus noise.
+
+    Returns:
+        The (duration * fs,) signal in [-1, 1].
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(duration * fs)) / float(fs)
+    pitch = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / fs
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 10))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t))
+    signal = envelope * voiced + 0.05 * rng.standard_normal(t.shape)
+    return 0.9 * signal / np.amax(np.abs(signal))
+
+
+def generate_sound_files(directory, durations, sampling_frequencies):
+    """Write the 16-bit synthetic sound files and their manifest.
+
+    Returns:
+        (manifest_path, entries) where entries is the list of (duration, fs) of the files in the manifest order.
+    """
+    entries = []
+    with open(os.path.join(directory, 'file_path.txt'), 'w') as f:
+        for fs in sampling_frequencies:
+            for duration in durations:
+                name = 'synthetic_%d_%gs.wav' % (fs, duration)
+                sf.write(os.path.join(directory, name), synthetic_speech(duration, fs), fs, subtype='PCM_16')
+                f.write('%d %s\n' % (len(entries) % 2, name))
+                entries.append((duration, fs))
+    return os.path.join(directory, 'file_path.txt'), entries
+
+
+def measure(function, repeat):
+    """The latencies in milliseconds of `repeat` calls of a function(after a warm-up call)."""
+    function()
+    latencies = np.empty((repeat,))
+    for i in range(repeat):
+        start_time = timeit.default_timer()
+        function()
+        latencies[i] = 1000.0 * (timeit.default_timer() - start_time)
+    return latencies
+
+
+def stage_functions(dataset, idx):
+    """The function of each stage of `AudioDataset.__getitem__` for a file, each one computed from the output of
+    the previous stages."""
+    path = dataset.sound_file_path(idx)
+    params = dataset.params
+    signal, fs = dataset.read_signal(path)
+    frames = input_feature.frame_signal(signal, fs, params['frame_length'], params['frame_stride'])
+    spectrum = input_feature.power_spectrum(frames, params['fft_length'])
+    logenergy = input_feature.log_filterbank_energies(spectrum, fs, params['num_coefficient'],
+                                                      params['low_frequency'], params['high_frequency'])
+    sample = {'feature': logenergy, 'label': 0}
+    cmvn, derivative, cube = input_feature.CMVN(), input_feature.Extract_Derivative(), input_feature.Compose([
+        input_feature.Feature_Cube(cube_shape=(15, params['num_coefficient'], 3)), input_feature.ToOutput()])
+    normalized = cmvn(sample)
+    derived = derivative(normalized)
+    fused = input_feature.Fused_Cube(cube_shape=(15, params['num_coefficient'], 3), dtype=dataset.dtype)
+    return {'decode': lambda: dataset.read_signal(path),
+            'framing': lambda: input_feature.frame_signal(signal, fs, params['frame_length'],
+                                                          params['frame_stride']),
+            'fft': lambda: input_feature.power_spectrum(frames, params['fft_length']),
+            'filterbank': lambda: input_feature.log_filterbank_energies(spectrum, fs, params['num_coefficient'],
+                                                                        params['low_frequency'],
+                                                                        params['high_frequency']),
+            'cmvn': lambda: cmvn(sample),
+            'derivative': lambda: derivative(normalized),
+            'cube': lambda: cube(derived),
+            'fused': lambda: fused(sample),
+            'getitem': lambda: dataset[idx]}
+
+
+def run(audio_dir, manifest_path, entries, repeat, dtype_policy):
+    """Time the stages on each file.
+
+    Returns:
+        The list of the results, one dictionary per file and stage.
+    """
+    dataset = input_feature.AudioDataset(manifest_path, audio_dir, dtype_policy=dtype_policy,
+                                         transform=input_feature.Compose([
+                                             input_feature.CMVN(), input_feature.Extract_Derivative(),
+                                             input_feature.Feature_Cube(cube_shape=(15, 40, 3)),
+                                             input_feature.ToOutput()]))
+    results = []
+    for idx, (duration, fs) in enumerate(entries):
+        functions = stage_functions(dataset, idx)
+        for stage in STAGES:
+            latencies = measure(functions[stage], repeat)
+            results.append({'stage': stage, 'duration': duration, 'sampling_frequency': fs,
+                            'mean_ms': float(np.mean(latencies)), 'median_ms': float(np.median(latencies)),
+                            'p95_ms': float(np.percentile(latencies, 95)),
+                            'utterances_per_sec': float(1000.0 / np.mean(latencies))})
+    return results
+
+
+def git_commit():
+    """The commit of the working tree(None outside of a git repository)."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=DIRECTORY,
+                                           stderr=devnull).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """The description of the benchmark environment saved with the results."""
+    return {'commit': git_commit(), 'date': datetime.datetime.now().isoformat(), 'platform': platform.platform(),
+            'processor': platform.processor(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'scipy': scipy.__version__, 'soundfile': sf.__version__}
+
+
+def report(results):
+    print('%-10s %6s %8s %10s %10s %10s %12s' % ('stage', 'fs', 'duration', 'mean ms', 'median ms', 'p95 ms',
+                                                 'utt/sec'))
+    for result in results:
+        print('%-10s %6d %7gs %10.3f %10.3f %10.3f %12.1f' % (
+            result['stage'], result['sampling_frequency'], result['duration'], result['mean_ms'],
+            result['median_ms'], result['p95_ms'], result['utterances_per_sec']))
+
+
+def compare(results, baseline, threshold):
+    """Print the median latencies relative to a baseline.
+
+    Returns:
+        The number of stages which are slower than the baseline by more than `threshold`(a fraction).
+    """
+    previous = dict(((r['stage'], r['sampling_frequency'], r['duration']), r) for r in baseline['results'])
+    num_regressions = 0
+    print('compared with commit %s:' % baseline['environment'].get('commit'))
+    for result in results:
+        key = (result['stage'], result['sampling_frequency'], result['duration'])
+        if key not in previous:
+            continue
+        ratio = result['median_ms'] / max(previous[key]['median_ms'], 1e-9)
+        flag = ''
+        if ratio > 1 + threshold:
+            num_regressions += 1
+            flag = '  REGRESSION'
+        print('%-10s %6d %7gs %10.3f -> %10.3f ms(%.2fx)%s' % (key + (previous[key]['median_ms'],
+                                                                     result['median_ms'], ratio, flag)))
+    return num_regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-stage speech feature extraction benchmark')
+    parser.add_argument('--durations', type=float, nargs='+', default=[1, 3, 10],
+                        help='Durations of the synthetic sound files in seconds')
+    parser.add_argument('--sampling_frequencies', type=int, nargs='+', default=[8000, 16000, 44100],
+                        help='Sampling frequencies of the synthetic sound files')
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='Number of timed runs of each stage')
+    parser.add_argument('--dtype_policy', default='float32', choices=sorted(input_feature.DTYPE_POLICIES),
+                        help='Dtype policy of the dataset(refer to AudioDataset)')
+    parser.add_argument('--output', default=None,
+                        help='Path of the JSON results(not saved by default)')
+    parser.add_argument('--compare', default=None,
+                        help='Path of JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slowdown of the median latency reported as a regression')
+    args = parser.parse_args()
+
+    audio_dir = tempfile.mkdtemp()
+    try:
+        manifest_path, entries = generate_sound_files(audio_dir, args.durations, args.sampling_frequencies)
+        results = run(audio_dir, manifest_path, entries, args.repeat, args.dtype_policy)
+    finally:
+        shutil.rmtree(audio_dir)
+
+    report(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'dtype_policy': args.dtype_policy, 'repeat': args.repeat,
+                       'results': results}, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            num_regressions = compare(results, json.load(f), args.threshold)
+        sys.exit(1 if num_regressions else 0)
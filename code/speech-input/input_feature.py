@@ -1,16 +1,584 @@
 import os
-from scipy.io.wavfile import read
 import scipy.io.wavfile as wav
-import subprocess as sp
 import numpy as np
 import argparse
-import random
-import os
 import sys
-from random import shuffle
+import array
+import hashlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import speechpy
+import soundfile as sf
 import datetime
 
+try:
+    # Single precision transforms(numpy.fft computes in double precision). Before scipy 1.4, `scipy.fft` is a
+    # function rather than this module.
+    import scipy.fft as fft
+except ImportError:
+    from numpy import fft
+
+
+# The features which can be computed from a single framing/FFT pass(refer to `extract_features`).
+FEATURES = ('logenergy', 'power_spectrum', 'derivative')
+
+# The default parameters of the feature extraction(refer to `extract_features`).
+FEATURE_PARAMS = {'num_coefficient': 40, 'frame_length': 0.02, 'frame_stride': 0.02, 'fft_length': 1024,
+                  'low_frequency': 0, 'high_frequency': None}
+
+# The dtype policies of `AudioDataset`: the data type of the decoding, the features and the batches, and the data
+# type of the cached features on disk.
+DTYPE_POLICIES = {'float64': (np.float64, np.float64),
+                  'float32': (np.float32, np.float32),
+                  'float16': (np.float32, np.float16)}
+
+# The Mel filterbanks which have already been computed, keyed by their parameters.
+_filterbanks = {}
+
+
+def mel_filterbanks(num_filters, coefficients, fs, low_frequency=0, high_frequency=None, dtype=np.float64):
+    """The Mel filterbanks of `speechpy.feature.filterbanks`, computed once per set of parameters."""
+    high_frequency = high_frequency or fs / 2
+    key = (num_filters, coefficients, fs, low_frequency, high_frequency, np.dtype(dtype).name)
+    if key not in _filterbanks:
+        _filterbanks[key] = speechpy.feature.filterbanks(num_filters, coefficients, fs, low_frequency,
+                                                         high_frequency).astype(dtype)
+    return _filterbanks[key]
+
+
+def compute_dtype(dtype):
+    """The data type in which features of the given data type are computed(half precision is only a storage
+    format)."""
+    return np.promote_types(dtype, np.float32)
+
+
+def frame_sizes(fs, frame_length=0.02, frame_stride=0.02):
+    """The (frame_sample_length, stride) in samples."""
+    return int(np.round(fs * frame_length)), int(np.round(fs * frame_stride))
+
+
+def count_frames(num_samples, frame_sample_length, stride):
+    """The number of frames of a signal, like `speechpy.processing.stack_frames` without zero padding."""
+    return max(int(np.floor((num_samples - frame_sample_length) / float(stride))), 0)
+
+
+def _strided_frames(signal, num_frames, frame_sample_length, stride):
+    # Single and double precision signals are framed as they are, the features are computed at their precision.
+    signal = np.ascontiguousarray(signal, dtype=signal.dtype if signal.dtype in (np.float32, np.float64)
+                                  else np.float64)
+    return np.lib.stride_tricks.as_strided(signal, shape=(num_frames, frame_sample_length),
+                                           strides=(stride * signal.strides[0], signal.strides[0]),
+                                           writeable=False)
+
+
+def frame_signal(signal, fs, frame_length=0.02, frame_stride=0.02):
+    """Frame a signal like `speechpy.processing.stack_frames` without zero padding(the incomplete last frame is
+    dropped), as a read-only strided view instead of a gathered copy.
+
+    Returns:
+        The (num_frames, frame_sample_length) frames.
+    """
+    frame_sample_length, stride = frame_sizes(fs, frame_length, frame_stride)
+    return _strided_frames(signal, count_frames(signal.shape[0], frame_sample_length, stride), frame_sample_length,
+                           stride)
+
+
+def _check_outputs(outputs):
+    for output in outputs:
+        if output not in FEATURES:
+            raise ValueError('Feature [%s] was not recognized' % output)
+
+
+def power_spectrum(frames, fft_length=1024):
+    """Same as `speechpy.processing.power_spectrum`, at the precision of the frames."""
+    # numpy.fft is the faster one in double precision.
+    transform = np.fft if frames.dtype == np.float64 else fft
+    return (1.0 / fft_length * np.square(np.absolute(transform.rfft(frames, n=fft_length, axis=-1)))).astype(
+        frames.dtype, copy=False)
+
+
+def log_filterbank_energies(spectrum, fs, num_coefficient=40, low_frequency=0, high_frequency=None):
+    """The log Mel-filterbank energies of a power spectrum(the last step of `speechpy.feature.lmfe`)."""
+    dtype = spectrum.dtype
+    filter_banks = mel_filterbanks(num_coefficient, spectrum.shape[1], fs, low_frequency, high_frequency,
+                                   dtype=dtype)
+    energies = np.dot(spectrum, filter_banks.T)
+    return np.log(np.where(energies == 0, np.finfo(dtype).eps, energies))
+
+
+def frame_features(frames, fs, outputs=('logenergy',), num_coefficient=40, fft_length=1024, low_frequency=0,
+                   high_frequency=None):
+    """Compute the requested features of framed signal(refer to `extract_features`)."""
+    spectrum = power_spectrum(frames, fft_length)
+
+    features = {}
+    if 'power_spectrum' in outputs:
+        features['power_spectrum'] = spectrum
+    if 'logenergy' in outputs or 'derivative' in outputs:
+        logenergy = log_filterbank_energies(spectrum, fs, num_coefficient, low_frequency, high_frequency)
+        if 'logenergy' in outputs:
+            features['logenergy'] = logenergy
+        if 'derivative' in outputs:
+            features['derivative'] = batch_derivative_feature(logenergy)
+    return features
+
+
+def extract_features(signal, fs, outputs=('logenergy',), num_coefficient=40, frame_length=0.02, frame_stride=0.02,
+                     fft_length=1024, low_frequency=0, high_frequency=None):
+    """Compute the requested features of a signal from a single framing and FFT pass.
+
+    The log-energy features are identical to `speechpy.feature.lmfe` with the same parameters and the derivative
+    features to `speechpy.feature.extract_derivative_feature` applied to them(refer to `batch_derivative_feature`).
+    The features are computed at the precision of the signal(single or double, double for the other types).
+
+    Args:
+        signal (array): The (N,) audio signal.
+        fs (int): The sampling frequency.
+        outputs (tuple): The requested features among `FEATURES`.
+        num_coefficient (int): The number of Mel filters.
+        frame_length (float): The length of each frame in seconds.
+        frame_stride (float): The stride between frames in seconds.
+        fft_length (int): The number of FFT points.
+        low_frequency (float): The lowest band edge of the Mel filters.
+        high_frequency (float): The highest band edge of the Mel filters(fs / 2 by default).
+    Returns:
+        A dictionary with the requested features:
+            logenergy: (num_frames, num_coefficient) log Mel-filterbank energies.
+            power_spectrum: (num_frames, fft_length // 2 + 1) power spectrum.
+            derivative: (num_frames, num_coefficient, 3) log-energies with their first and second derivatives.
+    """
+    _check_outputs(outputs)
+    frames = frame_signal(signal, fs, frame_length=frame_length, frame_stride=frame_stride)
+    return frame_features(frames, fs, outputs=outputs, num_coefficient=num_coefficient, fft_length=fft_length,
+                          low_frequency=low_frequency, high_frequency=high_frequency)
+
+
+def stream_features(sound_file_path, outputs=('logenergy',), max_frames=None, block_frames=256, num_coefficient=40,
+                    frame_length=0.02, frame_stride=0.02, fft_length=1024, low_frequency=0, high_frequency=None,
+                    dtype=np.float64):
+    """Compute the features of a sound file block by block.
+
+    The file is read `block_frames` frames at a time, the samples shared by two blocks(when the frames overlap) are
+    kept from one block to the next, so the memory does not depend on the length of the file. The concatenation of
+    the blocks is the result of `extract_features` on the whole signal(up to the last bit of the filterbank product,
+    whose rounding may depend on the number of rows).
+
+    Args:
+        sound_file_path (string): Path to the sound file.
+        outputs (tuple): The requested features among `FEATURES`.
+        max_frames (int, optional): Stop after this many frames(the whole file by default).
+        block_frames (int): The number of frames of each block.
+        dtype: The data type of the decoded samples and of the features(single or double precision).
+        The other arguments are the ones of `extract_features`.
+    Returns:
+        A generator of dictionaries with the requested features of each block(refer to `extract_features`).
+    """
+    _check_outputs(outputs)
+    with sf.SoundFile(sound_file_path) as f:
+        fs = f.samplerate
+        frame_sample_length, stride = frame_sizes(fs, frame_length, frame_stride)
+        num_frames = count_frames(f.frames, frame_sample_length, stride)
+        if max_frames is not None:
+            num_frames = min(num_frames, max_frames)
+
+        # The samples read but not consumed yet.
+        buffered = np.zeros((0,), dtype=dtype)
+        emitted = 0
+        while emitted < num_frames:
+            count = min(block_frames, num_frames - emitted)
+            needed = (count - 1) * stride + frame_sample_length
+            if buffered.shape[0] < needed:
+                buffered = np.concatenate((buffered, f.read(needed - buffered.shape[0], dtype=np.dtype(dtype).name)))
+                if buffered.shape[0] < needed:
+                    # The file is shorter than its header says.
+                    return
+            yield frame_features(_strided_frames(buffered, count, frame_sample_length, stride), fs,
+                                 outputs=outputs, num_coefficient=num_coefficient, fft_length=fft_length,
+                                 low_frequency=low_frequency, high_frequency=high_frequency)
+            emitted += count
+
+            # Move to the start of the next frame.
+            consumed = count * stride
+            if consumed > buffered.shape[0]:
+                f.seek(consumed - buffered.shape[0], sf.SEEK_CUR)
+            buffered = buffered[consumed:].copy()
+
+
+def stream_cubes(sound_file_path, num_frames=15, hop=1, cmvn=False, dtype=np.float32, block_frames=256, **params):
+    """Sliding speech cubes over a whole sound file.
+
+    The log-energies are computed by `stream_features` and the cube starting at each `hop` frames is yielded as
+    soon as its frames are available, so the memory is bounded by a block and a cube whatever the file length.
+
+    Args:
+        sound_file_path (string): Path to the sound file.
+        num_frames (int): The number of frames of a cube(15 frames = 0.3s).
+        hop (int): The number of frames between the starts of two cubes.
+        cmvn (bool): Normalize each cube with its own mean and variance(the statistics of the whole utterance are
+            not known when streaming).
+        dtype: The data type of the cubes(the features are computed in single precision for half precision cubes).
+        block_frames (int): The number of frames read at once.
+        params: The feature parameters(refer to `extract_features`).
+    Returns:
+        A generator of the (num_frames, num_coefficient, 1, 3) cubes, the i-th one starts at frame `i * hop`.
+    """
+    pending = None
+    start = 0
+    next_cube = 0
+    for block in stream_features(sound_file_path, outputs=('logenergy',), block_frames=block_frames,
+                                 dtype=compute_dtype(dtype), **params):
+        pending = block['logenergy'] if pending is None else np.concatenate((pending, block['logenergy']))
+        starts = np.arange(next_cube, start + pending.shape[0] - num_frames + 1, hop)
+        if starts.size:
+            windows = pending[(starts - start)[:, None] + np.arange(num_frames)[None, :]]
+            if cmvn:
+                windows = masked_cmvn(windows, np.full((windows.shape[0],), num_frames))
+            cubes = batch_derivative_feature(windows)[:, :, :, None, :].astype(dtype)
+            for cube in cubes:
+                yield cube
+            next_cube = int(starts[-1]) + hop
+
+        # Keep the frames of the next cubes only.
+        dropped = min(next_cube - start, pending.shape[0])
+        pending = pending[dropped:]
+        start += dropped
+
+
+def batch_frames(signals, fs, frame_length=0.02, frame_stride=0.02, dtype=np.float64):
+    """Frame several signals into one array of frames(refer to `frame_signal`).
+
+    The frames of all the signals are packed one after another without padding.
+
+    Returns:
+        (frames, lengths): The (total_num_frames, frame_sample_length) frames and the (num_signals,) numbers of
+        frames of each signal.
+    """
+    framed = [frame_signal(signal, fs, frame_length=frame_length, frame_stride=frame_stride) for signal in signals]
+    lengths = np.array([f.shape[0] for f in framed], dtype=np.int64)
+    frames = np.empty((int(lengths.sum()), int(np.round(fs * frame_length))), dtype=dtype)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    for i, f in enumerate(framed):
+        frames[offsets[i]:offsets[i + 1]] = f
+    return frames, lengths
+
+
+def batch_logenergy(signals, fs, num_coefficient=40, frame_length=0.02, frame_stride=0.02, fft_length=1024,
+                    low_frequency=0, high_frequency=None, dtype=np.float64, block_size=128):
+    """The log Mel-filterbank energies of several signals with batched FFTs and filterbank products.
+
+    The packed frames are transformed `block_size` frames at a time so the spectra stay in the CPU cache. With
+    `dtype=np.float64` the log-energies are the ones of `speechpy.feature.lmfe`, `np.float32` halves the cost of the
+    FFT at single precision.
+
+    The FFT dominates and is already vectorized over the frames of a signal, so the batching mostly saves the
+    per-signal overhead.
+
+    Returns:
+        (logenergy, lengths): The (num_signals, max_num_frames, num_coefficient) log-energies(zero-padded) and the
+        (num_signals,) numbers of frames.
+    """
+    frames, lengths = batch_frames(signals, fs, frame_length=frame_length, frame_stride=frame_stride, dtype=dtype)
+    filter_banks = mel_filterbanks(num_coefficient, fft_length // 2 + 1, fs, low_frequency, high_frequency,
+                                   dtype=dtype) / fft_length
+    energies = np.empty((frames.shape[0], num_coefficient), dtype=dtype)
+    # numpy.fft is the faster one in double precision(refer to `power_spectrum`).
+    transform = np.fft if np.dtype(dtype) == np.float64 else fft
+    for start in range(0, frames.shape[0], block_size):
+        spectrum = np.absolute(transform.rfft(frames[start:start + block_size], n=fft_length, axis=-1))
+        energies[start:start + block_size] = np.dot(np.square(spectrum), filter_banks.T)
+    energies = np.log(np.where(energies == 0, np.finfo(dtype).eps, energies))
+
+    logenergy = np.zeros((len(signals), max(int(lengths.max()) if len(signals) else 0, 1), num_coefficient),
+                         dtype=dtype)
+    logenergy[np.arange(logenergy.shape[1])[None, :] < lengths[:, None]] = energies
+    return logenergy, lengths
+
+
+def masked_cmvn(features, lengths, variance_normalization=True):
+    """Cepstral mean variance normalization of each utterance of a zero-padded batch.
+
+    Same as `speechpy.processing.cmvn` applied to the first `lengths[i]` frames of each utterance, the padding
+    frames are left at zero.
+
+    Args:
+        features: The (num_utterances, max_num_frames, num_features) features.
+        lengths: The (num_utterances,) numbers of valid frames.
+    """
+    eps = 2 ** -30
+    mask = (np.arange(features.shape[1])[None, :] < lengths[:, None])[:, :, None]
+    count = np.maximum(lengths, 1)[:, None, None].astype(features.dtype)
+    mean_subtracted = np.where(mask, features - np.sum(features * mask, axis=1, keepdims=True) / count, 0)
+    if not variance_normalization:
+        return mean_subtracted
+    centered = np.where(mask, mean_subtracted - np.sum(mean_subtracted, axis=1, keepdims=True) / count, 0)
+    stdev = np.sqrt(np.sum(np.square(centered), axis=1, keepdims=True) / count)
+    return mean_subtracted / (stdev + eps)
+
+
+def batch_derivative_feature(features, delta_windows=2):
+    """The static, first and second derivative features of a batch.
+
+    Same as `speechpy.feature.extract_derivative_feature` applied to each utterance: like speechpy, the
+    differences are taken along the feature axis(the last one) with edge padding, so the frames are independent.
+
+    Args:
+        features: The (..., num_features) features.
+    Returns:
+        The (..., num_features, 3) feature cube.
+    """
+    def derivative(feature):
+        num_features = feature.shape[-1]
+        padded = np.pad(feature, [(0, 0)] * (feature.ndim - 1) + [(delta_windows, delta_windows)], 'edge')
+        difference = np.zeros(feature.shape, dtype=feature.dtype)
+        for r in range(1, delta_windows + 1):
+            difference += r * padded[..., delta_windows + r:delta_windows + r + num_features]
+        return difference / sum(2 * r ** 2 for r in range(1, delta_windows + 1))
+
+    first_derivative = derivative(features)
+    return np.stack((features, first_derivative, derivative(first_derivative)), axis=-1)
+
+
+class FeatureCache(object):
+    """Persistent cache of the features of the sound files.
+
+    The features are deterministic, so they are computed once and saved as .npy files which are memory-mapped when
+    read: after the first epoch, loading a sample only reads an array. An entry is keyed by the path, the size and
+    the modification time of the sound file and the feature parameters, so a modified file or a new set of
+    parameters is computed again.
+
+    Args:
+        cache_dir (string): The directory of the cache.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, sound_file_path, params):
+        """The key of the features of a sound file computed with the given parameters."""
+        stat = os.stat(sound_file_path)
+        description = (os.path.abspath(sound_file_path), stat.st_size, stat.st_mtime, sorted(params.items()))
+        return hashlib.sha1(repr(description).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npy')
+
+    def load(self, key):
+        """The memory-mapped(read-only) features of an entry or None if it is not cached."""
+        try:
+            feature = np.load(self._path(key), mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return feature
+
+    def store(self, key, feature):
+        path = self._path(key)
+        if not os.path.exists(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # Created by another process meanwhile.
+                pass
+        # The entry is written under a temporary name so a reader never sees a partial file.
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            np.save(f, feature)
+        os.rename(temp_path, path)
+
+
+def check_sound_file(sound_file_path):
+    """Validate a sound file from its header.
+
+    A file is valid if its RIFF size matches the file size and it is larger than 1000 bytes.
+
+    Returns:
+        (size, mtime, riff_size, valid, duration): The size and modification time of the file(-1 if it does not
+        exist), the RIFF size(-1 if the header is corrupted), the validity and the duration in seconds.
+    """
+    try:
+        stat = os.stat(sound_file_path)
+    except OSError:
+        return -1, -1.0, -1, False, 0.0
+    try:
+        with open(sound_file_path, 'rb') as f:
+            # The first item is the RIFF size(newer SciPy versions return more items).
+            riff_size = wav._read_riff_chunk(f)[0]
+        duration = sf.info(sound_file_path).duration
+    except (IOError, OSError, ValueError, RuntimeError):
+        return stat.st_size, stat.st_mtime, -1, False, 0.0
+    valid = riff_size == stat.st_size and stat.st_size > 1000
+    return stat.st_size, stat.st_mtime, riff_size, valid, duration
+
+
+class ManifestIndex(object):
+    """Compact columnar index of a manifest.
+
+    Instead of the raw lines, the entries are held in arrays: the labels, the offsets of the paths in a single
+    packed utf-8 buffer and optionally the durations. An entry costs a few bytes plus its path and is read without
+    any string parsing. The index is saved as a single .npz file which is loaded in one read.
+
+    Args:
+        labels: The (num_entries,) labels.
+        offsets: The (num_entries + 1,) offsets of the paths in `paths`.
+        paths: The uint8 buffer of the packed utf-8 paths.
+        durations: The (num_entries,) durations in seconds(NaN if unknown).
+    """
+
+    def __init__(self, labels, offsets, paths, durations=None):
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.paths = np.asarray(paths, dtype=np.uint8)
+        if durations is None:
+            durations = np.full(self.labels.shape, np.nan, dtype=np.float32)
+        self.durations = np.asarray(durations, dtype=np.float32)
+
+    @classmethod
+    def from_file(cls, files_path):
+        """Parse a manifest("class_label subject_dir/sound_file_name.ext" per line)."""
+        labels = array.array('i')
+        # 'q' is missing in Python 2, a C long holds a path length as well.
+        lengths = array.array('l')
+        paths = bytearray()
+        with open(files_path, 'rb') as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                labels.append(int(fields[0]))
+                lengths.append(len(fields[1]))
+                paths += fields[1]
+        offsets = np.zeros((len(lengths) + 1,), dtype=np.int64)
+        if lengths:
+            np.cumsum(np.frombuffer(lengths, dtype=np.dtype('l')), out=offsets[1:])
+        return cls(np.frombuffer(labels, dtype=np.int32), offsets, np.frombuffer(paths, dtype=np.uint8))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['labels'], data['offsets'], data['paths'], data['durations'])
+
+    def save(self, path):
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            np.savez(f, labels=self.labels, offsets=self.offsets, paths=self.paths, durations=self.durations)
+        os.rename(temp_path, path)
+
+    def __len__(self):
+        return self.labels.shape[0]
+
+    def path(self, idx):
+        """The path of an entry(relative to the audio directory)."""
+        return self.paths[self.offsets[idx]:self.offsets[idx + 1]].tobytes().decode('utf-8')
+
+    def select(self, rows):
+        """The index of a subset of the entries.
+
+        Args:
+            rows: The indices or the boolean mask of the selected entries.
+        """
+        rows = np.arange(len(self))[rows]
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        # The position of each selected byte in the packed buffer.
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return ManifestIndex(self.labels[rows], offsets, self.paths[positions], self.durations[rows])
+
+    def same_paths(self, offsets, paths):
+        """Whether the paths are the same as the given packed paths."""
+        return np.array_equal(self.offsets, offsets) and np.array_equal(self.paths, paths)
+
+    @property
+    def nbytes(self):
+        return self.labels.nbytes + self.offsets.nbytes + self.paths.nbytes + self.durations.nbytes
+
+
+class ValidationIndex(object):
+    """Sidecar index of the validation of the sound files of a manifest.
+
+    For each entry of the manifest the index holds the size, modification time, RIFF size, validity and duration of
+    the file(refer to `check_sound_file`) so the next startups only open the files which have changed since their
+    validation. The columns are aligned with the entries of the manifest: when the manifest is unchanged they are
+    loaded as they are, otherwise the records are matched by path.
+
+    Args:
+        path (string): Path to the .npz index(loaded if it exists, None to validate every file at each startup).
+        manifest (ManifestIndex): The manifest.
+        audio_dir (string): The directory of the audio files.
+    """
+
+    def __init__(self, path, manifest, audio_dir):
+        self.path = path
+        self.manifest = manifest
+        self.audio_dir = audio_dir
+        num_entries = len(manifest)
+        # A size of -2 means that the entry has not been validated.
+        self.size = np.full((num_entries,), -2, dtype=np.int64)
+        self.mtime = np.zeros((num_entries,), dtype=np.float64)
+        self.riff_size = np.full((num_entries,), -1, dtype=np.int64)
+        self.valid = np.zeros((num_entries,), dtype=bool)
+        self.duration = np.zeros((num_entries,), dtype=np.float64)
+        if path is None:
+            return
+        try:
+            self._load()
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    def _load(self):
+        with np.load(self.path) as data:
+            if str(data['audio_dir']) != self.audio_dir:
+                return
+            columns = [data[name] for name in ('size', 'mtime', 'riff_size', 'valid', 'duration')]
+            if self.manifest.same_paths(data['offsets'], data['paths']):
+                rows = np.arange(len(self.manifest))
+                saved_rows = rows
+            else:
+                saved = ManifestIndex(np.zeros(data['offsets'].shape[0] - 1), data['offsets'], data['paths'])
+                saved_rows = dict((saved.path(i), i) for i in range(len(saved)))
+                matches = [(i, saved_rows.get(self.manifest.path(i))) for i in range(len(self.manifest))]
+                rows = np.array([i for i, j in matches if j is not None], dtype=np.int64)
+                saved_rows = np.array([j for _, j in matches if j is not None], dtype=np.int64)
+        for column, saved_column in zip((self.size, self.mtime, self.riff_size, self.valid, self.duration), columns):
+            column[rows] = saved_column[saved_rows]
+
+    def sound_file_path(self, idx):
+        return os.path.join(self.audio_dir, self.manifest.path(idx))
+
+    def check(self, idx):
+        """Validate an entry of the manifest, the record is reused if the file has not changed.
+
+        Returns:
+            Whether the file is valid.
+        """
+        sound_file_path = self.sound_file_path(idx)
+        if self.size[idx] != -2:
+            try:
+                stat = os.stat(sound_file_path)
+                if stat.st_size == self.size[idx] and stat.st_mtime == self.mtime[idx]:
+                    return bool(self.valid[idx])
+            except OSError:
+                if self.size[idx] == -1:
+                    return False
+        (self.size[idx], self.mtime[idx], self.riff_size[idx], self.valid[idx],
+         self.duration[idx]) = check_sound_file(sound_file_path)
+        return bool(self.valid[idx])
+
+    def save(self):
+        if self.path is None:
+            return
+        temp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            np.savez(f, audio_dir=np.array(self.audio_dir), offsets=self.manifest.offsets, paths=self.manifest.paths,
+                     size=self.size, mtime=self.mtime, riff_size=self.riff_size, valid=self.valid,
+                     duration=self.duration)
+        os.rename(temp_path, self.path)
+
 
 ######################################
 ####### Define the dataset class #####
@@ -18,93 +586,244 @@ import datetime
 class AudioDataset():
     """Audio dataset."""
 
-    def __init__(self, files_path, audio_dir, transform=None):
+    def __init__(self, files_path, audio_dir, transform=None, feature='logenergy', cache_dir=None, lazy=False,
+                 num_workers=16, index_path=None, max_frames=None, dtype_policy='float32', **params):
         """
         Args:
-            files_path (string): Path to the .txt file which the address of files are saved in it.
+            files_path (string): Path to the .txt file which the address of files are saved in it(or to a manifest
+                index saved by `ManifestIndex.save` as a .npz file).
             root_dir (string): Directory with all the audio files.
             transform (callable, optional): Optional transform to be applied
                 on a sample.
+            feature (string): The feature of the samples, one of `FEATURES`(the log-energies by default).
+            cache_dir (string, optional): The directory of the feature cache(refer to `FeatureCache`).
+            lazy (bool): Validate each file on its first access instead of at construction. The invalid files are
+                then skipped when loading(the next valid file is loaded instead). The validation index is saved once
+                all the files have been validated.
+            num_workers (int): The number of threads validating the files.
+            index_path (string, optional): Path to the sidecar validation index(`files_path` + `.index.npz` by
+                default, refer to `ValidationIndex`).
+            max_frames (int, optional): Only decode the samples of the first `max_frames` frames of each file(for
+                long recordings of which only the first cube is used). The normalization then only covers them.
+            dtype_policy (string): One of `DTYPE_POLICIES`. `float32` decodes the files, computes the features and
+                the batches and caches the features in single precision, `float16` caches them in half precision
+                (half of the disk space and of the reads) and `float64` is the double precision of speechpy.
+            params: The parameters of the feature extraction which differ from `FEATURE_PARAMS`.
         """
+        if feature not in FEATURES:
+            raise ValueError('Feature [%s] was not recognized' % feature)
+        self.feature = feature
+        if dtype_policy not in DTYPE_POLICIES:
+            raise ValueError('dtype policy [%s] was not recognized' % dtype_policy)
+        self.dtype, self.storage_dtype = DTYPE_POLICIES[dtype_policy]
+        self.params = dict(FEATURE_PARAMS)
+        self.params.update(params)
+        self.max_frames = max_frames
+        self.cache = FeatureCache(cache_dir) if cache_dir is not None else None
 
-        # self.sound_files = [x.strip() for x in content]
         self.audio_dir = audio_dir
         self.transform = transform
 
-        # Open the .txt file and create a list from each line.
-        with open(files_path, 'r') as f:
-            content = f.readlines()
-        # you may also want to remove whitespace characters like `\n` at the end of each line
-        list_files = []
-        for x in content:
-            sound_file_path = os.path.join(self.audio_dir, x.strip().split()[1])
-            try:
-                with open(sound_file_path, 'rb') as f:
-                    riff_size, _ = wav._read_riff_chunk(f)
-                    file_size = os.path.getsize(sound_file_path)
-
-                # Assertion error.
-                assert riff_size == file_size and os.path.getsize(sound_file_path) > 1000, "Bad file!"
-
-                # Add to list if file is OK!
-                list_files.append(x.strip())
-            except OSError as err:
-                print("OS error: {0}".format(err))
-            except ValueError:
-                print('file %s is corrupted!' % sound_file_path)
-            # except:
-            #     print("Unexpected error:", sys.exc_info()[0])
-            #     raise
-
-        # Save the correct and healthy sound files to a list.
-        self.sound_files = list_files
+        # The columnar index of the manifest.
+        if files_path.endswith('.npz'):
+            manifest = ManifestIndex.load(files_path)
+        else:
+            manifest = ManifestIndex.from_file(files_path)
+        self.index = ValidationIndex(index_path or files_path + '.index.npz', manifest, audio_dir)
+
+        if lazy:
+            # -1: not validated yet, 0: invalid, 1: valid.
+            self.manifest = manifest
+            self.validity = np.full((len(manifest),), -1, dtype=np.int8)
+            self.num_unvalidated = len(manifest)
+            return
+
+        # The files are validated by a pool of threads, the unchanged files are not opened again.
+        pool = ThreadPool(max(int(num_workers), 1))
+        try:
+            valid = np.array(pool.map(self.index.check, range(len(manifest)), chunksize=256), dtype=bool)
+        finally:
+            pool.close()
+            pool.join()
+        self.save_index()
+
+        for idx in np.flatnonzero(~valid):
+            if self.index.size[idx] < 0:
+                print("OS error: file %s does not exist" % self.index.sound_file_path(idx))
+            else:
+                print('file %s is corrupted!' % self.index.sound_file_path(idx))
+
+        # Keep the correct and healthy sound files.
+        manifest.durations[valid] = self.index.duration[valid]
+        self.manifest = manifest.select(valid)
+        self.validity = np.ones((len(self.manifest),), dtype=np.int8)
 
     def __len__(self):
-        return len(self.sound_files)
+        return len(self.manifest)
 
-    def __getitem__(self, idx):
+    def save_index(self):
+        try:
+            self.index.save()
+        except (IOError, OSError) as err:
+            print("The validation index could not be saved: {0}".format(err))
+
+    def sound_file_path(self, idx):
+        return os.path.join(self.audio_dir, self.manifest.path(idx))
+
+    def read_signal(self, sound_file_path):
+        """Decode a sound file(only the samples of the first `max_frames` frames if it is set).
+
+        Returns:
+            (signal, fs)
+        """
+        dtype = np.dtype(self.dtype).name
+        if self.max_frames is None:
+            return sf.read(sound_file_path, dtype=dtype)
+        with sf.SoundFile(sound_file_path) as f:
+            frame_sample_length, stride = frame_sizes(f.samplerate, self.params['frame_length'],
+                                                      self.params['frame_stride'])
+            return f.read(self.max_frames * stride + frame_sample_length, dtype=dtype), f.samplerate
+
+    def cache_params(self, feature, dtype=None):
+        """The parameters which key the cached features(computed in `dtype`, the one of the policy by default)."""
+        params = dict(self.params, feature=feature)
+        if self.max_frames is not None:
+            params['max_frames'] = self.max_frames
+        dtype = np.dtype(dtype or self.dtype)
+        if dtype != np.float64:
+            # The entries of the double precision features keep their former keys.
+            params['dtype'] = dtype.name
+        if np.dtype(self.storage_dtype) != dtype:
+            params['storage_dtype'] = np.dtype(self.storage_dtype).name
+        return params
+
+    def resolve(self, idx):
+        """The index of the file loaded for `idx`: itself if it is valid or the next valid file otherwise(only
+        in the lazy mode, where the files are validated on their first access)."""
+        if not -len(self.manifest) <= idx < len(self.manifest):
+            raise IndexError('Index %d is out of range' % idx)
+        for offset in range(len(self.manifest)):
+            i = (idx + offset) % len(self.manifest)
+            if self.validity[i] < 0:
+                self.validity[i] = self.index.check(i)
+                self.manifest.durations[i] = self.index.duration[i]
+                self.num_unvalidated -= 1
+                if not self.num_unvalidated:
+                    self.save_index()
+            if self.validity[i]:
+                return i
+        raise IndexError('No valid sound file in the dataset')
+
+    def load_feature(self, idx):
+        """The feature of a sound file in the data type of the policy, read from the cache when available."""
         # Get the sound file path
-        sound_file_path = os.path.join(self.audio_dir, self.sound_files[idx].split()[1])
+        idx = self.resolve(idx)
+        sound_file_path = self.sound_file_path(idx)
+
+        if self.cache is not None:
+            key = self.cache.key(sound_file_path, self.cache_params(self.feature))
+            feature = self.cache.load(key)
+            if feature is not None:
+                # No copy unless the features are stored in half precision.
+                return np.asarray(feature, dtype=self.dtype)
 
         ##############################
         ### Reading and processing ###
         ##############################
 
-        # Reading .wav file
-        fs, signal = wav.read(sound_file_path)
-
-        # Reading .wav file
-        import soundfile as sf
-        signal, fs = sf.read(sound_file_path)
+        # Reading .wav file(decoded once)
+        signal, fs = self.read_signal(sound_file_path)
 
         ###########################
         ### Feature Extraction ####
         ###########################
 
-        # DEFAULTS:
-        num_coefficient = 40
+        # A single framing/FFT pass(same log-energies as speechpy.feature.lmfe).
+        feature = extract_features(signal, fs, outputs=(self.feature,), **self.params)[self.feature]
 
-        # Staching frames
-        frames = speechpy.processing.stack_frames(signal, sampling_frequency=fs, frame_length=0.02,
-                                                  frame_stride=0.02,
-                                                  zero_padding=True)
+        if self.cache is not None:
+            # The features are returned as they are read from the cache, so all the epochs see the same values.
+            feature = feature.astype(self.storage_dtype, copy=False)
+            self.cache.store(key, feature)
+            feature = np.asarray(feature, dtype=self.dtype)
+        return feature
 
-        # # Extracting power spectrum (choosing 3 seconds and elimination of DC)
-        power_spectrum = speechpy.processing.power_spectrum(frames, fft_points=2 * num_coefficient)[:, 1:]
+    def get_batch(self, indices, num_frames=15, cmvn=True, dtype=None):
+        """The speech feature cubes and labels of several files computed at once.
 
-        logenergy = speechpy.feature.lmfe(signal, sampling_frequency=fs, frame_length=0.02, frame_stride=0.02,
-                                          num_filters=num_coefficient, fft_length=1024, low_frequency=0,
-                                          high_frequency=None)
-        
+        Equivalent to the per-item pipeline `CMVN`, `Extract_Derivative` and `Feature_Cube` with the log-energy
+        features, but the FFT, the filterbank energies, the normalization and the derivatives are computed for the
+        whole batch with array operations. Cached log-energies are read from the feature cache.
+
+        Args:
+            indices (list): The indices of the files.
+            num_frames (int): The number of frames of each cube(the utterances which are shorter are zero-padded).
+            cmvn (bool): Apply the cepstral mean variance normalization.
+            dtype: The data type of the computation and of the cubes(the one of the policy by default, `np.float64`
+                gives the results of the per-item pipeline of speechpy but gains little over it since the FFT
+                dominates, `np.float32` is the fast path).
+        Returns:
+            (speech, labels): The (N, num_frames, num_coefficient, 1, 3) speech cubes fed to the speech network and
+            the (N, 1) labels.
+        """
+        indices = [self.resolve(idx) for idx in indices]
+        sound_file_paths = [self.sound_file_path(idx) for idx in indices]
+        labels = self.manifest.labels[indices].astype(np.int64)[:, None]
+        dtype = dtype or self.dtype
+        params = self.cache_params('logenergy', dtype)
+
+        # The cached log-energies, the others are computed together.
+        logenergies = [None] * len(indices)
+        keys = [None] * len(indices)
+        if self.cache is not None:
+            for i, sound_file_path in enumerate(sound_file_paths):
+                keys[i] = self.cache.key(sound_file_path, params)
+                logenergy = self.cache.load(keys[i])
+                if logenergy is not None:
+                    logenergies[i] = np.asarray(logenergy, dtype=dtype)
+        missing = [i for i, logenergy in enumerate(logenergies) if logenergy is None]
+        if missing:
+            signals = []
+            sampling_frequencies = set()
+            for i in missing:
+                signal, fs = self.read_signal(sound_file_paths[i])
+                signals.append(signal)
+                sampling_frequencies.add(fs)
+            if len(sampling_frequencies) > 1:
+                raise ValueError('The sound files of a batch must have the same sampling frequency')
+            computed, lengths = batch_logenergy(signals, sampling_frequencies.pop(), dtype=dtype, **self.params)
+            for i, logenergy, length in zip(missing, computed, lengths):
+                logenergies[i] = logenergy[:length]
+                if self.cache is not None:
+                    stored = logenergies[i].astype(self.storage_dtype, copy=False)
+                    self.cache.store(keys[i], stored)
+                    logenergies[i] = np.asarray(stored, dtype=dtype)
+
+        # The zero-padded batch of utterances.
+        lengths = np.array([logenergy.shape[0] for logenergy in logenergies], dtype=np.int64)
+        features = np.zeros((len(indices), max(lengths.max() if len(indices) else 0, num_frames),
+                             self.params['num_coefficient']), dtype=dtype)
+        for i, logenergy in enumerate(logenergies):
+            features[i, :lengths[i]] = logenergy
+
+        if cmvn:
+            features = masked_cmvn(features, lengths, variance_normalization=True)
+        cubes = batch_derivative_feature(features[:, :num_frames])
+        cubes[np.arange(num_frames)[None, :] >= lengths[:, None]] = 0
+        return cubes[:, :, :, None, :], labels
+
+    def __getitem__(self, idx):
+        idx = self.resolve(idx)
+        feature = self.load_feature(idx)
 
         ########################
         ### Handling sample ####
         ########################
 
         # Label extraction
-        label = int(self.sound_files[idx].split()[0])
+        label = int(self.manifest.labels[idx])
 
-        sample = {'feature': logenergy, 'label': label}
+        sample = {'feature': feature, 'label': label}
 
         ########################
         ### Post Processing ####
@@ -119,6 +838,41 @@ class AudioDataset():
         # return sample
 
 
+# The dataset of the warm-up workers.
+_warm_up_dataset = None
+
+
+def _init_warm_up(dataset):
+    global _warm_up_dataset
+    _warm_up_dataset = dataset
+
+
+def _warm_up(idx):
+    hits = _warm_up_dataset.cache.hits
+    _warm_up_dataset.load_feature(idx)
+    return _warm_up_dataset.cache.hits > hits
+
+
+def warm_up(dataset, num_workers=None):
+    """Populate the feature cache of a dataset with a pool of processes.
+
+    Returns:
+        The numbers of files which were already cached and which have been computed.
+    """
+    hits = misses = 0
+    pool = multiprocessing.Pool(num_workers, initializer=_init_warm_up, initargs=(dataset,))
+    try:
+        for hit in pool.imap_unordered(_warm_up, range(len(dataset)), chunksize=16):
+            if hit:
+                hits += 1
+            else:
+                misses += 1
+    finally:
+        pool.close()
+        pool.join()
+    return hits, misses
+
+
 class CMVN(object):
     """Cepstral mean variance normalization.
 
@@ -142,8 +896,8 @@ class Extract_Derivative(object):
     def __call__(self, sample):
         feature, label = sample['feature'], sample['label']
 
-        # Extract derivative features
-        feature = speechpy.feature.extract_derivative_feature(feature)
+        # Extract derivative features(same as speechpy.feature.extract_derivative_feature)
+        feature = batch_derivative_feature(feature)
 
         return {'feature': feature, 'label': label}
     
@@ -169,7 +923,6 @@ class Feature_Cube(object):
         feature, label = sample['feature'], sample['label']         
 
         if self.cube_shape != None:
-            feature_cube = np.zeros((self.num_frames, self.num_features, self.num_channels), dtype=np.float32)
             feature_cube = feature[0:self.num_frames, :, :]
         else:
             feature_cube = feature
@@ -179,6 +932,89 @@ class Feature_Cube(object):
         return {'feature': feature_cube[None, :, :, :], 'label': label}
 
 
+class Fused_Cube(object):
+    """The fused `CMVN`, `Extract_Derivative`, `Feature_Cube` and `ToOutput` transforms.
+
+    The normalization statistics, the derivatives and the cube are computed in preallocated buffers, so no array is
+    allocated per sample(the scratch buffer only grows with the longest utterance). The values are the ones of the
+    composed transforms, the utterances shorter than the cube are zero-padded.
+
+    The cube is written in an internal buffer which is overwritten by the next call, or in `out` if it is given(e.g.
+    a slot of a batch array).
+
+    Args:
+        cube_shape (tuple): The shape of the feature cube(num_frames, num_features, num_channels).
+            ex: cube_shape=(15,40,3)
+        cmvn (bool): Apply the cepstral mean variance normalization.
+        dtype: The data type of the cube(computed in double precision for a double precision cube, in single
+            precision otherwise).
+    """
+
+    def __init__(self, cube_shape=(15, 40, 3), cmvn=True, dtype=np.float32):
+        self.num_frames, self.num_features, self.num_channels = cube_shape
+        if self.num_channels != 3:
+            raise ValueError('The cube must have 3 channels(the features and their two derivatives)')
+        self.cmvn = cmvn
+        self.output = np.zeros((1, self.num_frames, self.num_features, self.num_channels), dtype=dtype)
+
+        # The buffers of the computation(the composed transforms compute at the precision of the features).
+        self.dtype = compute_dtype(dtype)
+        self.cube = np.zeros((self.num_frames, self.num_features, self.num_channels), dtype=self.dtype)
+        self.scratch = np.zeros((2, 0, self.num_features), dtype=self.dtype)
+        self.mean = np.zeros((self.num_features,), dtype=self.dtype)
+        self.stdev = np.zeros((self.num_features,), dtype=self.dtype)
+
+    def _normalize(self, feature):
+        # Same operations as speechpy.processing.cmvn(numpy mean and std).
+        eps = 2 ** -30
+        num_frames = feature.shape[0]
+        if self.scratch.shape[1] < num_frames:
+            self.scratch = np.zeros((2, num_frames, self.num_features), dtype=self.dtype)
+        mean_subtracted, centered = self.scratch[0, :num_frames], self.scratch[1, :num_frames]
+
+        np.add.reduce(feature, axis=0, out=self.mean)
+        np.true_divide(self.mean, num_frames, out=self.mean)
+        np.subtract(feature, self.mean, out=mean_subtracted)
+
+        # The standard deviation of the mean subtracted features(numpy centers them again).
+        np.add.reduce(mean_subtracted, axis=0, out=self.stdev)
+        np.true_divide(self.stdev, num_frames, out=self.stdev)
+        np.subtract(mean_subtracted, self.stdev, out=centered)
+        np.multiply(centered, centered, out=centered)
+        np.add.reduce(centered, axis=0, out=self.stdev)
+        np.true_divide(self.stdev, num_frames, out=self.stdev)
+        np.sqrt(self.stdev, out=self.stdev)
+        np.add(self.stdev, eps, out=self.stdev)
+
+        num_kept = min(num_frames, self.num_frames)
+        np.true_divide(mean_subtracted[:num_kept], self.stdev, out=self.cube[:num_kept, :, 0])
+
+    def __call__(self, sample, out=None):
+        feature, label = sample['feature'], sample['label']
+        num_kept = min(feature.shape[0], self.num_frames)
+
+        if self.cmvn:
+            self._normalize(feature)
+        else:
+            self.cube[:num_kept, :, 0] = feature[:num_kept]
+        self.cube[num_kept:] = 0
+
+        # The derivatives along the features with edge padding(refer to `batch_derivative_feature`):
+        # (x[j + 1] + 2 x[j + 2]) / 10 where the indices past the last feature are the last one.
+        for channel in (1, 2):
+            source, destination = self.cube[:num_kept, :, channel - 1], self.cube[:num_kept, :, channel]
+            np.multiply(source[:, 2:], 2, out=destination[:, :-2])
+            np.add(destination[:, :-2], source[:, 1:-1], out=destination[:, :-2])
+            np.multiply(source[:, -1], 3, out=destination[:, -1])
+            destination[:, -2] = destination[:, -1]
+            np.true_divide(destination, 10, out=destination)
+
+        if out is None:
+            out = self.output
+        np.copyto(out, self.cube.reshape(out.shape), casting='unsafe')
+        return out, label
+
+
 class ToOutput(object):
     """Return the output.
 
@@ -236,10 +1072,29 @@ if __name__ == '__main__':
     parser.add_argument('--audio_dir',
                         default=os.path.expanduser('~/github/lip-reading-deeplearning/code/speech-input/Audio'),
                         help='Location of sound files')
+
+    # The feature cache and its warm-up
+    parser.add_argument('--cache_dir', default=None,
+                        help='Directory of the feature cache(no cache by default)')
+    parser.add_argument('--warm_up', action='store_true',
+                        help='Compute the features of all the files into the cache and exit')
+    parser.add_argument('--num_workers', type=int, default=None,
+                        help='Number of processes of the warm-up(one per CPU by default)')
+    parser.add_argument('--dtype_policy', default='float32', choices=sorted(DTYPE_POLICIES),
+                        help='Data type of the features and of the cached features(refer to AudioDataset)')
     args = parser.parse_args()
 
-    dataset = AudioDataset(files_path=args.file_path, audio_dir=args.audio_dir,
+    dataset = AudioDataset(files_path=args.file_path, audio_dir=args.audio_dir, cache_dir=args.cache_dir,
+                           dtype_policy=args.dtype_policy,
                            transform=Compose([Extract_Derivative(), Feature_Cube(cube_shape=None), ToOutput()]))
+    if args.warm_up:
+        if args.cache_dir is None:
+            parser.error('--warm_up requires --cache_dir')
+        start_time = datetime.datetime.now()
+        hits, misses = warm_up(dataset, args.num_workers)
+        print('%d files already cached, %d computed in %s' % (hits, misses, datetime.datetime.now() - start_time))
+        sys.exit(0)
+
     idx = 0
     feature, label = dataset.__getitem__(idx)
     print(feature.shape)
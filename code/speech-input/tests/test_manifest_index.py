@@ -0,0 +1,57 @@
+"""
+Tests of the columnar manifest index.
+
+Run from code/speech-input:
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from input_feature import ManifestIndex
+
+
+class ManifestIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files_path = os.path.join(self.directory, 'file_path.txt')
+        with open(self.files_path, 'w') as f:
+            f.write('0 subject/sound.wav\n1 other_subject/long_sound_name.wav\n\n0 s/a.wav\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_from_file(self):
+        manifest = ManifestIndex.from_file(self.files_path)
+        self.assertEqual(len(manifest), 3)
+        self.assertEqual(manifest.labels.tolist(), [0, 1, 0])
+        self.assertEqual([manifest.path(i) for i in range(3)],
+                         ['subject/sound.wav', 'other_subject/long_sound_name.wav', 's/a.wav'])
+        self.assertEqual(manifest.offsets.dtype, np.int64)
+        self.assertTrue(np.isnan(manifest.durations).all())
+
+    def test_empty_file(self):
+        with open(self.files_path, 'w') as f:
+            f.write('\n')
+        manifest = ManifestIndex.from_file(self.files_path)
+        self.assertEqual(len(manifest), 0)
+        self.assertEqual(manifest.offsets.tolist(), [0])
+
+    def test_save_load(self):
+        manifest = ManifestIndex.from_file(self.files_path)
+        index_path = os.path.join(self.directory, 'manifest.npz')
+        manifest.save(index_path)
+        loaded = ManifestIndex.load(index_path)
+        self.assertEqual([loaded.path(i) for i in range(len(loaded))],
+                         [manifest.path(i) for i in range(len(manifest))])
+        self.assertEqual(loaded.labels.tolist(), manifest.labels.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Tests of the persisted validation of the sound files of a manifest.
+
+Run from code/speech-input:
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import input_feature
+from input_feature import AudioDataset
+
+
+class ValidationIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.audio_dir = os.path.join(self.directory, 'Audio')
+        os.makedirs(os.path.join(self.audio_dir, 'subject'))
+        rng = np.random.RandomState(0)
+        for name in ('a', 'b'):
+            wav.write(os.path.join(self.audio_dir, 'subject', name + '.wav'), 16000,
+                      (rng.random_sample(16000) * 2000).astype(np.int16))
+        self.files_path = os.path.join(self.directory, 'file_path.txt')
+        with open(self.files_path, 'w') as f:
+            f.write('0 subject/a.wav\n1 subject/b.wav\n1 subject/missing.wav\n')
+
+        # Count the files opened by the validation.
+        self.checked = []
+        self.check_sound_file = input_feature.check_sound_file
+
+        def _check_sound_file(sound_file_path):
+            self.checked.append(sound_file_path)
+            return self.check_sound_file(sound_file_path)
+        input_feature.check_sound_file = _check_sound_file
+
+    def tearDown(self):
+        input_feature.check_sound_file = self.check_sound_file
+        shutil.rmtree(self.directory)
+
+    def test_second_construction_reuses_the_index(self):
+        dataset = AudioDataset(self.files_path, self.audio_dir, num_workers=2)
+        self.assertEqual(len(dataset), 2)
+        self.assertEqual(len(self.checked), 3)
+        self.assertTrue(os.path.exists(self.files_path + '.index.npz'))
+
+        del self.checked[:]
+        dataset = AudioDataset(self.files_path, self.audio_dir, num_workers=2)
+        self.assertEqual(len(dataset), 2)
+        # The unchanged files are not opened(and the missing file is still missing).
+        self.assertEqual(self.checked, [])
+
+    def test_modified_file_is_validated_again(self):
+        AudioDataset(self.files_path, self.audio_dir, num_workers=2)
+        sound_file_path = os.path.join(self.audio_dir, 'subject', 'a.wav')
+        stat = os.stat(sound_file_path)
+        os.utime(sound_file_path, (stat.st_atime, stat.st_mtime + 10))
+
+        del self.checked[:]
+        AudioDataset(self.files_path, self.audio_dir, num_workers=2)
+        self.assertEqual(self.checked, [sound_file_path])
+
+    def test_lazy_mode_saves_the_index_after_a_full_pass(self):
+        dataset = AudioDataset(self.files_path, self.audio_dir, lazy=True)
+        dataset.resolve(0)
+        self.assertFalse(os.path.exists(self.files_path + '.index.npz'))
+        for idx in range(len(dataset)):
+            dataset.resolve(idx)
+        self.assertTrue(os.path.exists(self.files_path + '.index.npz'))
+
+        del self.checked[:]
+        AudioDataset(self.files_path, self.audio_dir, num_workers=2)
+        self.assertEqual(self.checked, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
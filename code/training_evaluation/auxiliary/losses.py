@@ -38,12 +38,13 @@ import tensorflow as tf
 #
 #         return tf.losses.compute_weighted_loss(Contrastive_Loss, scope=scope)
 
-def contrastive_loss(labels, logits, margin_gen=0, margin_imp=1, scope=None):
+def contrastive_loss(labels, logits, margin_gen=0, margin_imp=1, weights=1.0, scope=None):
     """With this definition the loss will be calculated.
         Args:
           y: The labels.
           distance: The distance vector between the output features..
           batch_size: the batch size is necessary because the loss calculation would be over each batch.
+          weights: The weights of the pairs(e.g. zero for the pairs left out by `hard_pair_weights`).
         Returns:
           The total loss.
     """
@@ -58,11 +59,57 @@ def contrastive_loss(labels, logits, margin_gen=0, margin_imp=1, scope=None):
 
         # Contrastive
         Contrastive_Loss = tf.add(term_1, term_2) / 2
-        loss = tf.losses.compute_weighted_loss(Contrastive_Loss, scope=scope)
+        loss = tf.losses.compute_weighted_loss(Contrastive_Loss, weights=weights, scope=scope)
 
         return loss
 
 
+def hard_pair_weights(labels, logits, strategy='legacy', hard_margin=10.0, hardest_k=0, scope=None):
+    """The in-graph online pair selection: one for the selected pairs and zero for the others.
+
+    The same selection as `select_pairs` in auxiliary/pair_selection.py, computed from the distances of the
+    training pass itself(without gradient), so no separate forward pass is needed.
+        Args:
+          labels: The (N, 1) labels(1 for genuine, 0 for impostor).
+          logits: The (N, 1) distances of the pairs.
+          strategy: One of "legacy", "semi_hard" or "hardest_k".
+          hard_margin: The margin above the farthest genuine pair of the "legacy" and "semi_hard" strategies.
+          hardest_k: The number of impostors of the "hardest_k" strategy(0 for the number of genuine pairs).
+        Returns:
+          The (N, 1) weights.
+    """
+    with ops.name_scope(scope, "hard_pair_weights", [labels, logits]):
+        distance = tf.stop_gradient(tf.reshape(logits, [-1]))
+        labels = tf.reshape(labels, [-1])
+        genuine = tf.equal(labels, 1)
+        impostor = tf.equal(labels, 0)
+
+        # The farthest genuine pair(zero without genuine pairs).
+        max_gen = tf.reduce_max(tf.where(genuine, distance, tf.zeros_like(distance)))
+        # The impostor distances, the other pairs are last in increasing order.
+        impostor_distance = tf.where(impostor, distance, tf.fill(tf.shape(distance), distance.dtype.max))
+
+        if strategy == 'legacy':
+            hard = tf.logical_and(impostor, distance < max_gen + hard_margin)
+        elif strategy == 'semi_hard':
+            hard = tf.logical_and(impostor, tf.logical_and(distance > max_gen, distance < max_gen + hard_margin))
+            # The hardest impostor when there is no semi-hard one.
+            hardest = tf.logical_and(impostor, tf.equal(tf.range(tf.size(distance, out_type=tf.int64)),
+                                                        tf.argmin(impostor_distance, axis=0)))
+            hard = tf.logical_or(hard, tf.logical_and(hardest, tf.logical_not(tf.reduce_any(hard))))
+        elif strategy == 'hardest_k':
+            num_impostors = tf.reduce_sum(tf.cast(impostor, tf.int32))
+            num_kept = tf.minimum(hardest_k if hardest_k else tf.reduce_sum(tf.cast(genuine, tf.int32)),
+                                  num_impostors)
+            # The rank of each pair in increasing impostor distance(top_k keeps the lower index first on ties).
+            order = tf.nn.top_k(-impostor_distance, k=tf.size(distance)).indices
+            hard = tf.logical_and(impostor, tf.invert_permutation(order) < num_kept)
+        else:
+            raise ValueError('Pair selection strategy [%s] was not recognized' % strategy)
+
+        return tf.reshape(tf.cast(tf.logical_or(genuine, hard), logits.dtype), [-1, 1])
+
+
 # def contrastive_loss(onehot_labels, logits, batch_size, margin=1):
 #     """With this definition the loss will be calculated.
 #         Args:
@@ -0,0 +1,155 @@
+"""
+Online hard pair selection
+
+The pairs of a batch are selected from their distances(the output of a forward pass) with masked reductions:
+all the genuine pairs are kept and the impostor pairs are kept by one of the strategies:
+
+    legacy       the impostors closer than the farthest genuine pair plus `hard_margin`(the former loops of
+                 train.py)
+    semi_hard    the impostors farther than the farthest genuine pair but closer than it plus `hard_margin`(the
+                 hardest impostor if there is none, so the batch keeps an impostor)
+    hardest_k    the `hardest_k` closest impostors(as many as the genuine pairs by default)
+
+Instead of a separate forward pass, the distances can be read from a `DistanceMemory` of the distances measured by
+the training passes of the previous epochs(the in-graph selection is `hard_pair_weights` in auxiliary/losses.py).
+
+Example(cost of the selection):
+    python -m auxiliary.pair_selection --batch_size 32
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import time
+import numpy as np
+
+STRATEGIES = ('legacy', 'semi_hard', 'hardest_k')
+
+
+def genuine_statistics(distance, labels):
+    """The maximum and minimum distances of the genuine pairs(0 and 100 without genuine pairs, like the former
+    loops)."""
+    distance = np.asarray(distance).reshape((-1,))
+    genuine = np.asarray(labels).reshape((-1,)) == 1
+    max_gen = max(np.max(distance[genuine]), 0) if genuine.any() else 0
+    min_gen = min(np.min(distance[genuine]), 100) if genuine.any() else 100
+    return max_gen, min_gen
+
+
+def select_pairs(distance, labels, strategy='legacy', hard_margin=10, hardest_k=0):
+    """Select the pairs of a batch to train on.
+
+    Args:
+      distance: The (N, 1) or (N,) distances of the pairs.
+      labels: The (N, 1) or (N,) labels(1 for genuine, 0 for impostor).
+      strategy: One of `STRATEGIES`.
+      hard_margin: The margin above the farthest genuine pair of the `legacy` and `semi_hard` strategies.
+      hardest_k: The number of impostors of the `hardest_k` strategy(0 for the number of genuine pairs).
+    Returns:
+      The indices of the selected pairs in increasing order.
+    """
+    distance = np.asarray(distance).reshape((-1,))
+    labels = np.asarray(labels).reshape((-1,))
+    genuine = labels == 1
+    impostor = labels == 0
+    max_gen, _ = genuine_statistics(distance, labels)
+
+    if strategy == 'legacy':
+        hard = impostor & (distance < max_gen + hard_margin)
+    elif strategy == 'semi_hard':
+        hard = impostor & (distance > max_gen) & (distance < max_gen + hard_margin)
+        if impostor.any() and not hard.any():
+            hard[np.argmin(np.where(impostor, distance, np.inf))] = True
+    elif strategy == 'hardest_k':
+        num_kept = min(hardest_k or int(genuine.sum()), int(impostor.sum()))
+        hard = np.zeros(distance.shape, dtype=bool)
+        hard[np.argsort(np.where(impostor, distance, np.inf), kind='mergesort')[:num_kept]] = True
+    else:
+        raise ValueError('Pair selection strategy [%s] was not recognized' % strategy)
+    return np.flatnonzero(genuine | hard)
+
+
+class DistanceMemory(object):
+    """The distances of the pairs measured by their last training steps.
+
+    Args:
+      num_pairs: The number of pairs of the training set.
+      max_age: The number of epochs after which a distance is measured again(the pair is then selected whatever the
+        strategy).
+    """
+
+    def __init__(self, num_pairs, max_age=3):
+        self.distance = np.zeros((num_pairs,), dtype=np.float32)
+        self.epoch = np.full((num_pairs,), -np.inf)
+        self.max_age = max_age
+
+    def select(self, rows, labels, epoch, **kwargs):
+        """Select the pairs of a batch from their remembered distances.
+
+        The pairs without a distance of the last `max_age` epochs are selected, the others are selected by
+        `select_pairs` with the keyword arguments.
+
+        Args:
+          rows: The (N,) indices of the pairs of the batch in the training set.
+          labels: The (N, 1) or (N,) labels.
+          epoch: The current epoch.
+        Returns:
+          The indices of the selected pairs in the batch in increasing order.
+        """
+        rows = np.asarray(rows)
+        labels = np.asarray(labels).reshape((-1,))
+        fresh = epoch - self.epoch[rows] <= self.max_age
+        known = np.flatnonzero(fresh)
+        selected = known[select_pairs(self.distance[rows[known]], labels[known], **kwargs)]
+        return np.union1d(selected, np.flatnonzero(~fresh))
+
+    def update(self, rows, distance, epoch):
+        """Remember the distances measured by the training step of the given pairs."""
+        self.distance[rows] = np.reshape(distance, (-1,))
+        self.epoch[rows] = epoch
+
+
+def legacy_select_pairs(distance, labels, hard_margin=10):
+    """The former loops of train.py(for the comparison)."""
+    label_keep = []
+    max_gen = 0
+    for j in range(labels.shape[0]):
+        if labels[j] == 1:
+            if max_gen < distance[j, 0]:
+                max_gen = distance[j, 0]
+    for i in range(labels.shape[0]):
+        if labels[i] == 0:
+            if distance[i, 0] < max_gen + hard_margin:
+                label_keep.append(i)
+        elif labels[i] == 1:
+            label_keep.append(i)
+    return label_keep
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cost of the online pair selection')
+    parser.add_argument('--batch_size', type=int, default=32,
+                        help='Number of pairs of a batch')
+    parser.add_argument('--repeat', type=int, default=1000,
+                        help='Number of timed selections')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    labels = rng.randint(2, size=(args.batch_size, 1))
+    distance = rng.random_sample((args.batch_size, 1)) * 20
+
+    for margin in (0.5, 2, 10):
+        if not np.array_equal(legacy_select_pairs(distance, labels, margin),
+                              select_pairs(distance, labels, 'legacy', margin)):
+            raise AssertionError('The legacy strategy differs from the former loops')
+
+    functions = [('loops', lambda: legacy_select_pairs(distance, labels))]
+    functions += [(strategy, lambda strategy=strategy: select_pairs(distance, labels, strategy))
+                  for strategy in STRATEGIES]
+    for name, function in functions:
+        start_time = time.time()
+        for _ in range(args.repeat):
+            selected = function()
+        print('%-9s %8.1f us per batch of %d, %d pairs kept' % (
+            name, 1e6 * (time.time() - start_time) / args.repeat, args.batch_size, len(selected)))
@@ -0,0 +1,42 @@
+"""
+The input data of the training and testing scripts.
+
+A data split is either a corpus written by datasets/pair_corpus.py(memory-mapped) or random data of the shape of the
+network inputs(speech and mouth cubes in [0, 1), like the mouth cubes of a corpus, refer to `PairCorpus`).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from datasets.pair_corpus import PairCorpus
+
+# The data is kept in single precision like the placeholders(double precision arrays take twice the memory and are
+# converted at every feed).
+INPUT_DTYPE = np.float32
+
+
+def describe_data(data):
+    """The size of a data split as a printable string."""
+    storage = 'in memory' if isinstance(data['mouth'], np.ndarray) else 'memory-mapped'
+    return "%.1f MB %s" % (sum(x.nbytes for x in data.values()) / 1e6, storage)
+
+
+def load_data(corpus_dir, num_samples):
+    """Loads a data split.
+
+    Args:
+      corpus_dir: The directory of a corpus written by datasets/pair_corpus.py, or None for random data.
+      num_samples: The number of random samples.
+
+    Returns:
+      The dictionary of the 'mouth' and 'speech' arrays and the (N, 1) labels. The arrays of a corpus are
+      memory-mapped, so the resident memory does not depend on its size.
+    """
+    if corpus_dir is not None:
+        corpus = PairCorpus(corpus_dir)
+        return {'mouth': corpus.mouth, 'speech': corpus.speech}, corpus.labels
+    data = {'mouth': np.random.random_sample(size=(num_samples, 9, 60, 100, 1)).astype(INPUT_DTYPE),
+            'speech': np.random.random_sample(size=(num_samples, 15, 40, 1, 3)).astype(INPUT_DTYPE)}
+    return data, np.random.randint(2, size=(num_samples, 1))
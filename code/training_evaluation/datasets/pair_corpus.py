@@ -0,0 +1,380 @@
+"""
+Sharded on-disk corpus of (speech, mouth, label) training pairs.
+
+A corpus is a directory:
+
+    index.json               the header: the number of pairs, the shape and data type of the speech and mouth cubes
+                             and the number of pairs of each shard
+    labels.npy               the (num_pairs, 1) labels(1 for a genuine pair, 0 for an impostor pair)
+    shard_00000.speech.npy   the (num_shard_pairs, 15, 40, 1, 3) speech cubes of the first shard
+    shard_00000.mouth.npy    the (num_shard_pairs, 9, 60, 100, 1) mouth cubes of the first shard
+    ...
+
+The shards are fixed-stride .npy arrays which are memory-mapped when read: a speech batch inside a shard is a view
+of the file(no copy), the uint8 mouth batches are scaled into single precision copies of the batch only, and only the
+most recently used shards are mapped, so the resident memory does not depend on the size of the corpus.
+
+A corpus is converted from the speech features of `AudioDataset`(code/speech-input/input_feature.py) and the mouth
+stores written by the lip tracker(`mouth.npz`, refer to code/lip_tracking/batch_lip_tracking.py). For the sound file
+`<subject_dir>/<name>.wav` of the manifest, the mouth store is `<mouth_dir>/<subject_dir>/<name>/mouth.npz`. Each
+aligned window of a clip gives a genuine pair(refer to `PairWindows`) and the impostor pairs match its speech with
+the mouth of another window of the same clip.
+
+Example(from code/training_evaluation):
+    python -m datasets.pair_corpus --file_path file_path.txt --audio_dir Audio --mouth_dir results --output corpus
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import sys
+import numpy as np
+
+from datasets.pair_windows import PairWindows
+
+# The header of a corpus.
+INDEX_NAME = 'index.json'
+LABELS_NAME = 'labels.npy'
+
+# The format version of the header.
+VERSION = 1
+
+
+def _shard_path(corpus_dir, shard, stream):
+    return os.path.join(corpus_dir, 'shard_%05d.%s.npy' % (shard, stream))
+
+
+class ShardedArray(object):
+    """An array stored as consecutive memory-mapped shards.
+
+    Slicing rows inside a shard gives a read-only view of the file, slicing across shards or indexing with an array
+    of rows gathers a copy. With a `scale`, the rows are read as single precision values multiplied by it(always a
+    copy).
+
+    Args:
+        paths (list): The .npy files of the shards in order.
+        counts (list): The number of rows of each shard.
+        shape (tuple): The shape of a row.
+        dtype: The data type of the rows on disk.
+        max_open_shards (int): The number of shards which stay mapped(the least recently used one is unmapped).
+        scale (float, optional): The factor applied to the rows when they are read.
+    """
+
+    def __init__(self, paths, counts, shape, dtype, max_open_shards=2, scale=None):
+        self.paths = paths
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.shape = (int(self.offsets[-1]),) + tuple(shape)
+        self.storage_dtype = np.dtype(dtype)
+        self.scale = scale
+        self.dtype = self.storage_dtype if scale is None else np.dtype(np.float32)
+        self.max_open_shards = max(int(max_open_shards), 1)
+        self._shards = collections.OrderedDict()
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        """The size of the mapped files."""
+        return int(np.prod(self.shape)) * self.storage_dtype.itemsize
+
+    def shard(self, shard):
+        """The memory-mapped array of a shard."""
+        if shard in self._shards:
+            array = self._shards.pop(shard)
+        else:
+            array = np.load(self.paths[shard], mmap_mode='r')
+            while len(self._shards) >= self.max_open_shards:
+                # The mapping is released once the views of the shard are released too.
+                self._shards.popitem(last=False)
+        self._shards[shard] = array
+        return array
+
+    def __getitem__(self, key):
+        rows = self._get(key)
+        if self.scale is None:
+            return rows
+        return np.multiply(rows, self.scale, dtype=self.dtype)
+
+    def _get(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.shape[0])
+            if step == 1:
+                return self._slice(start, max(stop, start))
+            key = np.arange(start, stop, step)
+        if isinstance(key, (int, np.integer)):
+            if not -self.shape[0] <= key < self.shape[0]:
+                raise IndexError('Index %d is out of range' % key)
+            key = key % self.shape[0]
+            shard = int(np.searchsorted(self.offsets, key, side='right')) - 1
+            return self.shard(shard)[key - self.offsets[shard]]
+        return self._take(np.asarray(key))
+
+    def _slice(self, start, stop):
+        if start == stop:
+            return np.empty((0,) + self.shape[1:], dtype=self.storage_dtype)
+        first = int(np.searchsorted(self.offsets, start, side='right')) - 1
+        if stop <= self.offsets[first + 1]:
+            # A view of a single shard.
+            return self.shard(first)[start - self.offsets[first]:stop - self.offsets[first]]
+        last = int(np.searchsorted(self.offsets, stop, side='left')) - 1
+        return np.concatenate([self.shard(shard)[max(start - self.offsets[shard], 0):
+                                                 min(stop, self.offsets[shard + 1]) - self.offsets[shard]]
+                               for shard in range(first, last + 1)])
+
+    def _take(self, rows):
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        rows = rows % max(self.shape[0], 1)
+        result = np.empty((rows.shape[0],) + self.shape[1:], dtype=self.storage_dtype)
+        shards = np.searchsorted(self.offsets, rows, side='right') - 1
+        for shard in np.unique(shards):
+            mask = shards == shard
+            result[mask] = self.shard(shard)[rows[mask] - self.offsets[shard]]
+        return result
+
+
+class PairCorpus(object):
+    """A corpus written by `PairCorpusWriter`, memory-mapped.
+
+    `speech` and `mouth` can be sliced like the in-memory arrays of the training script and `labels` is the
+    (num_pairs, 1) label array(held in memory). The gray levels of the uint8 mouth cubes are read in [0, 1] as single
+    precision values, like the random data of the training script.
+
+    Args:
+        corpus_dir (string): The directory of the corpus.
+        max_open_shards (int): The number of shards of each stream which stay mapped.
+    """
+
+    def __init__(self, corpus_dir, max_open_shards=2):
+        with open(os.path.join(corpus_dir, INDEX_NAME), 'r') as f:
+            index = json.load(f)
+        if index['version'] != VERSION:
+            raise ValueError('Corpus version [%s] was not recognized' % index['version'])
+        self.corpus_dir = corpus_dir
+        self.shard_size = index['shard_size']
+        counts = index['shards']
+        self.speech = ShardedArray([_shard_path(corpus_dir, shard, 'speech') for shard in range(len(counts))],
+                                   counts, index['speech_shape'], index['speech_dtype'], max_open_shards)
+        mouth_scale = 1. / 255 if np.dtype(index['mouth_dtype']) == np.uint8 else None
+        self.mouth = ShardedArray([_shard_path(corpus_dir, shard, 'mouth') for shard in range(len(counts))],
+                                  counts, index['mouth_shape'], index['mouth_dtype'], max_open_shards, mouth_scale)
+        self.labels = np.load(os.path.join(corpus_dir, LABELS_NAME))
+        if self.labels.shape[0] != len(self.speech):
+            raise ValueError('The labels of the corpus %s do not match its shards' % corpus_dir)
+
+    def __len__(self):
+        return len(self.speech)
+
+    def batches(self, batch_size, shuffle=False, seed=None):
+        """The consecutive batches of the corpus.
+
+        With a shard size which is a multiple of `batch_size`, every batch is read from a single shard. Shuffling
+        permutes the order of the batches(not the pairs inside them), so the reads stay sequential.
+
+        Returns:
+            A generator of (speech, mouth, labels) batches(the last one may be smaller).
+        """
+        starts = np.arange(0, len(self), batch_size)
+        if shuffle:
+            np.random.RandomState(seed).shuffle(starts)
+        for start in starts:
+            stop = min(start + batch_size, len(self))
+            yield self.speech[start:stop], self.mouth[start:stop], self.labels[start:stop]
+
+
+class PairCorpusWriter(object):
+    """Write a corpus shard by shard.
+
+    The pairs are written into memory-mapped shards as they come, so the memory does not depend on the size of the
+    corpus. The header and the labels are written by `close`.
+
+    Args:
+        corpus_dir (string): The directory of the corpus(created if needed).
+        speech_shape (tuple): The shape of a speech cube.
+        mouth_shape (tuple): The shape of a mouth cube.
+        speech_dtype: The data type of the speech cubes on disk.
+        mouth_dtype: The data type of the mouth cubes on disk(the gray levels of the lip tracker are uint8).
+        shard_size (int): The number of pairs of a shard(a multiple of the batch size keeps the batches zero-copy).
+    """
+
+    def __init__(self, corpus_dir, speech_shape=(15, 40, 1, 3), mouth_shape=(9, 60, 100, 1), speech_dtype=np.float32,
+                 mouth_dtype=np.uint8, shard_size=1024):
+        if not os.path.exists(corpus_dir):
+            os.makedirs(corpus_dir)
+        self.corpus_dir = corpus_dir
+        self.shapes = {'speech': tuple(speech_shape), 'mouth': tuple(mouth_shape)}
+        self.dtypes = {'speech': np.dtype(speech_dtype), 'mouth': np.dtype(mouth_dtype)}
+        self.shard_size = int(shard_size)
+        self.counts = []
+        self.labels = []
+        self._arrays = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def _open_shard(self):
+        shard = len(self.counts)
+        self._arrays = dict((stream, np.lib.format.open_memmap(
+            _shard_path(self.corpus_dir, shard, stream), mode='w+', dtype=self.dtypes[stream],
+            shape=(self.shard_size,) + self.shapes[stream])) for stream in ('speech', 'mouth'))
+        self.counts.append(0)
+
+    def _close_shard(self):
+        count = self.counts[-1]
+        for stream, array in self._arrays.items():
+            array.flush()
+            if count < self.shard_size:
+                # The last shard is cut to its pairs.
+                path = _shard_path(self.corpus_dir, len(self.counts) - 1, stream)
+                cut = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=array.dtype,
+                                                shape=(count,) + array.shape[1:])
+                cut[:] = array[:count]
+                cut.flush()
+                del cut
+                os.rename(path + '.tmp', path)
+        self._arrays = None
+
+    def write(self, speech, mouth, labels):
+        """Append pairs.
+
+        Args:
+            speech: The (N,) + speech_shape speech cubes.
+            mouth: The (N,) + mouth_shape mouth cubes.
+            labels: The (N,) labels.
+        """
+        labels = np.asarray(labels).reshape((-1,))
+        start = 0
+        while start < labels.shape[0]:
+            if self._arrays is None or self.counts[-1] == self.shard_size:
+                if self._arrays is not None:
+                    self._close_shard()
+                self._open_shard()
+            offset = self.counts[-1]
+            count = min(self.shard_size - offset, labels.shape[0] - start)
+            self._arrays['speech'][offset:offset + count] = speech[start:start + count]
+            self._arrays['mouth'][offset:offset + count] = mouth[start:start + count]
+            self.counts[-1] += count
+            start += count
+        self.labels.append(labels.astype(np.uint8))
+
+    def close(self):
+        if self._arrays is not None:
+            self._close_shard()
+        labels = np.concatenate(self.labels) if self.labels else np.zeros((0,), dtype=np.uint8)
+        np.save(os.path.join(self.corpus_dir, LABELS_NAME), labels[:, None])
+        index = {'version': VERSION, 'num_pairs': int(labels.shape[0]), 'shard_size': self.shard_size,
+                 'shards': self.counts, 'speech_shape': list(self.shapes['speech']),
+                 'speech_dtype': self.dtypes['speech'].name, 'mouth_shape': list(self.shapes['mouth']),
+                 'mouth_dtype': self.dtypes['mouth'].name}
+        # The header is written last, so a corpus with a header is complete.
+        with open(os.path.join(self.corpus_dir, INDEX_NAME + '.tmp'), 'w') as f:
+            json.dump(index, f, indent=2)
+        os.rename(os.path.join(self.corpus_dir, INDEX_NAME + '.tmp'), os.path.join(self.corpus_dir, INDEX_NAME))
+
+
+def mouth_store_path(mouth_dir, sound_file):
+    """The mouth store written by the lip tracker for the video of a sound file of the manifest."""
+    return os.path.join(mouth_dir, os.path.splitext(sound_file)[0], 'mouth.npz')
+
+
+def impostor_rows(times, min_shift, rng):
+    """For each window, another window of the clip starting at least `min_shift` seconds away(-1 if none)."""
+    rows = np.full(times.shape, -1, dtype=np.int64)
+    for i, time in enumerate(times):
+        candidates = np.flatnonzero(np.abs(times - time) >= min_shift)
+        if candidates.size:
+            rows[i] = rng.choice(candidates)
+    return rows
+
+
+def convert(dataset, mouth_dir, writer, hop=0.1, min_shift=1.0, seed=0, chunk_size=256):
+    """Write the genuine and impostor pairs of the clips of a speech dataset into a corpus.
+
+    Args:
+        dataset (AudioDataset): The dataset of the sound files(log-energy features).
+        mouth_dir (string): The output directory of the lip tracker.
+        writer (PairCorpusWriter): The corpus writer.
+        hop (float): The time between the starts of two windows in seconds.
+        min_shift (float): The minimum time between the speech and the mouth windows of an impostor pair.
+        seed (int): The seed of the choice of the impostor windows.
+        chunk_size (int): The number of pairs gathered at once.
+    Returns:
+        The number of clips converted and the list of the sound files without a mouth store.
+    """
+    from input_feature import masked_cmvn, batch_derivative_feature
+
+    rng = np.random.RandomState(seed)
+    num_clips = 0
+    missing = []
+    for idx in range(len(dataset)):
+        sound_file = dataset.manifest.path(idx)
+        store_path = mouth_store_path(mouth_dir, sound_file)
+        if not os.path.exists(store_path):
+            missing.append(sound_file)
+            continue
+
+        # The speech features of the whole clip, like the per-item pipeline(CMVN then derivatives).
+        logenergy = np.asarray(dataset.load_feature(idx))
+        normalized = masked_cmvn(logenergy[None], np.array([logenergy.shape[0]]))[0]
+        windows = PairWindows.from_mouth_store(batch_derivative_feature(normalized), store_path, hop=hop)
+
+        rows = np.flatnonzero(windows.valid)
+        impostors = impostor_rows(windows.times[rows], min_shift, rng)
+        for start in range(0, rows.shape[0], chunk_size):
+            chunk = rows[start:start + chunk_size]
+            matched = impostors[start:start + chunk_size]
+            kept = matched >= 0
+            speech_rows = np.concatenate((chunk, chunk[kept]))
+            mouth_rows = np.concatenate((chunk, rows[matched[kept]]))
+            labels = np.concatenate((np.ones(chunk.shape), np.zeros(kept.sum())))
+            # The genuine and impostor pairs are mixed, so the batches of consecutive pairs have both.
+            order = rng.permutation(labels.shape[0])
+            writer.write(windows.speech[speech_rows[order]], windows.mouth[mouth_rows[order]], labels[order])
+        num_clips += 1
+    return num_clips, missing
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert the speech features and the mouth stores into a corpus')
+    parser.add_argument('--file_path', required=True,
+                        help='The speech manifest("class_label subject_dir/sound_file_name.ext" per line)')
+    parser.add_argument('--audio_dir', required=True,
+                        help='Location of sound files')
+    parser.add_argument('--mouth_dir', required=True,
+                        help='Output directory of the lip tracker')
+    parser.add_argument('--output', required=True,
+                        help='Directory of the corpus')
+    parser.add_argument('--cache_dir', default=None,
+                        help='Directory of the speech feature cache(no cache by default)')
+    parser.add_argument('--hop', type=float, default=0.1,
+                        help='Time between two windows in seconds')
+    parser.add_argument('--min_shift', type=float, default=1.0,
+                        help='Minimum time between the speech and the mouth of an impostor pair in seconds')
+    parser.add_argument('--shard_size', type=int, default=1024,
+                        help='Number of pairs of a shard(a multiple of the batch size)')
+    parser.add_argument('--speech_dtype', default='float32', choices=['float16', 'float32'],
+                        help='Data type of the speech cubes on disk')
+    args = parser.parse_args()
+
+    # The speech input pipeline(code/speech-input is not a package).
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'speech-input'))
+    from input_feature import AudioDataset
+
+    dataset = AudioDataset(args.file_path, args.audio_dir, cache_dir=args.cache_dir)
+    with PairCorpusWriter(args.output, speech_dtype=args.speech_dtype, shard_size=args.shard_size) as writer:
+        num_clips, missing = convert(dataset, args.mouth_dir, writer, hop=args.hop, min_shift=args.min_shift)
+    for sound_file in missing:
+        print('no mouth store for %s' % sound_file)
+    print('%d clips converted into %d pairs(%d shards) in %s' % (num_clips, len(writer), len(writer.counts),
+                                                                  args.output))
@@ -0,0 +1,164 @@
+"""
+Aligned sliding windows over the speech and mouth streams of a clip.
+
+A training pair is a speech cube of 15 frames of 40 log-energies with their derivatives(0.3s at the 0.02s frame
+stride of the speech features) and a mouth cube of 9 gray 60x100 mouth areas(0.3s at 30 f/s). Instead of the first
+window only(refer to `Feature_Cube` in code/speech-input/input_feature.py), every window starting at a multiple of
+`hop` seconds is used, so a clip gives dozens of genuine pairs.
+
+The windows are strided views of the feature arrays of the clip: no frame is copied until a batch is gathered.
+
+Example(throughput benchmark on a synthetic clip):
+    python datasets/pair_windows.py --duration 60 --hop 0.1 --batch_size 32
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import fractions
+import time
+import numpy as np
+
+# The frame rates of the speech features(0.02s stride) and of the mouth areas.
+SPEECH_RATE = 50
+MOUTH_RATE = 30
+
+# The number of frames of the cubes(0.3s).
+SPEECH_FRAMES = 15
+MOUTH_FRAMES = 9
+
+
+def sliding_windows(frames, window, hop):
+    """The windows of `window` frames starting every `hop` frames, as a read-only strided view.
+
+    Args:
+        frames: The (num_frames, ...) array.
+    Returns:
+        The (num_windows, window, ...) view.
+    """
+    num_windows = max((frames.shape[0] - window) // hop + 1, 0)
+    return np.lib.stride_tricks.as_strided(frames, shape=(num_windows, window) + frames.shape[1:],
+                                           strides=(hop * frames.strides[0],) + frames.strides, writeable=False)
+
+
+def hop_frames(hop, speech_rate=SPEECH_RATE, mouth_rate=MOUTH_RATE):
+    """The hop in frames of each stream.
+
+    The windows of both streams must start at the same time, so the hop must be a whole number of frames of both
+    streams(a multiple of 0.1s at 50 and 30 f/s).
+
+    Returns:
+        (speech_hop, mouth_hop)
+    """
+    hop = fractions.Fraction(hop).limit_denominator(1000)
+    speech_hop = hop * fractions.Fraction(speech_rate).limit_denominator(1000)
+    mouth_hop = hop * fractions.Fraction(mouth_rate).limit_denominator(1000)
+    if speech_hop <= 0 or speech_hop.denominator != 1 or mouth_hop.denominator != 1:
+        raise ValueError('The hop of %gs is not a whole number of frames of both streams' % float(hop))
+    return int(speech_hop), int(mouth_hop)
+
+
+class PairWindows(object):
+    """All the aligned (speech, mouth) cube pairs of a clip.
+
+    Args:
+        speech: The (num_speech_frames, 40, 3) or (num_speech_frames, 40, 1, 3) speech features.
+        mouth: The (num_mouth_frames, 60, 100) or (num_mouth_frames, 60, 100, 1) mouth areas.
+        activation: The (num_mouth_frames,) activation of the mouth frames(one if the mouth has been extracted),
+            a pair is valid if all its mouth frames are active.
+        hop (float): The time between the starts of two windows in seconds.
+        speech_rate (int): The frame rate of the speech features.
+        mouth_rate (int): The frame rate of the mouth areas.
+        speech_frames (int): The number of frames of a speech cube.
+        mouth_frames (int): The number of frames of a mouth cube.
+    """
+
+    def __init__(self, speech, mouth, activation=None, hop=0.1, speech_rate=SPEECH_RATE, mouth_rate=MOUTH_RATE,
+                 speech_frames=SPEECH_FRAMES, mouth_frames=MOUTH_FRAMES):
+        speech_hop, mouth_hop = hop_frames(hop, speech_rate, mouth_rate)
+        # The channel axes of the network inputs are added as views.
+        if speech.ndim == 3:
+            speech = speech[:, :, None, :]
+        if mouth.ndim == 3:
+            mouth = mouth[:, :, :, None]
+
+        speech_windows = sliding_windows(speech, speech_frames, speech_hop)
+        mouth_windows = sliding_windows(mouth, mouth_frames, mouth_hop)
+        num_pairs = min(speech_windows.shape[0], mouth_windows.shape[0])
+        self.speech = speech_windows[:num_pairs]
+        self.mouth = mouth_windows[:num_pairs]
+        self.times = np.arange(num_pairs) * float(hop)
+        if activation is None:
+            self.valid = np.ones((num_pairs,), dtype=bool)
+        else:
+            activation = np.ascontiguousarray(activation, dtype=bool)
+            self.valid = sliding_windows(activation, mouth_frames, mouth_hop)[:num_pairs].all(axis=1)
+
+    @classmethod
+    def from_mouth_store(cls, speech, mouth_store_path, **kwargs):
+        """The pairs of a clip from its speech features and the mouth store written by the lip tracker.
+
+        The mouth store(`mouth.npz`, refer to `ArrayMouthWriter` in code/lip_tracking/mouth_extraction.py) must hold
+        every frame of the video at `mouth_rate`(the `all` or `fps` sampling of the lip tracker).
+        """
+        with np.load(mouth_store_path) as data:
+            mouth, activation = data['mouth'], data['activation']
+        return cls(speech, mouth, activation, **kwargs)
+
+    def __len__(self):
+        return self.speech.shape[0]
+
+    def __getitem__(self, idx):
+        """The (speech, mouth) views of a pair."""
+        return self.speech[idx], self.mouth[idx]
+
+    def batches(self, batch_size, valid_only=True, dtype=np.float32):
+        """Gather the pairs into batches.
+
+        Args:
+            batch_size (int): The number of pairs of a batch(the last batch may be smaller).
+            valid_only (bool): Skip the pairs with an inactive mouth frame.
+            dtype: The data type of the batches.
+        Returns:
+            A generator of the (batch_size, 15, 40, 1, 3) speech and (batch_size, 9, 60, 100, 1) mouth batches.
+        """
+        rows = np.flatnonzero(self.valid) if valid_only else np.arange(len(self))
+        for start in range(0, rows.shape[0], batch_size):
+            batch_rows = rows[start:start + batch_size]
+            yield self.speech[batch_rows].astype(dtype), self.mouth[batch_rows].astype(dtype)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of the pair windows')
+    parser.add_argument('--duration', type=float, default=60.0,
+                        help='Duration of the synthetic clip in seconds')
+    parser.add_argument('--hop', type=float, default=0.1,
+                        help='Time between two windows in seconds')
+    parser.add_argument('--batch_size', type=int, default=32,
+                        help='Number of pairs of a batch')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of passes over the pairs')
+    args = parser.parse_args()
+
+    speech = np.random.randn(int(args.duration * SPEECH_RATE), 40, 3).astype(np.float32)
+    mouth = np.random.randint(256, size=(int(args.duration * MOUTH_RATE), 60, 100, 1)).astype(np.uint8)
+    activation = np.random.random_sample(mouth.shape[0]) > 0.01
+
+    start_time = time.time()
+    for _ in range(args.repeat):
+        pairs = PairWindows(speech, mouth, activation, hop=args.hop)
+    windows_seconds = (time.time() - start_time) / args.repeat
+    copied_bytes = pairs.speech.size * pairs.speech.itemsize + pairs.mouth.size * pairs.mouth.itemsize
+    print('%d pairs(%d valid) from a %.0fs clip, windows built in %.3f ms' % (
+        len(pairs), pairs.valid.sum(), args.duration, 1000.0 * windows_seconds))
+    print('clip arrays: %.1f MB, the same pairs as copies: %.1f MB' % (
+        (speech.nbytes + mouth.nbytes) / 1e6, copied_bytes / 1e6))
+
+    start_time = time.time()
+    num_pairs = 0
+    for _ in range(args.repeat):
+        for speech_batch, mouth_batch in pairs.batches(args.batch_size):
+            num_pairs += speech_batch.shape[0]
+    elapsed = time.time() - start_time
+    print('batches of %d: %.0f pairs/sec' % (args.batch_size, num_pairs / elapsed))
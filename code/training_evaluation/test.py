@@ -5,12 +5,14 @@ from __future__ import print_function
 import tensorflow as tf
 
 import sys
+import time
 import numpy as np
 from sklearn.model_selection import KFold
 from tensorflow.python.ops import control_flow_ops
 from nets import nets_factory
 from auxiliary import losses
 from roc_curve import calculate_roc
+from datasets.input_data import describe_data, load_data
 import os
 # import matplotlib.pyplot as plt
 slim = tf.contrib.slim
@@ -122,6 +124,10 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_integer(
     'num_epochs', 20, 'The number of epochs for training.')
 
+tf.app.flags.DEFINE_string(
+    'test_corpus', None,
+    'Directory of the memory-mapped testing corpus(refer to datasets/pair_corpus.py), random data by default.')
+
 
 #####################
 # Fine-Tuning Flags #
@@ -274,15 +280,6 @@ def _get_variables_to_train():
 # Definign arbitrary data
 num_training_samples = 1000
 num_testing_samples = 1000
-train_data = {}
-
-train_data = {'mouth': np.random.random_sample(size=(num_training_samples, 9, 60, 100, 1)),
-              'speech': np.random.random_sample(size=(num_training_samples, 15, 40, 1, 3))}
-test_data = {'mouth': np.random.random_sample(size=(num_testing_samples, 9, 60, 100, 1)),
-             'speech': np.random.random_sample(size=(num_testing_samples, 15, 40, 1, 3))}
-
-train_label = np.random.randint(2, size=(num_training_samples, 1))
-test_label = np.random.randint(2, size=(num_testing_samples, 1))
 
 
 # # Uncomment if data standardalization is required and the mean and std vectors have been calculated.
@@ -319,6 +316,8 @@ def main(_):
 
     tf.logging.set_verbosity(tf.logging.INFO)
 
+    test_data, test_label = load_data(FLAGS.test_corpus, num_testing_samples)
+
     graph = tf.Graph()
     with graph.as_default(), tf.device('/cpu:0'):
         ######################
@@ -326,11 +325,11 @@ def main(_):
         ######################
 
         # required from data
-        num_samples_per_epoch = train_data['mouth'].shape[0]
-        num_batches_per_epoch = int(num_samples_per_epoch / FLAGS.batch_size)
+        num_samples_per_epoch = num_training_samples
 
         num_samples_per_epoch_test = test_data['mouth'].shape[0]
         num_batches_per_epoch_test = int(num_samples_per_epoch_test / FLAGS.batch_size)
+        print("Input data: testing %s" % describe_data(test_data))
 
         # Create global_step
         global_step = tf.Variable(0, name='global_step', trainable=False)
@@ -523,6 +522,7 @@ def main(_):
         label_vector = np.zeros((FLAGS.batch_size * num_batches_per_epoch_test, 1))
 
         # Loop over all batches
+        test_start_time = time.time()
         for i in range(num_batches_per_epoch_test):
             start_idx = i * FLAGS.batch_size
             end_idx = (i + 1) * FLAGS.batch_size
@@ -550,6 +550,12 @@ def main(_):
             score_dissimilarity_vector[start_idx:end_idx] = score_dissimilarity
             label_vector[start_idx:end_idx] = label_test
 
+        # Testing throughput.
+        test_seconds = time.time() - test_start_time
+        print("TESTING: %d samples in %.2f seconds(%.1f samples/sec)" % (
+            num_batches_per_epoch_test * FLAGS.batch_size, test_seconds,
+            num_batches_per_epoch_test * FLAGS.batch_size / max(test_seconds, 1e-6)))
+
         ##############################
         ##### K-fold validation ######
         ##############################
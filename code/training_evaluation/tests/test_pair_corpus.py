@@ -0,0 +1,140 @@
+"""
+Tests of the sharded on-disk corpus of training pairs.
+
+Run from code/training_evaluation:
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from datasets.pair_corpus import PairCorpus, PairCorpusWriter, ShardedArray
+
+
+class ShardedArrayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data = np.arange(23 * 2 * 3, dtype=np.int16).reshape((23, 2, 3))
+        counts = [10, 10, 3]
+        self.paths = []
+        for shard, (start, count) in enumerate(zip(np.cumsum([0] + counts[:-1]), counts)):
+            path = os.path.join(self.directory, 'shard_%d.npy' % shard)
+            np.save(path, self.data[start:start + count])
+            self.paths.append(path)
+        self.array = ShardedArray(self.paths, counts, (2, 3), np.int16, max_open_shards=2)
+
+    def tearDown(self):
+        del self.array
+        shutil.rmtree(self.directory)
+
+    def test_shape(self):
+        self.assertEqual(len(self.array), 23)
+        self.assertEqual(self.array.shape, (23, 2, 3))
+        self.assertEqual(self.array.nbytes, self.data.nbytes)
+
+    def test_slices(self):
+        for start, stop in ((0, 10), (3, 7), (8, 12), (10, 20), (5, 23), (0, 23), (19, 21), (9, 11), (7, 7),
+                            (20, 30), (-5, None), (None, -15)):
+            np.testing.assert_array_equal(self.array[start:stop], self.data[start:stop])
+
+    def test_slice_inside_a_shard_is_a_view(self):
+        rows = self.array[12:15]
+        self.assertIsInstance(rows, np.memmap)
+        self.assertFalse(rows.flags.writeable)
+        self.assertNotIsInstance(self.array[8:12], np.memmap)
+
+    def test_steps_and_indices(self):
+        np.testing.assert_array_equal(self.array[1:22:4], self.data[1:22:4])
+        np.testing.assert_array_equal(self.array[::-3], self.data[::-3])
+        for index in (0, 9, 10, 22, -1, -23):
+            np.testing.assert_array_equal(self.array[index], self.data[index])
+        self.assertRaises(IndexError, self.array.__getitem__, 23)
+
+    def test_take(self):
+        rows = np.array([22, 0, 11, 11, 9, 10, -1])
+        np.testing.assert_array_equal(self.array[rows], self.data[rows])
+        mask = np.arange(23) % 3 == 0
+        np.testing.assert_array_equal(self.array[mask], self.data[mask])
+        self.assertEqual(self.array[np.array([], dtype=np.int64)].shape, (0, 2, 3))
+
+    def test_open_shards_are_bounded(self):
+        self.array[np.arange(23)]
+        self.assertEqual(len(self.array._shards), 2)
+        self.assertEqual(list(self.array._shards), [1, 2])
+
+    def test_scale(self):
+        array = ShardedArray(self.paths, [10, 10, 3], (2, 3), np.int16, scale=0.5)
+        rows = array[8:12]
+        self.assertEqual(rows.dtype, np.float32)
+        np.testing.assert_allclose(rows, self.data[8:12] * 0.5)
+
+
+class PairCorpusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.corpus_dir = os.path.join(self.directory, 'corpus')
+        rng = np.random.RandomState(0)
+        self.speech = rng.randn(11, 15, 4, 1, 3).astype(np.float32)
+        self.mouth = rng.randint(256, size=(11, 3, 6, 5, 1)).astype(np.uint8)
+        self.labels = rng.randint(2, size=(11,))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, shard_size=4, chunks=(3, 5, 3)):
+        with PairCorpusWriter(self.corpus_dir, speech_shape=(15, 4, 1, 3), mouth_shape=(3, 6, 5, 1),
+                              shard_size=shard_size) as writer:
+            start = 0
+            for count in chunks:
+                writer.write(self.speech[start:start + count], self.mouth[start:start + count],
+                             self.labels[start:start + count])
+                start += count
+        return writer
+
+    def test_round_trip(self):
+        writer = self._write()
+        self.assertEqual(writer.counts, [4, 4, 3])
+        corpus = PairCorpus(self.corpus_dir)
+        self.assertEqual(len(corpus), 11)
+        np.testing.assert_array_equal(corpus.speech[:], self.speech)
+        np.testing.assert_array_equal(corpus.labels, self.labels[:, None])
+        # The uint8 gray levels are read in [0, 1].
+        mouth = corpus.mouth[:]
+        self.assertEqual(mouth.dtype, np.float32)
+        np.testing.assert_allclose(mouth, self.mouth / 255., rtol=1e-6)
+        self.assertTrue(mouth.max() <= 1)
+        np.testing.assert_allclose(corpus.mouth[np.array([10, 2, 5])], self.mouth[[10, 2, 5]] / 255., rtol=1e-6)
+
+    def test_batches(self):
+        self._write()
+        corpus = PairCorpus(self.corpus_dir)
+        batches = list(corpus.batches(4))
+        self.assertEqual([len(labels) for _, _, labels in batches], [4, 4, 3])
+        np.testing.assert_array_equal(np.concatenate([speech for speech, _, _ in batches]), self.speech)
+
+        shuffled = list(corpus.batches(4, shuffle=True, seed=1))
+        self.assertEqual(sorted(labels[:, 0].tolist() for _, _, labels in shuffled),
+                         sorted(labels[:, 0].tolist() for _, _, labels in batches))
+
+    def test_float_mouth_is_not_scaled(self):
+        with PairCorpusWriter(self.corpus_dir, speech_shape=(15, 4, 1, 3), mouth_shape=(3, 6, 5, 1),
+                              mouth_dtype=np.float32, shard_size=4) as writer:
+            writer.write(self.speech, self.mouth.astype(np.float32), self.labels)
+        np.testing.assert_array_equal(PairCorpus(self.corpus_dir).mouth[:], self.mouth)
+
+    def test_empty_corpus(self):
+        self._write(chunks=())
+        corpus = PairCorpus(self.corpus_dir)
+        self.assertEqual(len(corpus), 0)
+        self.assertEqual(list(corpus.batches(4)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Tests of the online hard pair selection.
+
+Run from code/training_evaluation:
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from auxiliary.pair_selection import DistanceMemory, legacy_select_pairs, select_pairs
+
+
+class SelectPairsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def _batch(self, batch_size=32):
+        labels = self.rng.randint(2, size=(batch_size, 1))
+        distance = self.rng.random_sample((batch_size, 1)) * 20
+        return distance, labels
+
+    def test_legacy_matches_the_former_loops(self):
+        for _ in range(20):
+            distance, labels = self._batch()
+            for margin in (-5, 0, 0.5, 2, 10):
+                self.assertEqual(select_pairs(distance, labels, 'legacy', margin).tolist(),
+                                 legacy_select_pairs(distance, labels, margin))
+
+    def test_legacy_without_genuine_pairs(self):
+        distance = np.array([[1.], [15.], [8.]])
+        labels = np.zeros((3, 1), dtype=np.int64)
+        self.assertEqual(select_pairs(distance, labels, 'legacy', 10).tolist(),
+                         legacy_select_pairs(distance, labels, 10))
+        self.assertEqual(select_pairs(distance, labels, 'legacy', 10).tolist(), [0, 2])
+
+    def test_semi_hard(self):
+        distance = np.array([2., 3., 1., 4., 9., 20.])
+        labels = np.array([1, 1, 0, 0, 0, 0])
+        # The impostors between the farthest genuine pair(3) and 3 + margin.
+        self.assertEqual(select_pairs(distance, labels, 'semi_hard', 2).tolist(), [0, 1, 3])
+        # The hardest impostor when none is semi-hard.
+        self.assertEqual(select_pairs(distance, labels, 'semi_hard', 0.5).tolist(), [0, 1, 2])
+
+    def test_hardest_k(self):
+        distance = np.array([2., 3., 1., 4., 9., 20., 4.])
+        labels = np.array([1, 1, 0, 0, 0, 0, 0])
+        # As many impostors as genuine pairs by default, the earlier one first for equal distances.
+        self.assertEqual(select_pairs(distance, labels, 'hardest_k').tolist(), [0, 1, 2, 3])
+        self.assertEqual(select_pairs(distance, labels, 'hardest_k', hardest_k=3).tolist(), [0, 1, 2, 3, 6])
+        self.assertEqual(select_pairs(distance, labels, 'hardest_k', hardest_k=100).tolist(), list(range(7)))
+
+    def test_genuine_pairs_are_always_kept(self):
+        for strategy in ('legacy', 'semi_hard', 'hardest_k'):
+            distance, labels = self._batch()
+            selected = select_pairs(distance, labels, strategy, hard_margin=1)
+            self.assertTrue(set(np.flatnonzero(labels[:, 0] == 1)) <= set(selected.tolist()))
+            self.assertEqual(selected.tolist(), sorted(selected.tolist()))
+
+    def test_unknown_strategy(self):
+        distance, labels = self._batch()
+        self.assertRaises(ValueError, select_pairs, distance, labels, 'hardest')
+
+
+class DistanceMemoryTest(unittest.TestCase):
+
+    def test_unknown_pairs_are_selected(self):
+        memory = DistanceMemory(10)
+        labels = np.array([1, 0, 0, 1])
+        self.assertEqual(memory.select(np.array([0, 3, 5, 7]), labels, epoch=0).tolist(), [0, 1, 2, 3])
+
+    def test_remembered_distances_select_the_pairs(self):
+        memory = DistanceMemory(10, max_age=2)
+        rows = np.array([0, 3, 5, 7])
+        labels = np.array([1, 0, 0, 1])
+        memory.update(rows, np.array([[2.], [30.], [5.], [3.]]), epoch=0)
+        selected = memory.select(rows, labels, epoch=1, strategy='legacy', hard_margin=10)
+        self.assertEqual(selected.tolist(),
+                         select_pairs(np.array([2., 30., 5., 3.]), labels, 'legacy', 10).tolist())
+        self.assertEqual(selected.tolist(), [0, 2, 3])
+
+    def test_stale_distances_are_measured_again(self):
+        memory = DistanceMemory(10, max_age=2)
+        rows = np.array([0, 3, 5, 7])
+        labels = np.array([1, 0, 0, 1])
+        memory.update(rows, np.array([2., 30., 5., 3.]), epoch=0)
+        memory.update(rows[:2], np.array([2., 30.]), epoch=3)
+        # Rows 5 and 7 are 3 epochs old, so they are selected whatever their distance.
+        self.assertEqual(memory.select(rows, labels, epoch=3, strategy='legacy', hard_margin=10).tolist(),
+                         [0, 2, 3])
+        self.assertEqual(memory.select(rows, labels, epoch=3, strategy='legacy', hard_margin=1).tolist(),
+                         [0, 2, 3])
+        memory.update(rows[2:], np.array([50., 3.]), epoch=3)
+        self.assertEqual(memory.select(rows, labels, epoch=3, strategy='legacy', hard_margin=1).tolist(),
+                         [0, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
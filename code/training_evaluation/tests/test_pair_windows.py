@@ -0,0 +1,85 @@
+"""
+Tests of the aligned sliding windows of a clip.
+
+Run from code/training_evaluation:
+    python -m unittest discover -s tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from datasets.pair_windows import PairWindows, hop_frames, sliding_windows
+
+
+class PairWindowsTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # A 2s clip.
+        self.speech = rng.randn(100, 40, 3).astype(np.float32)
+        self.mouth = rng.randint(256, size=(60, 60, 100)).astype(np.uint8)
+
+    def test_sliding_windows(self):
+        frames = np.arange(10 * 2).reshape((10, 2))
+        windows = sliding_windows(frames, 3, 2)
+        self.assertEqual(windows.shape, (4, 3, 2))
+        for i in range(4):
+            np.testing.assert_array_equal(windows[i], frames[2 * i:2 * i + 3])
+        self.assertFalse(windows.flags.writeable)
+        self.assertEqual(sliding_windows(frames, 11, 1).shape, (0, 11, 2))
+
+    def test_hop_frames(self):
+        self.assertEqual(hop_frames(0.1), (5, 3))
+        self.assertEqual(hop_frames(0.3), (15, 9))
+        self.assertRaises(ValueError, hop_frames, 0.05)
+        self.assertRaises(ValueError, hop_frames, 0)
+
+    def test_windows_are_aligned(self):
+        pairs = PairWindows(self.speech, self.mouth, hop=0.1)
+        # (100 - 15) // 5 + 1 speech windows and (60 - 9) // 3 + 1 mouth windows.
+        self.assertEqual(len(pairs), 18)
+        np.testing.assert_allclose(pairs.times, np.arange(18) * 0.1)
+        for i in (0, 7, 17):
+            speech, mouth = pairs[i]
+            self.assertEqual(speech.shape, (15, 40, 1, 3))
+            self.assertEqual(mouth.shape, (9, 60, 100, 1))
+            np.testing.assert_array_equal(speech[:, :, 0, :], self.speech[5 * i:5 * i + 15])
+            np.testing.assert_array_equal(mouth[:, :, :, 0], self.mouth[3 * i:3 * i + 9])
+        # The windows are views of the clip.
+        self.assertTrue(np.may_share_memory(pairs.speech, self.speech))
+
+    def test_activation(self):
+        activation = np.ones((60,), dtype=np.uint8)
+        activation[10] = 0
+        pairs = PairWindows(self.speech, self.mouth, activation, hop=0.1)
+        # The windows of the mouth frames [3i, 3i + 9) which hold the frame 10.
+        self.assertEqual(np.flatnonzero(~pairs.valid).tolist(), [1, 2, 3])
+
+        batches = list(pairs.batches(8))
+        self.assertEqual([speech.shape[0] for speech, _ in batches], [8, 7])
+        speech, mouth = batches[0]
+        self.assertEqual(speech.dtype, np.float32)
+        np.testing.assert_array_equal(mouth[1, :, :, :, 0], self.mouth[12:21])
+        self.assertEqual(sum(speech.shape[0] for speech, _ in pairs.batches(8, valid_only=False)), 18)
+
+    def test_from_mouth_store(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'mouth.npz')
+            activation = np.ones((60,), dtype=np.uint8)
+            activation[50] = 0
+            np.savez_compressed(path, mouth=self.mouth[:, :, :, None], activation=activation)
+            pairs = PairWindows.from_mouth_store(self.speech, path, hop=0.3)
+            self.assertEqual(len(pairs), 6)
+            self.assertEqual(pairs.valid.tolist(), [True] * 5 + [False])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
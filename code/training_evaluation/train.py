@@ -5,12 +5,15 @@ from __future__ import print_function
 import tensorflow as tf
 
 import sys
+import time
 import numpy as np
 from sklearn.model_selection import KFold
 from tensorflow.python.ops import control_flow_ops
 from nets import nets_factory
 from auxiliary import losses
+from auxiliary import pair_selection
 from roc_curve import calculate_roc
+from datasets.input_data import describe_data, load_data
 import os
 
 slim = tf.contrib.slim
@@ -117,6 +120,61 @@ tf.app.flags.DEFINE_integer(
 tf.app.flags.DEFINE_integer(
     'num_epochs', 1, 'The number of epochs for training.')
 
+tf.app.flags.DEFINE_string(
+    'train_corpus', None,
+    'Directory of the memory-mapped training corpus(refer to datasets/pair_corpus.py), random data by default.')
+
+tf.app.flags.DEFINE_string(
+    'test_corpus', None,
+    'Directory of the memory-mapped testing corpus(refer to datasets/pair_corpus.py), random data by default.')
+
+tf.app.flags.DEFINE_string(
+    'input_pipeline', 'feed_dict',
+    'How the training batches are fed to the networks, one of "feed_dict" (the NumPy batches are fed at each step)'
+    ' or "dataset" (a tf.data pipeline prepares and prefetches the batches into the graph).')
+
+tf.app.flags.DEFINE_integer(
+    'shuffle_buffer_size', 1000, 'The number of samples shuffled together by the "dataset" input pipeline.')
+
+tf.app.flags.DEFINE_integer(
+    'num_parallel_calls', 4, 'The number of samples prepared in parallel by the "dataset" input pipeline.')
+
+tf.app.flags.DEFINE_integer(
+    'prefetch_batches', 2, 'The number of batches prepared ahead of the training step by the "dataset" input pipeline.')
+
+tf.app.flags.DEFINE_boolean(
+    'online_pair_selection', True, 'Train on the hard pairs of each batch only.')
+
+tf.app.flags.DEFINE_string(
+    'pair_selection', 'legacy',
+    'The impostors kept by the online pair selection, one of "legacy", "semi_hard" or "hardest_k" (refer to'
+    ' auxiliary/pair_selection.py).')
+
+tf.app.flags.DEFINE_float(
+    'hard_margin', 10.0,
+    'The margin above the farthest genuine pair of the "legacy" and "semi_hard" pair selections.')
+
+tf.app.flags.DEFINE_integer(
+    'hardest_k', 0,
+    'The number of impostors kept by the "hardest_k" pair selection(0 for the number of genuine pairs).')
+
+tf.app.flags.DEFINE_string(
+    'mining_mode', 'two_pass',
+    'How the distances of the online pair selection are measured, one of "two_pass"(a forward pass before the'
+    ' training step), "memory"(the distances of the previous epochs, refer to auxiliary/pair_selection.py) or'
+    ' "in_graph"(the easy impostors are zero-weighted in the loss of the training step).')
+
+tf.app.flags.DEFINE_boolean(
+    'fixed_batch_shape', False,
+    'Feed the whole batch with zero loss and batch normalization weights for the pairs left out by the online'
+    ' pair selection of the "two_pass" or "memory" mining, instead of a batch of the selected pairs only(the batches'
+    ' keep the same shape at each step). Off by default: the whole batch is back-propagated, which raised the mean'
+    ' step time by about 60% on a CPU for a lower variation(refer to the README).')
+
+tf.app.flags.DEFINE_integer(
+    'mining_memory_epochs', 3,
+    'The number of epochs after which a remembered distance of the "memory" mining is measured again.')
+
 
 #####################
 # Fine-Tuning Flags #
@@ -248,6 +306,54 @@ def average_gradients(tower_grads):
     return average_grads
 
 
+def _configure_input_pipeline(speech, mouth, labels):
+    """Configures the tf.data input pipeline of the training data.
+
+    The in-memory arrays are fed once to the placeholders of an initializable iterator(rather than being embedded in
+    the graph as constants). The samples are then shuffled, prepared in parallel, batched and prefetched, so the batch
+    of the next step is prepared while the current step runs. The memory-mapped arrays of a corpus are read batch by
+    batch instead(in a random order of the batches), so the corpus is never loaded as a whole.
+
+    Args:
+      speech: The speech array.
+      mouth: The mouth array.
+      labels: The label array.
+
+    Returns:
+      The iterator over the (speech, mouth, labels) batches and the feed_dict of its initializer.
+    """
+    def _prepare(speech_sample, mouth_sample, label):
+        return tf.cast(speech_sample, tf.float32), tf.cast(mouth_sample, tf.float32), tf.cast(label, tf.uint8)
+
+    if not isinstance(speech, np.ndarray):
+        num_batches = len(labels) // FLAGS.batch_size
+
+        def _batches():
+            for batch_num in np.random.permutation(num_batches):
+                start = batch_num * FLAGS.batch_size
+                yield (speech[start:start + FLAGS.batch_size], mouth[start:start + FLAGS.batch_size],
+                       labels[start:start + FLAGS.batch_size])
+
+        dataset = tf.data.Dataset.from_generator(
+            _batches, (tf.as_dtype(speech.dtype), tf.as_dtype(mouth.dtype), tf.as_dtype(labels.dtype)),
+            (tf.TensorShape((None,) + speech.shape[1:]), tf.TensorShape((None,) + mouth.shape[1:]),
+             tf.TensorShape((None,) + labels.shape[1:])))
+        dataset = dataset.repeat().map(_prepare, num_parallel_calls=FLAGS.num_parallel_calls)
+        iterator = dataset.prefetch(FLAGS.prefetch_batches).make_initializable_iterator()
+        return iterator, {}
+
+    speech_placeholder = tf.placeholder(tf.as_dtype(speech.dtype), speech.shape)
+    mouth_placeholder = tf.placeholder(tf.as_dtype(mouth.dtype), mouth.shape)
+    labels_placeholder = tf.placeholder(tf.as_dtype(labels.dtype), labels.shape)
+
+    dataset = tf.data.Dataset.from_tensor_slices((speech_placeholder, mouth_placeholder, labels_placeholder))
+    dataset = dataset.shuffle(FLAGS.shuffle_buffer_size).repeat()
+    dataset = dataset.map(_prepare, num_parallel_calls=FLAGS.num_parallel_calls)
+    dataset = dataset.batch(FLAGS.batch_size).prefetch(FLAGS.prefetch_batches)
+    iterator = dataset.make_initializable_iterator()
+    return iterator, {speech_placeholder: speech, mouth_placeholder: mouth, labels_placeholder: labels}
+
+
 def _get_variables_to_train():
     """Returns a list of variables to train.
 
@@ -269,15 +375,6 @@ def _get_variables_to_train():
 # Definign arbitrary data
 num_training_samples = 1000
 num_testing_samples = 1000
-train_data = {}
-
-train_data = {'mouth': np.random.random_sample(size=(num_training_samples, 9, 60, 100, 1)),
-              'speech': np.random.random_sample(size=(num_training_samples, 15, 40, 1, 3))}
-test_data = {'mouth': np.random.random_sample(size=(num_testing_samples, 9, 60, 100, 1)),
-             'speech': np.random.random_sample(size=(num_testing_samples, 15, 40, 1, 3))}
-
-train_label = np.random.randint(2, size=(num_training_samples, 1))
-test_label = np.random.randint(2, size=(num_testing_samples, 1))
 
 
 # # Uncomment if data standardalization is required and the mean and std vectors have been calculated.
@@ -314,6 +411,9 @@ def main(_):
 
     tf.logging.set_verbosity(tf.logging.INFO)
 
+    train_data, train_label = load_data(FLAGS.train_corpus, num_training_samples)
+    test_data, test_label = load_data(FLAGS.test_corpus, num_testing_samples)
+
     graph = tf.Graph()
     with graph.as_default(), tf.device('/cpu:0'):
         ######################
@@ -326,6 +426,7 @@ def main(_):
 
         num_samples_per_epoch_test = test_data['mouth'].shape[0]
         num_batches_per_epoch_test = int(num_samples_per_epoch_test / FLAGS.batch_size)
+        print("Input data: training %s, testing %s" % (describe_data(train_data), describe_data(test_data)))
 
         # Create global_step
         global_step = tf.Variable(0, name='global_step', trainable=False)
@@ -365,28 +466,59 @@ def main(_):
         # with tf.device(deploy_config.inputs_device()):
         """
         Define the place holders and creating the batch tensor.
+        With the "dataset" input pipeline, the place holders default to the batches of the pipeline and are only
+        fed with the selected pairs.
         """
+        if FLAGS.input_pipeline == 'dataset':
+            iterator, iterator_feed_dict = _configure_input_pipeline(train_data['speech'], train_data['mouth'],
+                                                                     train_label)
+            next_speech, next_mouth, next_labels = iterator.get_next()
+        elif FLAGS.input_pipeline != 'feed_dict':
+            raise ValueError('Input pipeline [%s] was not recognized' % FLAGS.input_pipeline)
+        if FLAGS.mining_mode not in ('two_pass', 'memory', 'in_graph'):
+            raise ValueError('Mining mode [%s] was not recognized' % FLAGS.mining_mode)
+        if FLAGS.online_pair_selection and FLAGS.mining_mode == 'memory' and FLAGS.input_pipeline == 'dataset':
+            raise ValueError('The "memory" mining needs the indices of the pairs(--input_pipeline=feed_dict)')
+        if FLAGS.online_pair_selection and FLAGS.mining_mode == 'in_graph' and FLAGS.fixed_batch_shape:
+            # The in-graph weights come from the distances of the training pass, so they cannot weight its own batch
+            # normalization moments.
+            raise ValueError('--fixed_batch_shape applies to the host pair selection, not to the "in_graph" mining')
+
+        # The pairs are selected on the host before the training step, except by the "in_graph" mining.
+        host_selection = FLAGS.online_pair_selection and FLAGS.mining_mode != 'in_graph'
 
         # Mouth spatial set
         INPUT_SEQ_LENGTH = 9
         INPUT_HEIGHT = 60
         INPUT_WIDTH = 100
         INPUT_CHANNELS = 1
-        batch_mouth = tf.placeholder(tf.float32, shape=(
-            [None, INPUT_SEQ_LENGTH, INPUT_HEIGHT, INPUT_WIDTH, INPUT_CHANNELS]))
+        mouth_shape = [None, INPUT_SEQ_LENGTH, INPUT_HEIGHT, INPUT_WIDTH, INPUT_CHANNELS]
+        if FLAGS.input_pipeline == 'dataset':
+            batch_mouth = tf.placeholder_with_default(next_mouth, shape=mouth_shape)
+        else:
+            batch_mouth = tf.placeholder(tf.float32, shape=mouth_shape)
 
         # Speech spatial set
         INPUT_SEQ_LENGTH_SPEECH = 15
         INPUT_HEIGHT_SPEECH = 40
         INPUT_WIDTH_SPEECH = 1
         INPUT_CHANNELS_SPEECH = 3
-        batch_speech = tf.placeholder(tf.float32, shape=(
-            [None, INPUT_SEQ_LENGTH_SPEECH, INPUT_HEIGHT_SPEECH, INPUT_WIDTH_SPEECH, INPUT_CHANNELS_SPEECH]))
+        speech_shape = [None, INPUT_SEQ_LENGTH_SPEECH, INPUT_HEIGHT_SPEECH, INPUT_WIDTH_SPEECH, INPUT_CHANNELS_SPEECH]
+        if FLAGS.input_pipeline == 'dataset':
+            batch_speech = tf.placeholder_with_default(next_speech, shape=speech_shape)
+        else:
+            batch_speech = tf.placeholder(tf.float32, shape=speech_shape)
 
         # Label
-        batch_labels = tf.placeholder(tf.uint8, (None, 1))
+        if FLAGS.input_pipeline == 'dataset':
+            batch_labels = tf.placeholder_with_default(next_labels, shape=(None, 1))
+        else:
+            batch_labels = tf.placeholder(tf.uint8, (None, 1))
         margin_imp_tensor = tf.placeholder(tf.float32, ())
 
+        # The loss weights of the pairs, fed with the mask of the selected pairs by --fixed_batch_shape.
+        pair_weights = tf.placeholder_with_default(tf.ones_like(tf.cast(batch_labels, tf.float32)), shape=(None, 1))
+
         ################################
         ## Feed forwarding to network ##
         ################################
@@ -406,8 +538,12 @@ def main(_):
                         ######## Outputs of two networks #######
                         ########################################
 
-                        logits_speech, end_points_speech = network_speech_fn(batch_speech)
-                        logits_mouth, end_points_mouth = network_mouth_fn(batch_mouth)
+                        # With --fixed_batch_shape the pairs left out by the selection are also kept out of the
+                        # moments of the batch normalization(zero batch weights), as if they were not fed.
+                        batch_norm_weights = tf.reshape(pair_weights, [-1]) if FLAGS.fixed_batch_shape else None
+                        with slim.arg_scope([slim.batch_norm], batch_weights=batch_norm_weights):
+                            logits_speech, end_points_speech = network_speech_fn(batch_speech)
+                            logits_mouth, end_points_mouth = network_mouth_fn(batch_mouth)
 
                         # # Uncomment if the output embedding is desired to be as |f(x)| = 1
                         # logits_speech = tf.nn.l2_normalize(logits_speech, dim=1, epsilon=1e-12, name=None)
@@ -428,8 +564,16 @@ def main(_):
                             tf.reduce_sum(tf.pow(tf.subtract(logits_speech, logits_mouth), 2), 1, keepdims=True))
 
                         ##### Contrastive loss ######
+                        # The "in_graph" mining zero-weights the easy impostors in the training step itself.
+                        if FLAGS.online_pair_selection and FLAGS.mining_mode == 'in_graph':
+                            weights = losses.hard_pair_weights(batch_labels, distance_l2,
+                                                               strategy=FLAGS.pair_selection,
+                                                               hard_margin=FLAGS.hard_margin,
+                                                               hardest_k=FLAGS.hardest_k)
+                        else:
+                            weights = pair_weights
                         loss = losses.contrastive_loss(batch_labels, distance_l2, margin_imp=margin_imp_tensor,
-                                                       scope=scope)
+                                                       weights=weights, scope=scope)
 
                         # ##### call the optimizer ######
                         # # TODO: call optimizer object outside of this gpu environment
@@ -504,6 +648,8 @@ def main(_):
         coord = tf.train.Coordinator()
         sess.run(tf.global_variables_initializer())
         sess.run(tf.local_variables_initializer())
+        if FLAGS.input_pipeline == 'dataset':
+            sess.run(iterator.initializer, feed_dict=iterator_feed_dict)
 
         # # Restore the model
         # saver.restore(sess, '/home/sina/TRAIN_LIPREAD/train_logs-1366')
@@ -516,82 +662,99 @@ def main(_):
         #####################################
 
         step = 1
+        if host_selection and FLAGS.mining_mode == 'memory':
+            distance_memory = pair_selection.DistanceMemory(num_samples_per_epoch, FLAGS.mining_memory_epochs)
         for epoch in range(FLAGS.num_epochs):
+            epoch_start_time = time.time()
+            selection_seconds = 0.0
+            step_seconds = np.zeros((num_batches_per_epoch,))
 
             # Loop over all batches
 
             for batch_num in range(num_batches_per_epoch):
                 step += 1
-                start_idx = batch_num * FLAGS.batch_size
-                end_idx = (batch_num + 1) * FLAGS.batch_size
-                speech_train, mouth_train, label_train = train_data['speech'][start_idx:end_idx], train_data['mouth'][
-                                                                                                  start_idx:end_idx], train_label[
-                                                                                                                      start_idx:end_idx]
-
-                # # # Standardalization for speech if necessary
-                # speech_train = (speech_train - mean_speech) / std_speech
-                #
-                # # # Standardalization  for visual if necessary
-                # mouth_train = (mouth_train - mean_mouth) / std_mouth
+                step_start_time = time.time()
+                if FLAGS.input_pipeline == 'dataset':
+                    if host_selection:
+                        # The batch is fetched with its distances(a single step of the iterator), the selected
+                        # pairs are then fed.
+                        speech_train, mouth_train, label_train, distance = sess.run(
+                            [batch_speech, batch_mouth, batch_labels, distance_l2], feed_dict={is_training: False})
+                else:
+                    start_idx = batch_num * FLAGS.batch_size
+                    end_idx = (batch_num + 1) * FLAGS.batch_size
+                    speech_train = train_data['speech'][start_idx:end_idx]
+                    mouth_train = train_data['mouth'][start_idx:end_idx]
+                    label_train = train_label[start_idx:end_idx]
+
+                    # # # Standardalization for speech if necessary
+                    # speech_train = (speech_train - mean_speech) / std_speech
+                    #
+                    # # # Standardalization  for visual if necessary
+                    # mouth_train = (mouth_train - mean_mouth) / std_mouth
+
+                    if host_selection and FLAGS.mining_mode == 'two_pass':
+                        distance = sess.run(
+                            distance_l2,
+                            feed_dict={is_training: False, batch_speech: speech_train,
+                                       batch_mouth: mouth_train,
+                                       batch_labels: label_train.reshape([FLAGS.batch_size, 1])})
 
                 #########################################################################
                 ################## Online Pair Selection Algorithm ######################
                 #########################################################################
-                online_pair_selection = True
-                if online_pair_selection:
-                    distance = sess.run(
-                        distance_l2,
-                        feed_dict={is_training: False, batch_speech: speech_train,
-                                   batch_mouth: mouth_train,
-                                   batch_labels: label_train.reshape([FLAGS.batch_size, 1])})
-                    label_keep = []
-
-                    ###############################
-                    hard_margin = 10
-
-                    # Max-Min distance in genuines
-                    max_gen = 0
-                    min_gen = 100
-                    for j in range(label_train.shape[0]):
-                        if label_train[j] == 1:
-                            if max_gen < distance[j, 0]:
-                                max_gen = distance[j, 0]
-                            if min_gen > distance[j, 0]:
-                                min_gen = distance[j, 0]
-
-                    # Min-Max distance in impostors
-                    min_imp = 100
-                    max_imp = 0
-                    for k in range(label_train.shape[0]):
-                        if label_train[k] == 0:
-                            if min_imp > distance[k, 0]:
-                                min_imp = distance[k, 0]
-                            if max_imp < distance[k, 0]:
-                                max_imp = distance[k, 0]
-
+                if host_selection:
                     ### Keeping hard impostors and genuines
-                    for i in range(label_train.shape[0]):
-                        # imposter
-                        if label_train[i] == 0:
-                            if distance[i, 0] < max_gen + hard_margin:
-                                label_keep.append(i)
-                        elif label_train[i] == 1:
-                            # if distance[i, 0] > min_imp - hard_margin:
-                            label_keep.append(i)
+                    selection_start_time = time.time()
+                    if FLAGS.mining_mode == 'memory':
+                        label_keep = distance_memory.select(np.arange(start_idx, end_idx), label_train, epoch,
+                                                            strategy=FLAGS.pair_selection,
+                                                            hard_margin=FLAGS.hard_margin,
+                                                            hardest_k=FLAGS.hardest_k)
+                    else:
+                        label_keep = pair_selection.select_pairs(distance, label_train,
+                                                                 strategy=FLAGS.pair_selection,
+                                                                 hard_margin=FLAGS.hard_margin,
+                                                                 hardest_k=FLAGS.hardest_k)
+                    selection_seconds += time.time() - selection_start_time
+                    if not len(label_keep):
+                        # Nothing to train on(an empty mask would also give NaN batch normalization moments).
+                        print("Epoch " + str(epoch + 1) + ", Minibatch " + str(batch_num + 1) +
+                              " of %d , no pair selected, the step is skipped" % num_batches_per_epoch)
+                        step_seconds[batch_num] = time.time() - step_start_time
+                        continue
 
                     #### Choosing the pairs ######
-                    speech_train = speech_train[label_keep]
-                    mouth_train = mouth_train[label_keep]
-                    label_train = label_train[label_keep]
+                    if FLAGS.fixed_batch_shape:
+                        weights_train = np.zeros((label_train.shape[0], 1), dtype=np.float32)
+                        weights_train[label_keep] = 1
+                    else:
+                        speech_train = speech_train[label_keep]
+                        mouth_train = mouth_train[label_keep]
+                        label_train = label_train[label_keep]
 
                 ############################################
                 #### Running the training operation ########
-                _, loss_value, score_dissimilarity, summary, training_step, _ = sess.run(
-                    [train_op, loss, distance_l2, summary_op, global_step, is_training],
-                    feed_dict={is_training: True, margin_imp_tensor: 100,
-                               batch_speech: speech_train, batch_mouth: mouth_train,
-                               batch_labels: label_train.reshape([label_train.shape[0], 1])})
-                summary_writer.add_summary(summary, epoch * num_batches_per_epoch + i)
+                # Without the host pair selection, the "dataset" input pipeline feeds the training operation directly.
+                feed_dict = {is_training: True, margin_imp_tensor: 100}
+                if FLAGS.input_pipeline == 'feed_dict' or host_selection:
+                    feed_dict.update({batch_speech: speech_train, batch_mouth: mouth_train,
+                                      batch_labels: label_train.reshape([label_train.shape[0], 1])})
+                if host_selection and FLAGS.fixed_batch_shape:
+                    feed_dict[pair_weights] = weights_train
+                _, loss_value, score_dissimilarity, summary, training_step, _, label_train = sess.run(
+                    [train_op, loss, distance_l2, summary_op, global_step, is_training, batch_labels],
+                    feed_dict=feed_dict)
+                summary_writer.add_summary(summary, epoch * num_batches_per_epoch + batch_num)
+                step_seconds[batch_num] = time.time() - step_start_time
+                if host_selection and FLAGS.fixed_batch_shape:
+                    # The metrics are calculated on the selected pairs(the whole batch has been measured).
+                    if FLAGS.mining_mode == 'memory':
+                        distance_memory.update(np.arange(start_idx, end_idx), score_dissimilarity, epoch)
+                    label_train = label_train[label_keep]
+                    score_dissimilarity = score_dissimilarity[label_keep]
+                elif host_selection and FLAGS.mining_mode == 'memory':
+                    distance_memory.update(start_idx + label_keep, score_dissimilarity, epoch)
 
                 # try and error method is used to handle the error due to ROC calculation
                 try:
@@ -607,6 +770,26 @@ def main(_):
                     print("Error: " ,sys.exc_info()[0])
                     print("No contributing impostor pair!")
 
+            # Training throughput of the epoch.
+            epoch_seconds = time.time() - epoch_start_time
+            print("Epoch " + str(epoch + 1) + ", %d samples in %.2f seconds(%.1f samples/sec, %.2f steps/sec with the "
+                  "%s input pipeline)" % (num_batches_per_epoch * FLAGS.batch_size, epoch_seconds,
+                                          num_batches_per_epoch * FLAGS.batch_size / max(epoch_seconds, 1e-6),
+                                          num_batches_per_epoch / max(epoch_seconds, 1e-6), FLAGS.input_pipeline))
+            if FLAGS.online_pair_selection:
+                print("Epoch " + str(epoch + 1) + ", %s pair selection with the %s mining: %.2f ms per step, of which"
+                      " %.3f ms of host selection(%.2f%% of the epoch)" % (
+                          FLAGS.pair_selection, FLAGS.mining_mode,
+                          1000.0 * epoch_seconds / max(num_batches_per_epoch, 1),
+                          1000.0 * selection_seconds / max(num_batches_per_epoch, 1),
+                          100.0 * selection_seconds / max(epoch_seconds, 1e-6)))
+            print("Epoch " + str(epoch + 1) + ", step time: %.2f ms mean, %.2f ms std(%.1f%% variation), %.2f ms p95"
+                  " with %s batches" % (1000.0 * np.mean(step_seconds), 1000.0 * np.std(step_seconds),
+                                        100.0 * np.std(step_seconds) / max(np.mean(step_seconds), 1e-9),
+                                        1000.0 * np.percentile(step_seconds, 95),
+                                        'variable-size' if host_selection and not FLAGS.fixed_batch_shape
+                                        else 'fixed-shape'))
+
             # Save the model
             saver.save(sess, FLAGS.train_dir, global_step=training_step)
 